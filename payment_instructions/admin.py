@@ -1,10 +1,26 @@
+import hashlib
+import logging
+import os
+
 from django.contrib import admin
+from django.core.cache import cache
+from django.core.paginator import Paginator
 from django.db import models
 from django.utils import timezone
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.utils.html import format_html
-from django.core.exceptions import ValidationError
-from .models import User, PaymentRecipient, Payment, Specialist
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect
+from django.urls import path, reverse
+from django.utils.functional import cached_property
+from .models import User, PaymentRecipient, Payment, Specialist, ArchivedPayment, CompressionJob
+from .signals import invalidate_recipient_index
+from .utils.exports import stream_export, stream_proof_archive
+from .utils.proof_packs import open_proof
+from .utils.thumbnails import generate_thumbnail, thumbnail_version
+
+logger = logging.getLogger(__name__)
 
 
 @admin.register(User)
@@ -53,11 +69,12 @@ class UserAdmin(BaseUserAdmin):
 @admin.register(PaymentRecipient)
 class PaymentRecipientAdmin(admin.ModelAdmin):
     list_display = (
-        'alias', 'max_amount_display', 'current_month_received', 'priority_order', 'is_recurring', 'is_active'
+        'alias', 'max_amount_display', 'current_month_received', 'remaining_amount', 'onetime_usage',
+        'priority_display', 'is_recurring', 'is_active'
     )
     list_filter = ('is_recurring', 'is_active', 'created_at')
     search_fields = ('name', 'alias', 'cbu')
-    ordering = ('priority_order', 'name')
+    ordering = ('sort_key', 'name')
     readonly_fields = ('created_at', 'updated_at', 'current_month_received', 'remaining_amount')
     
     fieldsets = (
@@ -73,7 +90,25 @@ class PaymentRecipientAdmin(admin.ModelAdmin):
         }),
     )
     
-    actions = ['activate_recipients', 'deactivate_recipients']
+    actions = ['activate_recipients', 'deactivate_recipients', 'renumber_priorities']
+
+    def get_queryset(self, request):
+        # Ledger totals come annotated so the columns below don't query once per row
+        qs = PaymentRecipient.objects.with_capacity(super().get_queryset(request))
+        # Visible priority is the position by sort key; stored numbers may lag until the next renumber
+        return PaymentRecipient.objects.with_rank(qs)
+
+    def get_object(self, request, object_id, from_field=None):
+        obj = super().get_object(request, object_id, from_field)
+        if obj is not None:
+            # Show the current position in the form so an untouched field keeps the recipient in place
+            obj.priority_order = obj.priority_rank
+        return obj
+
+    def priority_display(self, obj):
+        return obj.priority_rank
+    priority_display.short_description = 'Orden'
+    priority_display.admin_order_field = 'sort_key'
 
     def max_amount_display(self, obj):
         return f"${obj.max_amount}"
@@ -81,25 +116,42 @@ class PaymentRecipientAdmin(admin.ModelAdmin):
 
 
     def current_month_received(self, obj):
-        amount = obj.get_current_month_received()
+        amount = obj.month_received if hasattr(obj, 'month_received') else obj.get_current_month_received()
         return f"${amount}"
     current_month_received.short_description = 'Recibido'
+    current_month_received.admin_order_field = 'month_received'
     
     def remaining_amount(self, obj):
-        remaining = obj.get_remaining_amount()
+        remaining = obj.remaining if hasattr(obj, 'remaining') else obj.get_remaining_amount()
         return f"${remaining}"
     remaining_amount.short_description = 'Restante'
+    remaining_amount.admin_order_field = 'remaining'
+    
+    def onetime_usage(self, obj):
+        if obj.is_recurring:
+            return "-"
+        total = obj.total_received if hasattr(obj, 'total_received') else obj.get_total_received()
+        return "Usado" if total > 0 else "Disponible"
+    onetime_usage.short_description = 'Pago único'
+    onetime_usage.admin_order_field = 'total_received'
     
     def activate_recipients(self, request, queryset):
         updated = queryset.update(is_active=True)
+        invalidate_recipient_index()
         self.message_user(request, f"Activated {updated} recipients.")
     activate_recipients.short_description = "Activar seleccionados"
     
     def deactivate_recipients(self, request, queryset):
         updated = queryset.update(is_active=False)
+        invalidate_recipient_index()
         self.message_user(request, f"Deactivated {updated} recipients.")
     deactivate_recipients.short_description = "Desactivar seleccionados"
     
+    def renumber_priorities(self, request, queryset):
+        renumbered = PaymentRecipient.objects.renumber()
+        self.message_user(request, f"Renumbered {renumbered} recipients.")
+    renumber_priorities.short_description = "Renumerar prioridades (todos)"
+    
     def has_add_permission(self, request):
         if request.user.is_superuser:
             return True
@@ -165,40 +217,210 @@ class SpecialistAdmin(admin.ModelAdmin):
         return hasattr(request.user, 'role') and request.user.role == User.ADMINISTRATOR
 
 
+class AutocompleteFilter(admin.RelatedFieldListFilter):
+    """
+    Foreign key filter that lists only the selected object and finds the others through the admin
+    autocomplete view, instead of loading every related row into the sidebar.
+    The related model's admin needs search_fields.
+    """
+    template = 'admin/payment_instructions/autocomplete_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        super().__init__(field, request, params, model, model_admin, field_path)
+        self.app_label = model._meta.app_label
+        self.model_name = model._meta.model_name
+        self.field_name = field.name
+
+    def has_output(self):
+        return True
+
+    def field_choices(self, field, request, model_admin):
+        if not self.lookup_val:
+            return []
+        try:
+            return field.get_choices(include_blank=False, limit_choices_to={'pk__in': self.lookup_val})
+        except ValueError:
+            return []
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Paginator that remembers the row count of each query for COUNT_TIMEOUT seconds, so moving
+    between pages of a large changelist doesn't count the whole table every time
+    """
+    COUNT_TIMEOUT = 60
+
+    @cached_property
+    def count(self):
+        key = 'admin-count:' + hashlib.sha256(str(self.object_list.query).encode()).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = super().count
+            cache.set(key, count, self.COUNT_TIMEOUT)
+        return count
+
+
+class ProofFileMixin:
+    """Proof links go through the admin, which serves packed proofs from their monthly pack"""
+
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        urls = [
+            path(
+                '<int:object_id>/proof/',
+                self.admin_site.admin_view(self.proof_view),
+                name='%s_%s_proof' % info,
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def proof_view(self, request, object_id):
+        """Redirect to the proof file, or send it from its pack when it has been packed"""
+        if not self.has_view_or_change_permission(request):
+            raise PermissionDenied
+        obj = get_object_or_404(self.get_queryset(request), pk=object_id)
+        proof = obj.proof_of_payment_file
+        if not proof:
+            raise Http404
+        if proof.storage.exists(proof.name):
+            return redirect(proof.url)
+        try:
+            return FileResponse(open_proof(proof.name), filename=os.path.basename(proof.name))
+        except FileNotFoundError:
+            raise Http404
+
+    def proof_url(self, obj):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        return reverse('admin:%s_%s_proof' % info, args=[obj.pk])
+
+
+class PaymentExportMixin:
+    """Actions that stream the selected payments as CSV or XLSX, or their proofs as a ZIP, reading them in chunks"""
+
+    def export_payments(self, request, queryset, export_format):
+        chunks, content_type, timer = stream_export([queryset], export_format, request.build_absolute_uri('/'))
+
+        def logged(chunks):
+            yield from chunks
+            logger.info('Exported %s as %s', timer, export_format)
+
+        response = StreamingHttpResponse(logged(chunks), content_type=content_type)
+        filename = f"pagos_{timezone.localtime():%Y%m%d_%H%M}.{export_format}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    def export_csv(self, request, queryset):
+        return self.export_payments(request, queryset, 'csv')
+    export_csv.short_description = "Exportar a CSV"
+
+    def export_xlsx(self, request, queryset):
+        return self.export_payments(request, queryset, 'xlsx')
+    export_xlsx.short_description = "Exportar a Excel"
+
+    def download_proofs(self, request, queryset):
+        chunks, timer = stream_proof_archive(queryset)
+
+        def logged(chunks):
+            yield from chunks
+            logger.info('Archived the proofs of %s', timer)
+
+        response = StreamingHttpResponse(logged(chunks), content_type='application/zip')
+        filename = f"comprobantes_{timezone.localtime():%Y%m%d_%H%M}.zip"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+    download_proofs.short_description = "Descargar comprobantes (ZIP)"
+
+
 @admin.register(Payment)
-class PaymentAdmin(admin.ModelAdmin):
+class PaymentAdmin(PaymentExportMixin, ProofFileMixin, admin.ModelAdmin):
     list_display = (
         'id', 'amount_display', 'payment_recipient', 'operator_user', 
-        'has_proof', 'created_at',
+        'has_proof', 'proof_status', 'created_at',
+    )
+    list_filter = (
+        'created_at',
+        ('payment_recipient', AutocompleteFilter),
+        ('operator_user', AutocompleteFilter),
+        ('specialist', AutocompleteFilter),
+        'proof_status',
+        'compression_profile',
     )
-    list_filter = ('created_at', 'payment_recipient', 'operator_user', 'created_at')
+    list_select_related = ('payment_recipient', 'operator_user')
     search_fields = ('payment_recipient__name', 'payment_recipient__alias', 'operator_user__username', 'notes')
     ordering = ('-created_at',)
-    readonly_fields = ('created_at', 'preview_proof')
+    date_hierarchy = 'created_at'
+    actions = ['export_csv', 'export_xlsx', 'download_proofs']
+    paginator = CachedCountPaginator
+    # The unfiltered total would be a second COUNT over the whole table on every filtered page
+    show_full_result_count = False
+    readonly_fields = ('created_at', 'preview_proof', 'proof_status', 'compression_profile', 'size_display')
     
     fieldsets = (
         ('Payment Information', {
             'fields': ('amount', 'payment_recipient', 'specialist', 'operator_user', 'created_at',)
         }),
         ('Documentation', {
-            'fields': ('proof_of_payment_file', 'notes', 'preview_proof')
+            'fields': (
+                'proof_of_payment_file', 'proof_status', 'compression_profile', 'size_display', 'notes', 'preview_proof',
+            )
         }),
     )
+    
+    def size_display(self, obj):
+        if obj.original_size is None or obj.compressed_size is None:
+            return "-"
+        return f"{obj.original_size / 1024:.1f} KB → {obj.compressed_size / 1024:.1f} KB"
+    size_display.short_description = 'Tamaño'
+
+    class Media:
+        css = {'all': ('admin/css/vendor/select2/select2.css', 'admin/css/autocomplete.css')}
+        js = (
+            'admin/js/vendor/jquery/jquery.js',
+            'admin/js/vendor/select2/select2.full.js',
+            'admin/js/jquery.init.js',
+            'admin/js/autocomplete.js',
+            'payment_instructions/admin/autocomplete_filter.js',
+        )
+
+    def get_urls(self):
+        urls = [
+            path(
+                '<int:payment_id>/thumbnail/',
+                self.admin_site.admin_view(self.thumbnail_view, cacheable=True),
+                name='payment_instructions_payment_thumbnail',
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def thumbnail_view(self, request, payment_id):
+        """Serve the proof thumbnail, generating it on first use; URLs carry a version so it can be cached"""
+        if not self.has_view_or_change_permission(request):
+            raise PermissionDenied
+        payment = get_object_or_404(self.get_queryset(request), pk=payment_id)
+        if not payment.proof_of_payment_file:
+            raise Http404
+        try:
+            thumb_name = generate_thumbnail(payment.proof_of_payment_file.name)
+        except Exception:
+            raise Http404
+        response = FileResponse(payment.proof_of_payment_file.storage.open(thumb_name, 'rb'))
+        if request.GET.get('v') == thumbnail_version(payment.proof_of_payment_file.name):
+            response['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return response
+
+    def thumbnail_url(self, obj):
+        url = reverse('admin:payment_instructions_payment_thumbnail', args=[obj.pk])
+        return f"{url}?v={thumbnail_version(obj.proof_of_payment_file.name)}"
 
     def preview_proof(self, obj):
         """Show file preview inside admin form."""
-        if not obj or not obj.proof_of_payment_file:
+        if not obj or not obj.pk or not obj.proof_of_payment_file:
             return "Sin archivo"
 
-        url = obj.proof_of_payment_file.url
-
-        # For images → show thumbnail
-        if obj.proof_of_payment_file.name.lower().endswith((".jpg", ".jpeg", ".png", ".gif")):
-            return format_html('<img src="{}" style="max-height:200px; border-radius:8px;" />', url)
-
-        # For PDFs → simple link or icon (basic version)
+        # Thumbnail (first page for PDFs) linking to the full file
         return format_html(
-            '<a href="{}" target="_blank">📄 Ver PDF</a>', url
+            '<a href="{}" target="_blank"><img src="{}" style="max-height:200px; border-radius:8px;" /></a>',
+            self.proof_url(obj), self.thumbnail_url(obj)
         )
 
     preview_proof.short_description = "Vista previa"
@@ -210,8 +432,8 @@ class PaymentAdmin(admin.ModelAdmin):
     def has_proof(self, obj):
         if obj.proof_of_payment_file:
             return format_html(
-                '<a href="{}" target="_blank">Abrir archivo</a>',
-                obj.proof_of_payment_file.url
+                '<a href="{}" target="_blank"><img src="{}" alt="Abrir archivo" style="max-height:48px;" /></a>',
+                self.proof_url(obj), self.thumbnail_url(obj)
             )
         return "Sin archivo"
     has_proof.short_description = 'Comprobante'
@@ -238,7 +460,7 @@ class PaymentAdmin(admin.ModelAdmin):
         if 'payment_recipient' in form.base_fields:
             form.base_fields['payment_recipient'].queryset = PaymentRecipient.objects.filter(
                 is_active=True
-            ).order_by('priority_order', 'name')
+            ).order_by('sort_key', 'name')
         
         # Set operator_user to current user for new payments
         if 'operator_user' in form.base_fields and not obj:
@@ -276,6 +498,95 @@ class PaymentAdmin(admin.ModelAdmin):
             return True
         return hasattr(request.user, 'role') and request.user.role == User.ADMINISTRATOR
     
+@admin.register(ArchivedPayment)
+class ArchivedPaymentAdmin(PaymentExportMixin, ProofFileMixin, admin.ModelAdmin):
+    list_display = (
+        'id', 'amount_display', 'payment_recipient', 'operator_user',
+        'has_proof', 'created_at', 'archived_at',
+    )
+    list_select_related = ('payment_recipient', 'operator_user')
+    list_filter = ('created_at',)
+    search_fields = ('payment_recipient__name', 'payment_recipient__alias', 'operator_user__username', 'notes')
+    ordering = ('-created_at',)
+    date_hierarchy = 'created_at'
+    actions = ['export_csv', 'export_xlsx', 'download_proofs']
+
+    def amount_display(self, obj):
+        return f"${obj.amount}"
+    amount_display.short_description = 'Monto'
+
+    def has_proof(self, obj):
+        if obj.proof_of_payment_file:
+            return format_html(
+                '<a href="{}" target="_blank">Abrir archivo</a>',
+                self.proof_url(obj)
+            )
+        return "Sin archivo"
+    has_proof.short_description = 'Comprobante'
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        if request.user.is_superuser:
+            return qs
+        if hasattr(request.user, 'role') and request.user.role == User.ADMINISTRATOR:
+            return qs
+        return qs.filter(operator_user=request.user)
+
+    # Archived payments are read-only
+    def has_view_permission(self, request, obj=None):
+        return True
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 # Customize admin site headers
 admin.site.site_header = "Docta Dent - Clinica dental"
 admin.site.site_title = "Sistema de Instrucciones de pago"
+
+
+@admin.register(CompressionJob)
+class CompressionJobAdmin(admin.ModelAdmin):
+    list_display = (
+        'id', 'file_name', 'status', 'attempts', 'created_at', 'finished_at', 'latency_display',
+    )
+    list_filter = ('status', 'created_at')
+    search_fields = ('file_name', 'last_error')
+    ordering = ('-created_at',)
+    actions = ['retry_jobs']
+    
+    def latency_display(self, obj):
+        latency = obj.get_latency()
+        return f"{latency:.1f}s" if latency is not None else "-"
+    latency_display.short_description = 'Latencia'
+    
+    def changelist_view(self, request, extra_context=None):
+        if request.method == 'GET':
+            self.show_queue_stats(request)
+        return super().changelist_view(request, extra_context)
+    
+    def show_queue_stats(self, request):
+        stats = CompressionJob.objects.stats()
+        self.message_user(
+            request,
+            f"Pendientes: {stats['pending']} · En proceso: {stats['running']} · Fallidos: {stats['failed']} · "
+            f"Latencia media (última hora): {stats['avg_latency_seconds']:.1f}s"
+        )
+    
+    def retry_jobs(self, request, queryset):
+        requeued = CompressionJob.objects.retry(queryset)
+        self.message_user(request, f"Requeued {requeued} failed jobs.")
+    retry_jobs.short_description = "Reintentar fallidos"
+    
+    # Jobs are created by the payment views and updated by the worker
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -6,3 +6,5 @@ class PaymentInstructionsConfig(AppConfig):
     name = 'payment_instructions'
     verbose_name = 'Instrucciones de pago'
 
+    def ready(self):
+        from . import signals  # noqa: F401
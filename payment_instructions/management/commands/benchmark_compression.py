@@ -0,0 +1,126 @@
+import random
+import time
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+from PIL import Image, ImageDraw, ImageFilter
+from payment_instructions.utils.file_compression import FileCompressor, SizeTargetEncoder
+
+
+def make_receipt(rng, size, photo=False):
+    """Synthetic transfer receipt: header band, text-like lines and an amount box; optionally photographed"""
+    width, height = size
+    background = (255, 255, 255) if not photo else tuple(rng.randint(200, 235) for _ in range(3))
+    img = Image.new('RGB', size, background)
+    draw = ImageDraw.Draw(img)
+
+    header = tuple(rng.randint(0, 160) for _ in range(3))
+    draw.rectangle([0, 0, width, height // 10], fill=header)
+    line_height = max(height // 40, 8)
+    y = height // 8
+    while y < height - line_height * 2:
+        x = width // 12
+        # Words as dark blocks of random length, like rendered text at a distance
+        while x < width * 0.9:
+            word = rng.randint(width // 40, width // 8)
+            draw.rectangle([x, y, min(x + word, width - 1), y + line_height // 2], fill=(30, 30, 30))
+            x += word + width // 60
+        y += line_height * rng.choice([1, 1, 2])
+    draw.rectangle([width // 12, height // 2, width * 11 // 12, height // 2 + line_height * 3], outline=header, width=4)
+
+    if photo:
+        # Perspective-free but blurred and noisy, like a phone photo of a screen or paper
+        img = img.filter(ImageFilter.GaussianBlur(radius=max(width // 1000, 1)))
+        noise = Image.effect_noise(size, rng.randint(12, 30)).convert('RGB')
+        img = Image.blend(img, noise, 0.15)
+    return img
+
+
+def build_corpus(count, seed):
+    rng = random.Random(seed)
+    sizes = [((1080, 1920), False), ((1170, 2532), False), ((3024, 4032), True), ((2448, 3264), True), ((800, 1200), False)]
+    corpus = []
+    for index in range(count):
+        size, photo = sizes[index % len(sizes)]
+        output = BytesIO()
+        make_receipt(rng, size, photo).save(output, format='PNG' if not photo else 'JPEG', quality=95)
+        corpus.append((f'receipt_{index:03d}', output.getvalue()))
+    return corpus
+
+
+def prepare(content):
+    img = Image.open(BytesIO(content)).convert('RGB')
+    img.thumbnail((FileCompressor.MAX_WIDTH, FileCompressor.MAX_HEIGHT), Image.Resampling.LANCZOS)
+    return img
+
+
+def legacy_encode(img, target_bytes):
+    """The previous compress_image loop: quality -10 per pass, shrinking by 0.8 once quality is 50 or lower"""
+    quality = FileCompressor.JPEG_QUALITY
+    encodes = 0
+    output = BytesIO()
+    while quality > 30:
+        output = BytesIO()
+        img.save(output, format='JPEG', quality=quality, optimize=True)
+        encodes += 1
+        size_bytes = output.tell()
+        if size_bytes <= target_bytes:
+            break
+        quality -= 10
+        if quality <= 50 and size_bytes > target_bytes:
+            img = img.resize((int(img.width * 0.8), int(img.height * 0.8)), Image.Resampling.LANCZOS)
+    return output.tell(), encodes, img.size
+
+
+def target_encode(img, target_bytes):
+    encoder = SizeTargetEncoder(target_bytes)
+    output, size_bytes, img, _ = encoder.fit(img)
+    output.close()
+    return size_bytes, encoder.encodes, img.size
+
+
+class Command(BaseCommand):
+    help = 'Compare the size-targeting JPEG encoder with the previous quality loop on synthetic receipts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=20, help='Number of synthetic receipts')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for the corpus')
+        parser.add_argument(
+            '--target-kb',
+            type=int,
+            default=FileCompressor.TARGET_SIZE_KB,
+            help='Target size in KB',
+        )
+
+    def handle(self, *args, **options):
+        target_bytes = options['target_kb'] * 1024
+        corpus = build_corpus(options['count'], options['seed'])
+        self.stdout.write(f'{len(corpus)} synthetic receipts, target {options["target_kb"]} KB\n')
+
+        totals = {}
+        for label, encode in (('legacy', legacy_encode), ('size_target', target_encode)):
+            results = []
+            for name, content in corpus:
+                img = prepare(content)
+                started = time.perf_counter()
+                size_bytes, encodes, dimensions = encode(img, target_bytes)
+                elapsed = time.perf_counter() - started
+                results.append((size_bytes, encodes, elapsed, dimensions))
+                if options['verbosity'] > 1:
+                    self.stdout.write(
+                        f'  {label:<12} {name}: {size_bytes / 1024:6.1f} KB, {encodes} encodes, '
+                        f'{elapsed * 1000:7.1f} ms, {dimensions[0]}x{dimensions[1]}'
+                    )
+            totals[label] = results
+
+        self.stdout.write(f'{"":<12} {"avg KB":>8} {"over":>5} {"encodes":>8} {"ms/file":>8} {"avg px":>10}')
+        for label, results in totals.items():
+            count = len(results)
+            self.stdout.write(
+                f'{label:<12} '
+                f'{sum(r[0] for r in results) / count / 1024:8.1f} '
+                f'{sum(1 for r in results if r[0] > target_bytes):5d} '
+                f'{sum(r[1] for r in results) / count:8.2f} '
+                f'{sum(r[2] for r in results) / count * 1000:8.1f} '
+                f'{sum(r[3][0] * r[3][1] for r in results) / count:10.0f}'
+            )
@@ -0,0 +1,59 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from payment_instructions.models import MonthlySnapshot, ArchivedPayment, local_month_range
+
+
+class Command(BaseCommand):
+    help = 'Write monthly snapshots for closed months and optionally archive old payments'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--month',
+            help='Close a specific month (YYYY-MM) instead of every pending month',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Recompute the snapshot of --month even if it was already closed',
+        )
+        parser.add_argument(
+            '--archive-older-than',
+            type=int,
+            metavar='N',
+            help='Move payments from months more than N months ago into the archive table',
+        )
+
+    def handle(self, *args, **options):
+        if options['month']:
+            try:
+                month = datetime.strptime(options['month'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError('El mes debe tener el formato YYYY-MM.')
+            if month >= timezone.localdate().replace(day=1):
+                raise CommandError('Solo se pueden cerrar meses anteriores al actual.')
+            if MonthlySnapshot.objects.close_month(month, force=options['force']):
+                self.stdout.write(self.style.SUCCESS(f'Closed {month:%Y-%m}.'))
+            else:
+                self.stdout.write(f'{month:%Y-%m} was already closed (use --force to recompute).')
+        else:
+            closed = MonthlySnapshot.objects.close_pending_months()
+            if closed:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Closed {", ".join(f"{month:%Y-%m}" for month in closed)}.'
+                ))
+            else:
+                self.stdout.write('No pending months to close.')
+
+        months = options['archive_older_than']
+        if months is not None:
+            if months < 1:
+                raise CommandError('--archive-older-than must be at least 1.')
+            # Only whole months that are already closed are archived
+            MonthlySnapshot.objects.close_pending_months()
+            today = timezone.localdate()
+            index = today.year * 12 + today.month - 1 - months
+            cutoff, _ = local_month_range(index // 12, index % 12 + 1)
+            moved = ArchivedPayment.objects.archive_before(cutoff)
+            self.stdout.write(self.style.SUCCESS(f'Archived {moved} payments created before {cutoff:%Y-%m-%d}.'))
@@ -0,0 +1,46 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from payment_instructions.models import Payment, local_month_range
+
+
+class Command(BaseCommand):
+    help = 'Show proof storage savings per compression profile for one month'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--month',
+            help='Month to report (YYYY-MM); defaults to the current month',
+        )
+
+    def handle(self, *args, **options):
+        if options['month']:
+            try:
+                month = datetime.strptime(options['month'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError('El mes debe tener el formato YYYY-MM.')
+        else:
+            month = timezone.localdate()
+        start, end = local_month_range(month.year, month.month)
+        groups = Payment.get_compression_stats(start, end)
+
+        self.stdout.write(f'Proofs of {month:%Y-%m}')
+        self.stdout.write(f'{"profile":<18} {"payments":>8} {"original KB":>12} {"stored KB":>10} {"saved":>6}')
+        for group in groups + [self.total(groups)]:
+            original = group['original_size']
+            saved = group['saved_size'] / original * 100 if original else 0
+            self.stdout.write(
+                f'{group["label"]:<18} {group["payment_count"]:8d} {original / 1024:12.1f} '
+                f'{group["compressed_size"] / 1024:10.1f} {saved:5.1f}%'
+            )
+
+    @staticmethod
+    def total(groups):
+        return {
+            'label': 'Total',
+            **{
+                key: sum(group[key] for group in groups)
+                for key in ('payment_count', 'original_size', 'compressed_size', 'saved_size')
+            },
+        }
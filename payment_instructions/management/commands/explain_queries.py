@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from payment_instructions.utils.query_plans import explain, full_scans, hot_queries
+
+
+class Command(BaseCommand):
+    help = 'Print the query plan of every hot payment query and fail if any of them scans the whole table'
+
+    def handle(self, *args, **options):
+        failed = []
+        for label, query in hot_queries():
+            self.stdout.write(label)
+            for plan in explain(query):
+                for step in plan:
+                    self.stdout.write(f'  {step}')
+                if full_scans(plan):
+                    failed.append(label)
+
+        if failed:
+            raise CommandError(f"Consultas que recorren toda la tabla de pagos: {', '.join(failed)}.")
+        self.stdout.write(self.style.SUCCESS('Every hot query uses an index.'))
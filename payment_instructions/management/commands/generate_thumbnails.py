@@ -0,0 +1,63 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from payment_instructions.models import Payment, ArchivedPayment
+from payment_instructions.utils.thumbnails import generate_thumbnail
+
+
+def backfill_thumbnail(name, force):
+    """Runs in a pool process: filesystem only"""
+    try:
+        generate_thumbnail(name, force=force)
+        return name, None
+    except Exception as e:
+        return name, f'{type(e).__name__}: {e}'
+
+
+class Command(BaseCommand):
+    help = 'Generate missing thumbnails for stored proofs of payment'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Regenerate thumbnails that already exist',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=2,
+            help='Number of processes generating thumbnails',
+        )
+
+    def handle(self, *args, **options):
+        names = set()
+        for model in (Payment, ArchivedPayment):
+            names.update(
+                model.objects.exclude(proof_of_payment_file='')
+                .values_list('proof_of_payment_file', flat=True).distinct().order_by()
+            )
+        names = sorted(names)
+
+        workers = max(options['workers'], 1)
+        force = [options['force']] * len(names)
+        if workers == 1:
+            results = map(backfill_thumbnail, names, force)
+        else:
+            # Pool processes are forked from this one: they must not inherit open database connections
+            connections.close_all()
+            executor = ProcessPoolExecutor(max_workers=workers)
+            results = executor.map(backfill_thumbnail, names, force, chunksize=16)
+
+        failed = 0
+        for name, error in results:
+            if error:
+                failed += 1
+                self.stderr.write(f'  {name}: {error}')
+        if workers > 1:
+            executor.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Thumbnails ready for {len(names) - failed} of {len(names)} proofs.'
+        ))
@@ -0,0 +1,154 @@
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.utils import timezone
+from payment_instructions.models import CapacityExceeded, Payment, PaymentRecipient, Specialist, User
+
+
+def profiles():
+    """SQLite out of the box (rollback journal, deferred transactions, a connection per request) vs settings"""
+    return {
+        'default': {'pragmas': {'journal_mode': 'DELETE'}, 'options': {}, 'persistent': False},
+        'tuned': {
+            'pragmas': settings.SQLITE_PRAGMAS,
+            'options': settings.DATABASES['default'].get('OPTIONS', {}),
+            'persistent': True,
+        },
+    }
+
+
+def seed(recipients, payments):
+    """Create an operator, a specialist, recipients with room for every write and some history to read"""
+    operator = User.objects.create_user(username='load_operator', email='load@example.com')
+    specialist = Specialist.objects.create(name='Carga')
+    # Saved one by one so their sort keys are computed
+    created = [
+        PaymentRecipient.objects.create(
+            alias=f'load{number}', name=f'Carga {number}', max_amount=2 * 10 ** 9, priority_order=number
+        )
+        for number in range(recipients)
+    ]
+    now = timezone.now()
+    Payment.objects.bulk_create([
+        Payment(
+            amount=1000,
+            payment_recipient=created[number % recipients],
+            specialist=specialist,
+            operator_user=operator,
+            proof_of_payment_file='comprobantes/load.jpg',
+            created_at=now - timedelta(hours=number),
+        )
+        for number in range(payments)
+    ], batch_size=500)
+
+
+def run_worker(arguments):
+    """Runs in a forked process, like a gunicorn worker: a mix of reads and allocations for duration seconds"""
+    profile, duration, write_ratio, worker = arguments
+    settings.SQLITE_PRAGMAS = profile['pragmas']
+    connection.settings_dict['OPTIONS'] = dict(profile['options'])
+
+    rng = random.Random(worker)
+    operator = User.objects.get(username='load_operator')
+    specialist = Specialist.objects.get()
+    recipients = list(PaymentRecipient.objects.all())
+    reads = [
+        lambda: Payment.get_monthly_totals(),
+        lambda: list(PaymentRecipient.objects.get_available_recipients(1000)[:10]),
+        lambda: list(Payment.objects.filter(operator_user=operator).order_by('-created_at', '-pk')[:100]),
+    ]
+
+    counts = {'reads': 0, 'writes': 0, 'locked': 0}
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        write = rng.random() < write_ratio
+        try:
+            if write:
+                Payment.objects.allocate(
+                    amount=rng.randrange(100, 5000),
+                    payment_recipient=rng.choice(recipients),
+                    specialist=specialist,
+                    operator_user=operator,
+                    proof_of_payment_file='comprobantes/load.jpg',
+                )
+            else:
+                rng.choice(reads)()
+            counts['writes' if write else 'reads'] += 1
+        except CapacityExceeded:
+            counts['writes'] += 1
+        except OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            counts['locked'] += 1
+        if not profile['persistent']:
+            # What the end of every request does with CONN_MAX_AGE = 0
+            connection.close()
+    connection.close()
+    return counts
+
+
+class Command(BaseCommand):
+    help = 'Measure read/write throughput of concurrent workers on a scratch SQLite database, before and after tuning'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--profile',
+            choices=['default', 'tuned', 'both'],
+            default='both',
+            help='SQLite defaults, the tuned settings, or both one after the other',
+        )
+        parser.add_argument('--workers', type=int, default=3, help='Concurrent processes (gunicorn workers)')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds each profile runs')
+        parser.add_argument('--write-ratio', type=float, default=0.2, help='Share of operations that are payments')
+        parser.add_argument('--recipients', type=int, default=50, help='Recipients in the scratch database')
+        parser.add_argument('--payments', type=int, default=5000, help='Existing payments in the scratch database')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('La prueba de carga es solo para SQLite.')
+        if options['workers'] < 1 or not 0 <= options['write_ratio'] <= 1:
+            raise CommandError('--workers debe ser al menos 1 y --write-ratio estar entre 0 y 1.')
+        available = profiles()
+        names = ['default', 'tuned'] if options['profile'] == 'both' else [options['profile']]
+
+        self.stdout.write(f'{"profile":<8} {"workers":>7} {"reads/s":>9} {"writes/s":>9} {"locked":>7}')
+        for name in names:
+            counts = self.run(available[name], options)
+            self.stdout.write(
+                f"{name:<8} {options['workers']:7d} {counts['reads'] / options['duration']:9.1f} "
+                f"{counts['writes'] / options['duration']:9.1f} {counts['locked']:7d}"
+            )
+
+    def run(self, profile, options):
+        """Run the workers against a fresh scratch database (never the real one) with the given profile"""
+        original_name = connection.settings_dict['NAME']
+        original_pragmas = settings.SQLITE_PRAGMAS
+        with tempfile.TemporaryDirectory() as directory:
+            connections.close_all()
+            connection.settings_dict['NAME'] = os.path.join(directory, 'load_test.sqlite3')
+            settings.SQLITE_PRAGMAS = profile['pragmas']
+            try:
+                call_command('migrate', verbosity=0, interactive=False)
+                seed(options['recipients'], options['payments'])
+                # Forked workers must not share this process's connection
+                connections.close_all()
+                context = multiprocessing.get_context('fork')
+                arguments = [
+                    (profile, options['duration'], options['write_ratio'], worker)
+                    for worker in range(options['workers'])
+                ]
+                with context.Pool(options['workers']) as pool:
+                    results = pool.map(run_worker, arguments)
+            finally:
+                connections.close_all()
+                connection.settings_dict['NAME'] = original_name
+                settings.SQLITE_PRAGMAS = original_pragmas
+        return {key: sum(result[key] for result in results) for key in ('reads', 'writes', 'locked')}
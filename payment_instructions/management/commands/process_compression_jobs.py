@@ -0,0 +1,94 @@
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from payment_instructions.models import CompressionJob
+from payment_instructions.utils.compression_queue import process_jobs
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Compress queued proof-of-payment files in a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=min(os.cpu_count() or 1, 4),
+            help='Number of compression processes',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=2.0,
+            help='Seconds to wait before polling again when the queue is empty',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Process the jobs that are due now and exit',
+        )
+        parser.add_argument(
+            '--stats',
+            action='store_true',
+            help='Print queue depth and latency of recent jobs and exit',
+        )
+        parser.add_argument(
+            '--keep-days',
+            type=int,
+            default=7,
+            help='Delete completed jobs older than this many days',
+        )
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.print_stats()
+            return
+
+        workers = options['workers']
+        if workers < 1:
+            raise CommandError('--workers must be at least 1.')
+
+        # Pool processes are forked from this one: they must not inherit open database connections
+        connections.close_all()
+        processed = 0
+        executor = ProcessPoolExecutor(max_workers=workers)
+        try:
+            while True:
+                try:
+                    count = process_jobs(executor, limit=workers * 2)
+                except BrokenProcessPool:
+                    # Its jobs are already back in the queue; replace the pool and carry on
+                    logger.exception('Compression pool broke, starting a new one')
+                    executor.shutdown(wait=False)
+                    executor = ProcessPoolExecutor(max_workers=workers)
+                    continue
+                processed += count
+                if count:
+                    continue
+                if options['once']:
+                    break
+                CompressionJob.objects.purge(timedelta(days=options['keep_days']))
+                time.sleep(options['poll_interval'])
+        finally:
+            executor.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} compression jobs.'))
+
+    def print_stats(self):
+        stats = CompressionJob.objects.stats()
+        self.stdout.write(
+            f"Queue: {stats['pending']} pending, {stats['running']} running, "
+            f"{stats['failed']} failed, {stats['done']} done"
+        )
+        self.stdout.write(f"Oldest pending job: {stats['oldest_pending_seconds']:.1f}s")
+        self.stdout.write(
+            f"Last hour: {stats['recent_jobs']} jobs, avg wait {stats['avg_wait_seconds']:.2f}s, "
+            f"avg latency {stats['avg_latency_seconds']:.2f}s, p95 latency {stats['p95_latency_seconds']:.2f}s"
+        )
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from payment_instructions.models import RecipientMonthlyBalance, RecipientLifetimeBalance
+
+
+class Command(BaseCommand):
+    help = 'Verify or rebuild the recipient balance ledger from the Payment table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only report drift between the ledger and the payments, without modifying anything',
+        )
+
+    def handle(self, *args, **options):
+        if not options['verify']:
+            monthly_rows, lifetime_rows = RecipientMonthlyBalance.objects.rebuild()
+            self.stdout.write(self.style.SUCCESS(
+                f'Ledger rebuilt: {monthly_rows} monthly rows, {lifetime_rows} lifetime rows.'
+            ))
+            return
+
+        expected_monthly, expected_lifetime = RecipientMonthlyBalance.objects.compute_from_payments()
+        stored_monthly = {
+            (row['payment_recipient_id'], row['month']): row['received']
+            for row in RecipientMonthlyBalance.objects.values('payment_recipient_id', 'month', 'received')
+        }
+        stored_lifetime = dict(RecipientLifetimeBalance.objects.values_list('payment_recipient_id', 'received'))
+
+        drift = []
+        for (recipient_id, month) in sorted(set(expected_monthly) | set(stored_monthly)):
+            expected = expected_monthly.get((recipient_id, month), 0)
+            stored = stored_monthly.get((recipient_id, month), 0)
+            if expected != stored:
+                drift.append(f'  recipient {recipient_id} {month:%Y-%m}: ledger ${stored}, payments ${expected}')
+        for recipient_id in sorted(set(expected_lifetime) | set(stored_lifetime)):
+            expected = expected_lifetime.get(recipient_id, 0)
+            stored = stored_lifetime.get(recipient_id, 0)
+            if expected != stored:
+                drift.append(f'  recipient {recipient_id} lifetime: ledger ${stored}, payments ${expected}')
+
+        if drift:
+            self.stdout.write('\n'.join(drift))
+            raise CommandError(f'{len(drift)} balance(s) out of sync. Run without --verify to rebuild.')
+
+        self.stdout.write(self.style.SUCCESS('Ledger is in sync with payments.'))
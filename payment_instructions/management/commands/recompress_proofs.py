@@ -0,0 +1,145 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from payment_instructions.models import ProofBlob
+from payment_instructions.utils.cold_storage import cold_candidates, recompress_stored_proof, swap_in
+from payment_instructions.utils.proof_packs import pack_closed_months
+
+
+def recompress(path):
+    """Runs in a pool process: filesystem only"""
+    try:
+        return recompress_stored_proof(path), None
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'
+
+
+def default_checkpoint():
+    # Next to the database, outside the media tree that is backed up
+    return os.path.join(os.path.dirname(settings.DATABASES['default']['NAME']), 'recompress_checkpoint.json')
+
+
+class Command(BaseCommand):
+    help = 'Re-encode old proofs of payment with the cold storage profile and optionally pack closed months'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than',
+            type=int,
+            default=180,
+            metavar='DAYS',
+            help='Only proofs whose payments are all older than this many days',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=min(os.cpu_count() or 1, 4),
+            help='Number of compression processes',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='Proofs read and handed to the workers at a time; also how often the checkpoint is saved',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default=None,
+            help='File where progress is saved so an interrupted run resumes where it stopped',
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore the saved checkpoint and start from the first proof',
+        )
+        parser.add_argument(
+            '--pack',
+            action='store_true',
+            help='Afterwards, pack the proofs of closed months older than --older-than into one archive per month',
+        )
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if workers < 1 or options['batch_size'] < 1:
+            raise CommandError('--workers and --batch-size must be at least 1.')
+        cutoff = timezone.now() - timedelta(days=options['older_than'])
+        checkpoint = options['checkpoint'] or default_checkpoint()
+
+        state = self.load_checkpoint(checkpoint, options)
+        if state['last_name']:
+            self.stdout.write(f"Resuming after {state['last_name']}.")
+
+        if workers == 1:
+            executor = None
+        else:
+            # Pool processes are forked from this one: they must not inherit open database connections
+            connections.close_all()
+            executor = ProcessPoolExecutor(max_workers=workers)
+
+        storage = ProofBlob.storage()
+        try:
+            while True:
+                names = cold_candidates(cutoff, state['last_name'], options['batch_size'])
+                if not names:
+                    break
+                # One batch in flight at a time keeps memory bounded whatever the size of the backlog
+                paths = [storage.path(name) for name in names]
+                results = executor.map(recompress, paths) if executor else map(recompress, paths)
+                for name, (result, error) in zip(names, results):
+                    if error:
+                        state['failed'] += 1
+                        self.stderr.write(f'  {name}: {error}')
+                    elif result is None:
+                        state['skipped'] += 1
+                    else:
+                        state['reclaimed'] += swap_in(name, result)
+                        state['recompressed'] += 1
+                state['last_name'] = names[-1]
+                self.save_checkpoint(checkpoint, state)
+        finally:
+            if executor:
+                executor.shutdown()
+
+        # A complete pass needs no checkpoint; the next run starts over with the proofs that became old
+        if os.path.exists(checkpoint):
+            os.unlink(checkpoint)
+        self.stdout.write(self.style.SUCCESS(
+            f"Recompressed {state['recompressed']} proofs, reclaimed {state['reclaimed'] / 1024 / 1024:.1f} MB "
+            f"({state['skipped']} already small enough, {state['failed']} failed)."
+        ))
+
+        if options['pack']:
+            for pack_name, files, size in pack_closed_months(cutoff):
+                self.stdout.write(self.style.SUCCESS(f'Packed {files} proofs ({size / 1024:.0f} KB) into {pack_name}.'))
+
+    def load_checkpoint(self, path, options):
+        state = {
+            'older_than': options['older_than'],
+            'last_name': '',
+            'recompressed': 0,
+            'skipped': 0,
+            'failed': 0,
+            'reclaimed': 0,
+        }
+        if options['restart'] or not os.path.exists(path):
+            return state
+        with open(path) as checkpoint:
+            saved = json.load(checkpoint)
+        if saved.get('older_than') != options['older_than']:
+            self.stdout.write('Checkpoint was saved with a different --older-than; starting over.')
+            return state
+        state.update({key: saved[key] for key in state if key in saved})
+        return state
+
+    def save_checkpoint(self, path, state):
+        """Write the checkpoint to a temporary file and rename it, so a crash never leaves a partial one"""
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'w') as checkpoint:
+            json.dump(state, checkpoint)
+        os.replace(temporary_path, path)
@@ -1,5 +1,11 @@
+import copy
+import random
+import time
 from django.core.management.base import BaseCommand
 from payment_instructions.models import PaymentRecipient, Payment
+from payment_instructions.utils.allocation import (
+    STRATEGIES, get_available_capacity, consume_capacity,
+)
 from decimal import Decimal
 
 
@@ -12,20 +18,38 @@ class Command(BaseCommand):
             type=float,
             help='Test with specific amount',
         )
+        parser.add_argument(
+            '--strategy',
+            choices=list(STRATEGIES) + ['all'],
+            default='all',
+            help='Allocation strategy to test (default: compare all of them)',
+        )
+        parser.add_argument(
+            '--payments',
+            type=int,
+            default=200,
+            help='Number of simulated payments for the strategy comparison',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=1,
+            help='Random seed for the simulated payment amounts',
+        )
 
     def handle(self, *args, **options):
         self.stdout.write('Testing automatic recipient selection logic...\n')
         
         # Show current recipient status
-        recipients = PaymentRecipient.objects.filter(is_active=True).order_by('priority_order')
+        recipients = PaymentRecipient.objects.filter(is_active=True).order_by('sort_key', 'name')
         
         self.stdout.write('--- CURRENT RECIPIENTS STATUS ---')
-        for recipient in recipients:
+        for position, recipient in enumerate(recipients, start=1):
             remaining = recipient.get_remaining_amount()
             capacity = recipient.get_capacity_percentage()
             
             self.stdout.write(
-                f'{recipient.priority_order}. {recipient.alias}: '
+                f'{position}. {recipient.alias}: '
                 f'${remaining:,.2f} available (${recipient.max_amount:,.2f} max) '
             )
         
@@ -60,7 +84,8 @@ class Command(BaseCommand):
                 self.stdout.write(f'    - {recipient.alias}: ${remaining:,.2f} available')
             
             # Find best recipient
-            best_recipient = PaymentRecipient.objects.find_best_recipient(amount)
+            strategy = None if options['strategy'] == 'all' else options['strategy']
+            best_recipient = PaymentRecipient.objects.find_best_recipient(amount, strategy=strategy)
             
             if best_recipient:
                 remaining = best_recipient.get_remaining_amount()
@@ -74,6 +99,8 @@ class Command(BaseCommand):
             else:
                 self.stdout.write('  ❌ No suitable recipient found')
         
+        self.compare_strategies(options)
+        
         # Show system summary
         self.stdout.write('\n--- SYSTEM SUMMARY ---')
         summary = PaymentRecipient.get_payment_summary()
@@ -87,4 +114,45 @@ class Command(BaseCommand):
             self.stdout.write(f'Usage: {usage_percentage:.1f}%')
             self.stdout.write(f'Remaining capacity: ${remaining_capacity:,.2f}')
         
-        self.stdout.write(f'Recipients by status: {summary["recipients_by_status"]}') 
\ No newline at end of file
+        self.stdout.write(f'Recipients by status: {summary["recipients_by_status"]}')
+    
+    def compare_strategies(self, options):
+        """Run every strategy over the same simulated payments on a copy of the capacity snapshot"""
+        snapshot = list(
+            PaymentRecipient.objects.with_capacity().filter(is_active=True).order_by('sort_key', 'name')
+        )
+        rng = random.Random(options['seed'])
+        amounts = [rng.randrange(10, 501) * 100 for _ in range(options['payments'])]
+        if not amounts:
+            return
+        smallest_amount = min(amounts)
+        names = list(STRATEGIES) if options['strategy'] == 'all' else [options['strategy']]
+        
+        self.stdout.write(f'\n--- STRATEGY COMPARISON ({len(amounts)} payments, seed {options["seed"]}) ---')
+        for name in names:
+            recipients = [copy.copy(recipient) for recipient in snapshot]
+            strategy = STRATEGIES[name]()
+            assigned = 0
+            elapsed = 0.0
+            
+            for amount in amounts:
+                start = time.perf_counter()
+                recipient = strategy.select(recipients, amount)
+                elapsed += time.perf_counter() - start
+                if recipient:
+                    consume_capacity(recipient, amount)
+                    assigned += 1
+            
+            # Leftover capacity that can no longer take even the smallest payment is fragmentation
+            leftover = sum(get_available_capacity(recipient) for recipient in recipients)
+            fragmented = sum(
+                capacity for recipient in recipients
+                if 0 < (capacity := get_available_capacity(recipient)) < max(smallest_amount, recipient.min_threshold or 0)
+            )
+            fragmented_percentage = (fragmented / leftover * 100) if leftover else 0
+            
+            self.stdout.write(
+                f'{name}: {assigned}/{len(amounts)} assigned, '
+                f'${leftover:,.2f} left, ${fragmented:,.2f} unusable ({fragmented_percentage:.1f}%), '
+                f'{elapsed / len(amounts) * 1e6:.1f} µs per selection'
+            )
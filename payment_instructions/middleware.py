@@ -0,0 +1,28 @@
+import logging
+
+from django.utils import timezone
+
+from .models import MonthlySnapshot
+
+logger = logging.getLogger(__name__)
+
+
+class MonthCloseMiddleware:
+    """Close the previous month(s) on the first request each worker serves in a new month"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.checked_month = None
+
+    def __call__(self, request):
+        current_month = timezone.localdate().replace(day=1)
+        if current_month != self.checked_month:
+            try:
+                closed = MonthlySnapshot.objects.close_pending_months()
+                if closed:
+                    logger.info('Closed months: %s', ', '.join(f'{month:%Y-%m}' for month in closed))
+                self.checked_month = current_month
+            except Exception:
+                # Never block a request because of reporting; the next request retries
+                logger.exception('Error closing pending months')
+        return self.get_response(request)
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.4 on 2026-10-16 20:31
+
+import django.db.models.deletion
+from datetime import timezone
+from django.db import migrations, models
+from django.db.models.functions import TruncMonth
+
+
+def populate_balances(apps, schema_editor):
+    Payment = apps.get_model('payment_instructions', 'Payment')
+    RecipientMonthlyBalance = apps.get_model('payment_instructions', 'RecipientMonthlyBalance')
+    RecipientLifetimeBalance = apps.get_model('payment_instructions', 'RecipientLifetimeBalance')
+
+    lifetime = {}
+    monthly = []
+    rows = Payment.objects.annotate(
+        month=TruncMonth('created_at', tzinfo=timezone.utc)
+    ).values('payment_recipient_id', 'month').annotate(total=models.Sum('amount')).order_by()
+    for row in rows:
+        recipient_id = row['payment_recipient_id']
+        monthly.append(RecipientMonthlyBalance(
+            payment_recipient_id=recipient_id,
+            month=row['month'].astimezone(timezone.utc).date(),
+            received=row['total'],
+        ))
+        lifetime[recipient_id] = lifetime.get(recipient_id, 0) + row['total']
+
+    RecipientMonthlyBalance.objects.bulk_create(monthly)
+    RecipientLifetimeBalance.objects.bulk_create([
+        RecipientLifetimeBalance(payment_recipient_id=recipient_id, received=total)
+        for recipient_id, total in lifetime.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_instructions', '0005_alter_paymentrecipient_max_amount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipientLifetimeBalance',
+            fields=[
+                ('payment_recipient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='lifetime_balance', serialize=False, to='payment_instructions.paymentrecipient', verbose_name='Destinatario')),
+                ('received', models.BigIntegerField(default=0, verbose_name='Recibido')),
+            ],
+            options={
+                'verbose_name': 'Saldo histórico',
+                'verbose_name_plural': 'Saldos históricos',
+            },
+        ),
+        migrations.CreateModel(
+            name='RecipientMonthlyBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='Primer día del mes', verbose_name='Mes')),
+                ('received', models.BigIntegerField(default=0, verbose_name='Recibido')),
+                ('payment_recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_balances', to='payment_instructions.paymentrecipient', verbose_name='Destinatario')),
+            ],
+            options={
+                'verbose_name': 'Saldo mensual',
+                'verbose_name_plural': 'Saldos mensuales',
+                'constraints': [models.UniqueConstraint(fields=('payment_recipient', 'month'), name='unique_recipient_month_balance')],
+            },
+        ),
+        migrations.RunPython(populate_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-16 20:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_instructions', '0006_recipient_balances'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheVersion',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Versión de caché',
+                'verbose_name_plural': 'Versiones de caché',
+            },
+        ),
+    ]
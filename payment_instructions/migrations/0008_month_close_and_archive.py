@@ -0,0 +1,66 @@
+# Generated by Django 5.2.4 on 2026-10-16 20:39
+
+import django.db.models.deletion
+import django.utils.timezone
+import payment_instructions.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_instructions', '0007_cache_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthClose',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='Primer día del mes cerrado', unique=True, verbose_name='Mes')),
+                ('closed_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Cerrado')),
+            ],
+            options={
+                'verbose_name': 'Cierre mensual',
+                'verbose_name_plural': 'Cierres mensuales',
+                'ordering': ['-month'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedPayment',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('amount', models.PositiveIntegerField(verbose_name='Monto')),
+                ('proof_of_payment_file', models.FileField(upload_to=payment_instructions.models.modify_file_name, verbose_name='Comprobante')),
+                ('notes', models.TextField(blank=True, verbose_name='Notas')),
+                ('created_at', models.DateTimeField(verbose_name='Creado')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Archivado')),
+                ('operator_user', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='archived_payments', to=settings.AUTH_USER_MODEL, verbose_name='Operador')),
+                ('payment_recipient', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='archived_payments', to='payment_instructions.paymentrecipient', verbose_name='Destinatario')),
+                ('specialist', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='archived_payments', to='payment_instructions.specialist', verbose_name='Especialista')),
+            ],
+            options={
+                'verbose_name': 'Pago archivado',
+                'verbose_name_plural': 'Pagos archivados',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MonthlySnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='Mes')),
+                ('scope', models.CharField(choices=[('recipient', 'Destinatario'), ('specialist', 'Especialista'), ('operator', 'Operador')], max_length=20, verbose_name='Tipo')),
+                ('object_id', models.PositiveBigIntegerField(verbose_name='ID')),
+                ('total_amount', models.BigIntegerField(default=0, verbose_name='Total')),
+                ('payment_count', models.PositiveIntegerField(default=0, verbose_name='Pagos')),
+            ],
+            options={
+                'verbose_name': 'Resumen mensual',
+                'verbose_name_plural': 'Resúmenes mensuales',
+                'ordering': ['-month', 'scope', 'object_id'],
+                'constraints': [models.UniqueConstraint(fields=('month', 'scope', 'object_id'), name='unique_monthly_snapshot')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-16 20:41
+
+from django.db import migrations, models
+
+SORT_KEY_GAP = 1024
+
+
+def populate_sort_keys(apps, schema_editor):
+    PaymentRecipient = apps.get_model('payment_instructions', 'PaymentRecipient')
+    recipients = list(PaymentRecipient.objects.order_by('priority_order', 'name'))
+    for rank, recipient in enumerate(recipients, start=1):
+        recipient.priority_order = rank
+        recipient.sort_key = rank * SORT_KEY_GAP
+    PaymentRecipient.objects.bulk_update(recipients, ['priority_order', 'sort_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_instructions', '0008_month_close_and_archive'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='paymentrecipient',
+            options={'ordering': ['sort_key', 'name'], 'verbose_name': 'Destinatario', 'verbose_name_plural': 'Destinatarios'},
+        ),
+        migrations.AddField(
+            model_name='paymentrecipient',
+            name='sort_key',
+            field=models.PositiveBigIntegerField(db_index=True, default=0, editable=False, help_text='Clave dispersa derivada del orden; permite reordenar sin reescribir otros destinatarios', verbose_name='Clave de orden'),
+        ),
+        migrations.RunPython(populate_sort_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.4 on 2026-10-16 20:44
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_instructions', '0009_paymentrecipient_sort_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='proof_status',
+            field=models.CharField(choices=[('ready', 'Listo'), ('processing', 'Procesando'), ('failed', 'Sin comprimir')], default='ready', help_text='Los comprobantes se comprimen en segundo plano después de registrar el pago', max_length=20, verbose_name='Estado del comprobante'),
+        ),
+        migrations.CreateModel(
+            name='CompressionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_name', models.CharField(max_length=255, verbose_name='Archivo original')),
+                ('content_type', models.CharField(blank=True, max_length=100, verbose_name='Tipo de contenido')),
+                ('status', models.CharField(choices=[('pending', 'Pendiente'), ('running', 'En proceso'), ('done', 'Completado'), ('failed', 'Fallido')], default='pending', max_length=20, verbose_name='Estado')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Intentos')),
+                ('last_error', models.TextField(blank=True, verbose_name='Último error')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Encolado')),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Disponible desde')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Iniciado')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finalizado')),
+            ],
+            options={
+                'verbose_name': 'Trabajo de compresión',
+                'verbose_name_plural': 'Trabajos de compresión',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'available_at'], name='compressionjob_due_idx')],
+            },
+        ),
+    ]
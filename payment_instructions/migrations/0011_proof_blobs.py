@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-16 20:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_instructions', '0010_compression_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProofBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True, verbose_name='Hash')),
+                ('source_sha256', models.CharField(blank=True, db_index=True, help_text='Hash del archivo subido que produjo este comprobante, para detectar duplicados', max_length=64, verbose_name='Hash del original')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Archivo')),
+                ('size', models.PositiveIntegerField(default=0, verbose_name='Tamaño')),
+                ('ref_count', models.PositiveIntegerField(default=0, verbose_name='Referencias')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Creado')),
+            ],
+            options={
+                'verbose_name': 'Archivo de comprobante',
+                'verbose_name_plural': 'Archivos de comprobante',
+            },
+        ),
+        migrations.AddField(
+            model_name='compressionjob',
+            name='source_sha256',
+            field=models.CharField(blank=True, max_length=64, verbose_name='Hash del original'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.4 on 2026-10-16 21:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_instructions', '0011_proof_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedpayment',
+            name='compressed_size',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Tamaño comprimido'),
+        ),
+        migrations.AddField(
+            model_name='archivedpayment',
+            name='compression_profile',
+            field=models.CharField(blank=True, choices=[('photo', 'Foto'), ('grayscale', 'Escala de grises'), ('document', 'Documento')], max_length=20, verbose_name='Perfil de compresión'),
+        ),
+        migrations.AddField(
+            model_name='archivedpayment',
+            name='original_size',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Tamaño original'),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='compressed_size',
+            field=models.PositiveIntegerField(blank=True, help_text='Bytes del comprobante guardado', null=True, verbose_name='Tamaño comprimido'),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='compression_profile',
+            field=models.CharField(blank=True, choices=[('photo', 'Foto'), ('grayscale', 'Escala de grises'), ('document', 'Documento')], help_text='Codificación elegida para el comprobante según su contenido', max_length=20, verbose_name='Perfil de compresión'),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='original_size',
+            field=models.PositiveIntegerField(blank=True, help_text='Bytes del archivo subido', null=True, verbose_name='Tamaño original'),
+        ),
+        migrations.AddField(
+            model_name='proofblob',
+            name='profile',
+            field=models.CharField(blank=True, choices=[('photo', 'Foto'), ('grayscale', 'Escala de grises'), ('document', 'Documento')], max_length=20, verbose_name='Perfil de compresión'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.4 on 2026-10-16 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_instructions', '0012_compression_profile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PackedProof',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Archivo')),
+                ('pack', models.CharField(db_index=True, max_length=255, verbose_name='Paquete')),
+                ('offset', models.PositiveBigIntegerField(verbose_name='Posición')),
+                ('size', models.PositiveIntegerField(verbose_name='Tamaño')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Empaquetado')),
+            ],
+            options={
+                'verbose_name': 'Comprobante empaquetado',
+                'verbose_name_plural': 'Comprobantes empaquetados',
+            },
+        ),
+        migrations.AlterField(
+            model_name='archivedpayment',
+            name='compression_profile',
+            field=models.CharField(blank=True, choices=[('photo', 'Foto'), ('grayscale', 'Escala de grises'), ('document', 'Documento'), ('cold', 'Archivo frío')], max_length=20, verbose_name='Perfil de compresión'),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='compression_profile',
+            field=models.CharField(blank=True, choices=[('photo', 'Foto'), ('grayscale', 'Escala de grises'), ('document', 'Documento'), ('cold', 'Archivo frío')], help_text='Codificación elegida para el comprobante según su contenido', max_length=20, verbose_name='Perfil de compresión'),
+        ),
+        migrations.AlterField(
+            model_name='proofblob',
+            name='profile',
+            field=models.CharField(blank=True, choices=[('photo', 'Foto'), ('grayscale', 'Escala de grises'), ('document', 'Documento'), ('cold', 'Archivo frío')], max_length=20, verbose_name='Perfil de compresión'),
+        ),
+    ]
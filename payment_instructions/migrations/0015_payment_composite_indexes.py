@@ -0,0 +1,42 @@
+# Generated by Django 5.2.4 on 2026-10-16 21:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_instructions', '0014_payment_created_at_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['payment_recipient', 'created_at', 'amount'], name='payment_recipient_month_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['specialist', 'created_at', 'amount'], name='payment_specialist_month_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['operator_user', 'created_at'], name='payment_operator_created_idx'),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='operator_user',
+            field=models.ForeignKey(db_index=False, help_text='Operador que registró este pago', on_delete=django.db.models.deletion.PROTECT, related_name='registered_payments', to=settings.AUTH_USER_MODEL, verbose_name='Operador'),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='payment_recipient',
+            field=models.ForeignKey(db_index=False, help_text='Destinatario del pago', on_delete=django.db.models.deletion.PROTECT, related_name='payments', to='payment_instructions.paymentrecipient', verbose_name='Destinatario'),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='specialist',
+            field=models.ForeignKey(db_index=False, help_text='Especialista asociado al pago', on_delete=django.db.models.deletion.PROTECT, related_name='payments', to='payment_instructions.specialist', verbose_name='Especialista'),
+        ),
+    ]
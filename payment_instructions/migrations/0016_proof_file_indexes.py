@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-16 22:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_instructions', '0015_payment_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='archivedpayment',
+            index=models.Index(fields=['proof_of_payment_file'], name='archived_proof_file_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['proof_of_payment_file'], name='payment_proof_file_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-16 22:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_instructions', '0016_proof_file_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='archivedpayment',
+            index=models.Index(fields=['created_at'], name='archived_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('proof_status', 'processing')), fields=['proof_of_payment_file'], name='payment_processing_proof_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-16 22:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_instructions', '0017_proof_candidate_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivedpayment',
+            name='compression_profile',
+            field=models.CharField(blank=True, choices=[('photo', 'Foto'), ('grayscale', 'Escala de grises'), ('document', 'Documento'), ('cold', 'Archivo frío'), ('original', 'Original')], max_length=20, verbose_name='Perfil de compresión'),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='compression_profile',
+            field=models.CharField(blank=True, choices=[('photo', 'Foto'), ('grayscale', 'Escala de grises'), ('document', 'Documento'), ('cold', 'Archivo frío'), ('original', 'Original')], help_text='Codificación elegida para el comprobante según su contenido', max_length=20, verbose_name='Perfil de compresión'),
+        ),
+        migrations.AlterField(
+            model_name='proofblob',
+            name='profile',
+            field=models.CharField(blank=True, choices=[('photo', 'Foto'), ('grayscale', 'Escala de grises'), ('document', 'Documento'), ('cold', 'Archivo frío'), ('original', 'Original')], max_length=20, verbose_name='Perfil de compresión'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.4 on 2026-10-16 22:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_instructions', '0018_original_compression_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipientmonthlybalance',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Actualizado'),
+        ),
+        migrations.AddIndex(
+            model_name='recipientmonthlybalance',
+            index=models.Index(fields=['updated_at'], name='monthly_balance_updated_idx'),
+        ),
+    ]
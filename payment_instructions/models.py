@@ -1,9 +1,24 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Coalesce, TruncDate, TruncMonth
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.utils import timezone
 from django.core.exceptions import ValidationError
+import hashlib
 import os
-from datetime import datetime
+import secrets
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+def month_start(value=None):
+    """Return the first day of the (UTC) month of value, used as the balance ledger key"""
+    value = value or timezone.now()
+    return value.astimezone(dt_timezone.utc).date().replace(day=1)
+
+def local_month_range(year, month):
+    """Return the [start, end) datetimes of a calendar month in the current (local) timezone"""
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime(year, month, 1), tz)
+    end = timezone.make_aware(datetime(year + month // 12, month % 12 + 1, 1), tz)
+    return start, end
 
 def modify_file_name(instance, filename):
     ext = filename.split('.')[-1]
@@ -15,6 +30,17 @@ def modify_file_name(instance, filename):
     new_filename = f"{alias}_{day}.{ext}"
     return os.path.join(f'comprobantes/{year}/{month}', new_filename)
 
+def hash_file(file_obj):
+    """SHA-256 hex digest of a file, read in chunks; reuses the digest computed by the upload handler"""
+    digest = getattr(file_obj, 'sha256', None)
+    if digest:
+        return digest
+    sha256 = hashlib.sha256()
+    for chunk in file_obj.chunks():
+        sha256.update(chunk)
+    file_obj.seek(0)
+    return sha256.hexdigest()
+
 class UserManager(BaseUserManager):
     def create_user(self, username, email=None, password=None, **extra_fields):
         if not username:
@@ -61,37 +87,89 @@ class User(AbstractUser):
 
 
 class PaymentRecipientManager(models.Manager):
+    def with_capacity(self, queryset=None):
+        """Annotate recipients with received totals and remaining monthly capacity from the balance ledger"""
+        queryset = self.all() if queryset is None else queryset
+        current_month = RecipientMonthlyBalance.objects.filter(
+            payment_recipient=models.OuterRef('pk'),
+            month=month_start()
+        ).values('received')[:1]
+        return queryset.annotate(
+            month_received=Coalesce(models.Subquery(current_month), 0),
+            total_received=Coalesce(models.F('lifetime_balance__received'), 0),
+        ).annotate(
+            remaining=models.F('max_amount') - models.F('month_received')
+        )
+    
     def get_available_recipients(self, amount=None):
         """Get active recipients that can receive payments, ordered by priority"""
         queryset = self.filter(is_active=True)
         
         if amount is not None:
-            # Filter recipients that can receive the specified amount
-            available_recipients = []
-            for recipient in queryset:
-                if recipient.can_receive_amount(amount):
-                    available_recipients.append(recipient.pk)
-            queryset = queryset.filter(pk__in=available_recipients)
+            # Same rules as can_receive_amount, evaluated by the database in a single query
+            queryset = self.with_capacity().filter(
+                is_active=True,
+                min_threshold__lte=amount,
+            ).filter(
+                models.Q(is_recurring=True, remaining__gte=amount) |
+                models.Q(is_recurring=False, total_received=0, max_amount__gte=amount)
+            )
         
-        return queryset.order_by('priority_order', 'name')
+        return queryset.order_by('sort_key', 'name')
     
-    def find_best_recipient(self, amount):
-        """Find the best recipient for a given amount based on priority and availability"""
-        available = self.get_available_recipients(amount)
-        
-        # First try: exact or close match that doesn't waste capacity
-        # for recipient in available:
-        #     remaining = recipient.get_remaining_amount()
-        #     # Prefer recipients where the amount uses significant capacity but doesn't waste much
-        #     if remaining >= amount and (remaining - amount) <= remaining * Decimal('0.3'):
-        #         return recipient
+    def with_rank(self, queryset=None):
+        """Annotate priority_rank: the 1-based position of each recipient in the sort_key order"""
+        queryset = self.all() if queryset is None else queryset
+        earlier = self.filter(
+            models.Q(sort_key__lt=models.OuterRef('sort_key')) |
+            models.Q(sort_key=models.OuterRef('sort_key'), name__lt=models.OuterRef('name'))
+        ).order_by().values(
+            count=models.Func(models.F('pk'), function='COUNT', output_field=models.IntegerField())
+        )
+        return queryset.annotate(priority_rank=models.Subquery(earlier) + 1)
+    
+    def reorder(self, recipients, exclude=None):
+        """
+        Apply a full new priority order (recipients or pks, highest priority first) with one bulk_update.
+        Sort keys are respaced and visible priority numbers become 1..N. The order must list every
+        recipient exactly once (but exclude, which the caller places itself): keys handed out to a
+        partial list would collide with the keys of the recipients left out.
+        """
+        pks = [getattr(recipient, 'pk', recipient) for recipient in recipients]
+        expected = set(self.exclude(pk=exclude).values_list('pk', flat=True))
+        if len(pks) != len(expected) or set(pks) != expected:
+            raise ValueError('reorder() needs every recipient exactly once')
+        updated = [
+            self.model(pk=pk, priority_order=rank, sort_key=rank * self.model.SORT_KEY_GAP)
+            for rank, pk in enumerate(pks, start=1)
+        ]
+        with transaction.atomic():
+            self.bulk_update(updated, ['priority_order', 'sort_key'])
+            CacheVersion.objects.bump(CacheVersion.RECIPIENTS)
+        return len(updated)
+    
+    def renumber(self, exclude=None):
+        """Respace sort keys and make visible priority numbers contiguous again, keeping the current order"""
+        queryset = self.order_by('sort_key', 'name')
+        if exclude is not None:
+            queryset = queryset.exclude(pk=exclude)
+        return self.reorder(queryset.values_list('pk', flat=True), exclude=exclude)
+    
+    def find_best_recipient(self, amount, use_index=True, strategy=None):
+        """Find the best recipient for a given amount using the configured allocation strategy"""
+        from .utils.allocation import get_strategy, PriorityFirstStrategy
+        from .utils.recipient_index import recipient_index
         
-        # Second try: any recipient that can handle the amount, by priority
-        for recipient in available:
-            if recipient.can_receive_amount(amount):
-                return recipient
+        strategy = get_strategy(strategy)
+        if use_index:
+            recipients = recipient_index.get_recipients()
+            if recipients is not None:
+                return strategy.select(recipients, amount)
         
-        return None
+        if isinstance(strategy, PriorityFirstStrategy):
+            # First eligible recipient by priority; LIMIT 1 avoids loading the rest
+            return self.get_available_recipients(amount).first()
+        return strategy.select(list(self.get_available_recipients(amount)), amount)
 
 
 class PaymentRecipient(models.Model):
@@ -132,6 +210,13 @@ class PaymentRecipient(models.Model):
         default=1,
         help_text='Orden de prioridad para la selección automática (Menor numero es mayor prioridad)'
     )
+    sort_key = models.PositiveBigIntegerField(
+        verbose_name='Clave de orden',
+        default=0,
+        db_index=True,
+        editable=False,
+        help_text='Clave dispersa derivada del orden; permite reordenar sin reescribir otros destinatarios'
+    )
     is_active = models.BooleanField(
         verbose_name='Activo',
         default=True,
@@ -144,10 +229,12 @@ class PaymentRecipient(models.Model):
         verbose_name='Actualizado',
         auto_now=True)
     
+    SORT_KEY_GAP = 1024
+    
     objects = PaymentRecipientManager()
     
     class Meta:
-        ordering = ['priority_order', 'name']
+        ordering = ['sort_key', 'name']
         verbose_name = 'Destinatario'
         verbose_name_plural = 'Destinatarios'
     
@@ -197,78 +284,72 @@ class PaymentRecipient(models.Model):
         if self.cbu and len(self.cbu) != 22:
             raise ValidationError({'cbu': 'El CBU debe tener 22 dígitos.'})
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored priority so save() can tell whether it changed without another query
+        instance._loaded_priority = dict(zip(field_names, values)).get('priority_order')
+        return instance
+    
     def save(self, *args, **kwargs):
-        """Override save to handle unique priority logic"""
-        from django.db import transaction
-        
-        # Use transaction to ensure atomicity
+        """Override save to place the recipient at its requested priority by moving only this row"""
         with transaction.atomic():
-            # Check if this is an update and priority has changed
-            if self.pk:
-                try:
-                    old_instance = PaymentRecipient.objects.get(pk=self.pk)
-                    old_priority = old_instance.priority_order
-                except PaymentRecipient.DoesNotExist:
-                    old_priority = None
-            else:
-                old_priority = None
-            
-            new_priority = self.priority_order
-            
-            # If priority changed or this is a new instance, adjust other priorities
-            if old_priority != new_priority:
-                self._adjust_priorities(old_priority, new_priority)
-            
+            priority_changed = self.priority_order != getattr(self, '_loaded_priority', None)
+            if self._state.adding or priority_changed or not self.sort_key:
+                self.sort_key = self._sort_key_for_rank(self.priority_order)
             super().save(*args, **kwargs)
+            self._loaded_priority = self.priority_order
     
-    def _adjust_priorities(self, old_priority, new_priority):
-        """Adjust priorities of other recipients when this one changes"""
-        # Get all other recipients (excluding this one if it exists)
-        other_recipients = PaymentRecipient.objects.exclude(pk=self.pk if self.pk else 0)
+    def _sort_key_for_rank(self, rank):
+        """Sort key that puts this recipient at position `rank` among the others, reading at most two rows"""
+        others = PaymentRecipient.objects.exclude(pk=self.pk).order_by('sort_key', 'name')
+        position = max(rank, 1) - 1
+        neighbours = list(others[max(position - 1, 0):position + 1].values_list('sort_key', flat=True))
         
-        if old_priority is None:
-            # New recipient - shift all recipients with priority >= new_priority
-            other_recipients.filter(priority_order__gte=new_priority).update(
-                priority_order=models.F('priority_order') + 1
-            )
+        if position == 0:
+            lower, upper = 0, (neighbours[0] if neighbours else None)
         else:
-            # Existing recipient changing priority
-            if new_priority < old_priority:
-                # Moving up (lower number = higher priority)
-                # Shift down recipients between new_priority and old_priority-1
-                other_recipients.filter(
-                    priority_order__gte=new_priority,
-                    priority_order__lt=old_priority
-                ).update(priority_order=models.F('priority_order') + 1)
-            elif new_priority > old_priority:
-                # Moving down (higher number = lower priority)
-                # Shift up recipients between old_priority+1 and new_priority
-                other_recipients.filter(
-                    priority_order__gt=old_priority,
-                    priority_order__lte=new_priority
-                ).update(priority_order=models.F('priority_order') - 1)
-    
-    def delete(self, *args, **kwargs):
-        """Override delete to maintain priority order continuity"""
-        priority_to_remove = self.priority_order
-        super().delete(*args, **kwargs)
-        
-        # Shift up all recipients with priority > deleted priority
-        PaymentRecipient.objects.filter(
-            priority_order__gt=priority_to_remove
-        ).update(priority_order=models.F('priority_order') - 1)
+            lower = neighbours[0] if neighbours else None
+            upper = neighbours[1] if len(neighbours) > 1 else None
+        
+        if lower is None:
+            # Requested rank is past the end: go after the last recipient
+            last = others.values_list('sort_key', flat=True).last()
+            return (last or 0) + self.SORT_KEY_GAP
+        if upper is None:
+            return lower + self.SORT_KEY_GAP
+        if upper - lower > 1:
+            return (lower + upper) // 2
+        
+        # No room left between the neighbours: respace everyone once and try again
+        PaymentRecipient.objects.renumber(exclude=self.pk)
+        return self._sort_key_for_rank(rank)
+    
+    def _get_excluded_amount(self, exclude_payment, month=None):
+        """Amount the stored version of exclude_payment contributes to this recipient's balance"""
+        if not exclude_payment:
+            return 0
+        stored = exclude_payment.get_stored_state()
+        if stored is None or stored['payment_recipient_id'] != self.pk:
+            return 0
+        if month is not None and month_start(stored['created_at']) != month:
+            return 0
+        return stored['amount']
     
     def get_current_month_received(self, exclude_payment=None):
         """Get total amount received this month, optionally excluding a specific payment"""
-        current_month = timezone.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        queryset = self.payments.filter(created_at__gte=current_month)
+        current_month = month_start()
+        total = self.monthly_balances.filter(month=current_month).values_list('received', flat=True).first() or 0
         
         # Exclude specific payment if provided (useful when editing)
-        if exclude_payment:
-            queryset = queryset.exclude(pk=exclude_payment.pk)
-        
-        total = queryset.aggregate(total=models.Sum('amount'))['total']
-        return total or 0
+        return total - self._get_excluded_amount(exclude_payment, month=current_month)
+    
+    def get_total_received(self, exclude_payment=None):
+        """Get total amount ever received, optionally excluding a specific payment"""
+        total = RecipientLifetimeBalance.objects.filter(
+            payment_recipient=self
+        ).values_list('received', flat=True).first() or 0
+        return total - self._get_excluded_amount(exclude_payment)
     
     def get_remaining_amount(self, exclude_payment=None):
         """Get remaining amount available for this recipient this month"""
@@ -290,13 +371,7 @@ class PaymentRecipient(models.Model):
         
         # For one-time recipients, check if they have already received any payment
         if not self.is_recurring:
-            queryset = self.payments
-            if exclude_payment:
-                queryset = queryset.exclude(pk=exclude_payment.pk)
-            
-            total_received = queryset.aggregate(
-                total=models.Sum('amount')
-            )['total'] or 0
+            total_received = self.get_total_received(exclude_payment=exclude_payment)
             return total_received == 0 and amount <= self.max_amount and amount >= (self.min_threshold or 0)
         
         # For recurring recipients, check monthly limit
@@ -315,8 +390,7 @@ class PaymentRecipient(models.Model):
             return 'inactive'
         
         if not self.is_recurring:
-            total_received = self.payments.aggregate(total=models.Sum('amount'))['total'] or 0
-            if total_received > 0:
+            if self.get_total_received() > 0:
                 return 'completed_onetime'
             return 'available_onetime'
         
@@ -328,10 +402,7 @@ class PaymentRecipient(models.Model):
             return 0
         
         if not self.is_recurring:
-            total_received = self.payments.aggregate(
-                total=models.Sum('amount')
-            )['total'] or 0
-            if total_received > 0:
+            if self.get_total_received() > 0:
                 return 0
             return self.max_amount
         
@@ -340,32 +411,36 @@ class PaymentRecipient(models.Model):
     @classmethod
     def get_payment_summary(cls):
         """Get summary of all recipients and their current status"""
-        summary = {
-            'total_recipients': cls.objects.count(),
-            'active_recipients': cls.objects.filter(is_active=True).count(),
-            'completed_this_month': 0,
-            'available_recipients': 0,
-            'total_capacity': 0,
-            'total_used': 0,
-            'recipients_by_status': {}
-        }
+        active = models.Q(is_active=True)
+        recurring = active & models.Q(is_recurring=True)
+        onetime_used = active & models.Q(is_recurring=False, total_received__gt=0)
+        onetime_free = active & models.Q(is_recurring=False) & ~models.Q(total_received__gt=0)
         
-        status_counts = {}
-        for recipient in cls.objects.filter(is_active=True):
-            status = recipient.get_status()
-            status_counts[status] = status_counts.get(status, 0) + 1
-            
-            if recipient.is_recurring:
-                summary['total_capacity'] += recipient.max_amount
-                summary['total_used'] += recipient.get_current_month_received()
-            
-            if status in ['completed_monthly', 'completed_onetime']:
-                summary['completed_this_month'] += 1
-            elif status in ['available', 'half_full', 'nearly_full', 'available_onetime']:
-                summary['available_recipients'] += 1
+        # One query: conditional aggregates over the ledger-annotated recipients
+        totals = cls.objects.with_capacity().aggregate(
+            total_recipients=models.Count('pk'),
+            active_recipients=models.Count('pk', filter=active),
+            available=models.Count('pk', filter=recurring),
+            completed_onetime=models.Count('pk', filter=onetime_used),
+            available_onetime=models.Count('pk', filter=onetime_free),
+            total_capacity=Coalesce(models.Sum('max_amount', filter=recurring), 0),
+            total_used=Coalesce(models.Sum('month_received', filter=recurring), 0),
+        )
         
-        summary['recipients_by_status'] = status_counts
-        return summary
+        status_counts = {
+            status: totals[status]
+            for status in ('available', 'completed_onetime', 'available_onetime')
+            if totals[status]
+        }
+        return {
+            'total_recipients': totals['total_recipients'],
+            'active_recipients': totals['active_recipients'],
+            'completed_this_month': totals['completed_onetime'],
+            'available_recipients': totals['available'] + totals['available_onetime'],
+            'total_capacity': totals['total_capacity'],
+            'total_used': totals['total_used'],
+            'recipients_by_status': status_counts
+        }
 
 
 class Specialist(models.Model):
@@ -407,7 +482,99 @@ class Specialist(models.Model):
         )
 
 
+class CapacityExceeded(ValidationError):
+    """Raised when a payment no longer fits its recipient's limits at commit time"""
+
+
+class PaymentManager(models.Manager):
+    def allocate(self, compress_proof=False, **kwargs):
+        """
+        Create a payment only if its recipient can still receive the amount.
+        The capacity recheck and the insert happen in one transaction, so concurrent
+        operators can never push a recipient over max_amount. Raises CapacityExceeded.
+        """
+        return self.allocate_many([kwargs], compress_proof=compress_proof)[0]
+    
+    def allocate_many(self, payments_kwargs, compress_proof=False):
+        """
+        Create several payments (e.g. the legs of a split payment) all-or-nothing, rechecking
+        each recipient's capacity in the same transaction. All payments share the first one's proof.
+        With compress_proof an upload already compressed before (same source hash) reuses its
+        ProofBlob; otherwise the original is stored as is and a CompressionJob is queued for it.
+        """
+        payments = [self.model(**kwargs) for kwargs in payments_kwargs]
+        proof = payments[0].proof_of_payment_file
+        upload = proof.file if proof and not proof._committed else None
+        content_type = getattr(upload, 'content_type', '') if upload else ''
+        source_sha256 = hash_file(upload) if compress_proof and upload else ''
+        
+        # Duplicate uploads are found by the hash of their bytes before anything is stored or compressed
+        blob = ProofBlob.objects.filter(source_sha256=source_sha256).first() if source_sha256 else None
+        
+        def use_proof(name, status):
+            for payment in payments:
+                payment.proof_of_payment_file = name
+                payment.proof_status = status
+                if upload is not None:
+                    payment.original_size = upload.size
+                    payment.compression_profile = blob.profile if blob is not None else ''
+                    payment.compressed_size = blob.size if blob is not None else None
+        
+        def store_upload():
+            # Store the uploaded file before the transaction so file I/O doesn't hold the write lock
+            proof.save(proof.name, upload, save=False)
+            use_proof(proof.name, Payment.PROOF_PROCESSING if compress_proof else Payment.PROOF_READY)
+        
+        stored_file = upload is not None and blob is None
+        if blob is not None:
+            use_proof(blob.name, Payment.PROOF_READY)
+        elif stored_file:
+            store_upload()
+        else:
+            use_proof(proof.name, Payment.PROOF_READY)
+        
+        try:
+            with transaction.atomic():
+                if blob is not None and not ProofBlob.objects.acquire(blob, len(payments)):
+                    # The blob was released since the lookup: store and compress the upload after all
+                    blob = None
+                    stored_file = True
+                    store_upload()
+                for payment in payments:
+                    payment._check_capacity = True
+                    payment.save(force_insert=True)
+                if stored_file and compress_proof:
+                    CompressionJob.objects.enqueue(proof.name, content_type, source_sha256)
+        except CapacityExceeded:
+            if stored_file:
+                proof.delete(save=False)
+            raise
+        finally:
+            for payment in payments:
+                payment._check_capacity = False
+        return payments
+
+
 class Payment(models.Model):
+    PROOF_READY = 'ready'
+    PROOF_PROCESSING = 'processing'
+    PROOF_FAILED = 'failed'
+    
+    PROOF_STATUS_CHOICES = [
+        (PROOF_READY, 'Listo'),
+        (PROOF_PROCESSING, 'Procesando'),
+        (PROOF_FAILED, 'Sin comprimir'),
+    ]
+    
+    # Same values as the FileCompressor profiles
+    COMPRESSION_PROFILE_CHOICES = [
+        ('photo', 'Foto'),
+        ('grayscale', 'Escala de grises'),
+        ('document', 'Documento'),
+        ('cold', 'Archivo frío'),
+        ('original', 'Original'),
+    ]
+    
     amount = models.PositiveIntegerField(
         verbose_name='Monto',
         help_text='Monto del pago'
@@ -417,7 +584,8 @@ class Payment(models.Model):
         verbose_name='Destinatario',
         on_delete=models.PROTECT,
         related_name='payments',
-        help_text='Destinatario del pago'
+        help_text='Destinatario del pago',
+        db_index=False  # payment_recipient_month_idx leads with this column
     )
     specialist = models.ForeignKey(
         'Specialist',
@@ -426,19 +594,47 @@ class Payment(models.Model):
         related_name='payments',
         help_text='Especialista asociado al pago',
         null=False,
-        blank=False
+        blank=False,
+        db_index=False  # payment_specialist_month_idx leads with this column
     )
     proof_of_payment_file = models.FileField(
         verbose_name='Comprobante',
         upload_to=modify_file_name,
         help_text='Subir comprobante de pago (imagen o PDF)'
     )
+    proof_status = models.CharField(
+        verbose_name='Estado del comprobante',
+        max_length=20,
+        choices=PROOF_STATUS_CHOICES,
+        default=PROOF_READY,
+        help_text='Los comprobantes se comprimen en segundo plano después de registrar el pago'
+    )
+    compression_profile = models.CharField(
+        verbose_name='Perfil de compresión',
+        max_length=20,
+        choices=COMPRESSION_PROFILE_CHOICES,
+        blank=True,
+        help_text='Codificación elegida para el comprobante según su contenido'
+    )
+    original_size = models.PositiveIntegerField(
+        verbose_name='Tamaño original',
+        null=True,
+        blank=True,
+        help_text='Bytes del archivo subido'
+    )
+    compressed_size = models.PositiveIntegerField(
+        verbose_name='Tamaño comprimido',
+        null=True,
+        blank=True,
+        help_text='Bytes del comprobante guardado'
+    )
     operator_user = models.ForeignKey(
         User,
         verbose_name='Operador',
         on_delete=models.PROTECT,
         related_name='registered_payments',
-        help_text='Operador que registró este pago'
+        help_text='Operador que registró este pago',
+        db_index=False  # payment_operator_created_idx leads with this column
     )
     notes = models.TextField(
         verbose_name='Notas',
@@ -450,14 +646,94 @@ class Payment(models.Model):
         auto_now_add=True
     )
     
+    objects = PaymentManager()
+    
     class Meta:
         ordering = ['-created_at']
         verbose_name = 'Pago'
         verbose_name_plural = 'Pagos'
+        indexes = [
+            # Default ordering, date hierarchy and date filters of the admin changelist
+            models.Index(fields=['created_at'], name='payment_created_at_idx'),
+            # Month windows per recipient and per specialist; amount makes them covering for the sums
+            models.Index(fields=['payment_recipient', 'created_at', 'amount'], name='payment_recipient_month_idx'),
+            models.Index(fields=['specialist', 'created_at', 'amount'], name='payment_specialist_month_idx'),
+            # Operators' own changelist, newest first (read backwards, so the -pk tiebreak needs no sort)
+            models.Index(fields=['operator_user', 'created_at'], name='payment_operator_created_idx'),
+            # Payments sharing a stored proof, updated when it is compressed, deduplicated or packed
+            models.Index(fields=['proof_of_payment_file'], name='payment_proof_file_idx'),
+            # Proofs still waiting for compression; only those few rows are in the index
+            models.Index(
+                fields=['proof_of_payment_file'], name='payment_processing_proof_idx',
+                condition=models.Q(proof_status='processing'),
+            ),
+        ]
     
     def __str__(self):
         return f"${self.amount} to {self.payment_recipient.alias} on {self.created_at.strftime('%Y-%m-%d')}"
     
+    BALANCE_FIELDS = ('payment_recipient_id', 'amount', 'created_at')
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember stored values so balance deltas can be computed without re-reading the row
+        instance._loaded_values = {
+            name: value for name, value in zip(field_names, values)
+            if name in cls.BALANCE_FIELDS and value is not models.DEFERRED
+        }
+        if 'proof_of_payment_file' in field_names:
+            instance._loaded_proof = values[field_names.index('proof_of_payment_file')]
+        return instance
+    
+    def get_stored_state(self):
+        """Return recipient, amount and creation date as currently stored in the database"""
+        if self._state.adding or not self.pk:
+            return None
+        loaded = getattr(self, '_loaded_values', {})
+        if all(name in loaded for name in self.BALANCE_FIELDS):
+            return loaded
+        return Payment.objects.filter(pk=self.pk).values(*self.BALANCE_FIELDS).first()
+    
+    def is_being_archived(self):
+        """
+        True when this row is being deleted because archive_before already copied it to the archive table.
+        Delete signal handlers use it to keep the balance ledger and proof references of moved payments.
+        """
+        if not hasattr(self, '_being_archived'):
+            self._being_archived = bool(self.pk) and ArchivedPayment.objects.filter(pk=self.pk).exists()
+        return self._being_archived
+    
+    def save(self, *args, **kwargs):
+        """Override save to keep recipient balances in sync within the same transaction"""
+        with transaction.atomic():
+            previous = self.get_stored_state()
+            # The write comes first so SQLite takes its write lock before any capacity is read
+            super().save(*args, **kwargs)
+            current = {name: getattr(self, name) for name in self.BALANCE_FIELDS}
+            if previous:
+                RecipientMonthlyBalance.objects.record_payment(previous, sign=-1)
+            
+            if getattr(self, '_check_capacity', False):
+                recipient = PaymentRecipient.objects.get(pk=self.payment_recipient_id)
+                if (
+                    not recipient.is_active
+                    or self.amount < (recipient.min_threshold or 0)
+                    or not RecipientMonthlyBalance.objects.record_payment(current, recipient=recipient)
+                ):
+                    raise CapacityExceeded(
+                        {'amount': f'{recipient.alias} no puede recibir este monto.'}
+                    )
+            else:
+                RecipientMonthlyBalance.objects.record_payment(current)
+            self._loaded_values = current
+            
+            # A replaced proof gives up its reference to the shared blob
+            loaded_proof = getattr(self, '_loaded_proof', None)
+            if loaded_proof and loaded_proof != self.proof_of_payment_file.name:
+                ProofBlob.objects.release(loaded_proof)
+            self._loaded_proof = self.proof_of_payment_file.name
+    
     
     def clean(self):
         """Validate payment data"""
@@ -500,11 +776,907 @@ class Payment(models.Model):
         year = year or now.year
         month = month or now.month
         
-        payments = cls.objects.filter(created_at__year=year, created_at__month=month)
+        # Closed months are served from their snapshot, so archived payments still count
+        if MonthClose.objects.filter(month=date(year, month, 1)).exists():
+            return MonthlySnapshot.objects.get_monthly_totals(date(year, month, 1))
+        
+        # A range on created_at can use its index, unlike extracting the year and month of every row
+        start, end = local_month_range(year, month)
+        payments = cls.objects.filter(created_at__gte=start, created_at__lt=end)
+        
+        return payments.aggregate(
+            total_amount=Coalesce(models.Sum('amount'), 0),
+            payment_count=models.Count('pk'),
+            unique_recipients=models.Count('payment_recipient', distinct=True),
+            unique_operators=models.Count('operator_user', distinct=True),
+        )
+    
+    TOTALS_GROUPS = {
+        'day': ('day', None),
+        'recipient': ('payment_recipient_id', 'payment_recipient__alias'),
+        'specialist': ('specialist_id', 'specialist__name'),
+        'operator': ('operator_user_id', 'operator_user__username'),
+    }
+    
+    @classmethod
+    def get_totals(cls, start=None, end=None, group_by=None):
+        """
+        Totals of live and archived payments created in [start, end), optionally grouped by
+        'day', 'recipient', 'specialist' or 'operator'. Grouped results are a list of
+        {'key', 'label', 'total_amount', 'payment_count'} dicts sorted by key; one query per table.
+        """
+        if group_by is not None and group_by not in cls.TOTALS_GROUPS:
+            raise ValueError(f'Unknown group_by: {group_by}')
+        
+        filters = {}
+        if start is not None:
+            filters['created_at__gte'] = start
+        if end is not None:
+            filters['created_at__lt'] = end
+        
+        if group_by is None:
+            totals = {'total_amount': 0, 'payment_count': 0}
+            for model in (cls, ArchivedPayment):
+                row = model.objects.filter(**filters).aggregate(
+                    total_amount=Coalesce(models.Sum('amount'), 0),
+                    payment_count=models.Count('pk'),
+                )
+                totals['total_amount'] += row['total_amount']
+                totals['payment_count'] += row['payment_count']
+            return totals
+        
+        key, label = cls.TOTALS_GROUPS[group_by]
+        fields = [key] + ([label] if label else [])
+        groups = {}
+        for model in (cls, ArchivedPayment):
+            queryset = model.objects.filter(**filters)
+            if group_by == 'day':
+                queryset = queryset.annotate(day=TruncDate('created_at'))
+            rows = queryset.values(*fields).annotate(
+                total_amount=models.Sum('amount'),
+                payment_count=models.Count('pk'),
+            ).order_by()
+            for row in rows:
+                group = groups.setdefault(row[key], {
+                    'key': row[key],
+                    'label': row[label] if label else row[key],
+                    'total_amount': 0,
+                    'payment_count': 0,
+                })
+                group['total_amount'] += row['total_amount']
+                group['payment_count'] += row['payment_count']
+        return [groups[group_key] for group_key in sorted(groups)]
+    
+    @classmethod
+    def get_compression_stats(cls, start=None, end=None):
+        """
+        Storage savings of the proofs of live and archived payments created in [start, end), per
+        compression profile: a list of {'profile', 'label', 'payment_count', 'original_size',
+        'compressed_size', 'saved_size'} dicts sorted by profile. Only payments with both sizes count.
+        """
+        filters = {'original_size__isnull': False, 'compressed_size__isnull': False}
+        if start is not None:
+            filters['created_at__gte'] = start
+        if end is not None:
+            filters['created_at__lt'] = end
+        
+        labels = dict(cls.COMPRESSION_PROFILE_CHOICES)
+        groups = {}
+        for model in (cls, ArchivedPayment):
+            rows = model.objects.filter(**filters).values('compression_profile').annotate(
+                payment_count=models.Count('pk'),
+                original_size=models.Sum('original_size'),
+                compressed_size=models.Sum('compressed_size'),
+            ).order_by()
+            for row in rows:
+                profile = row['compression_profile']
+                group = groups.setdefault(profile, {
+                    'profile': profile,
+                    'label': labels.get(profile, 'Sin comprimir'),
+                    'payment_count': 0,
+                    'original_size': 0,
+                    'compressed_size': 0,
+                })
+                group['payment_count'] += row['payment_count']
+                group['original_size'] += row['original_size']
+                group['compressed_size'] += row['compressed_size']
+        for group in groups.values():
+            group['saved_size'] = group['original_size'] - group['compressed_size']
+        return [groups[profile] for profile in sorted(groups)]
+
+
+class RecipientBalanceManager(models.Manager):
+    def record_payment(self, state, sign=1, recipient=None):
+        """
+        Add (or with sign=-1 remove) a payment's amount to its recipient's monthly and lifetime balances.
+        When recipient is given, the increments are conditional on its limits and False is returned
+        (nothing applied) if the payment does not fit. The conditional UPDATE locks only this
+        recipient's balance rows and re-evaluates the limit against the committed value.
+        """
+        recipient_id = state['payment_recipient_id']
+        amount = state['amount'] * sign
+        month = month_start(state['created_at'])
+        
+        # Make sure both rows exist, then increment them atomically in SQL
+        self.bulk_create([self.model(payment_recipient_id=recipient_id, month=month)], ignore_conflicts=True)
+        RecipientLifetimeBalance.objects.bulk_create(
+            [RecipientLifetimeBalance(payment_recipient_id=recipient_id)], ignore_conflicts=True
+        )
+        monthly = self.filter(payment_recipient_id=recipient_id, month=month)
+        lifetime = RecipientLifetimeBalance.objects.filter(payment_recipient_id=recipient_id)
+        
+        if recipient is not None:
+            monthly = monthly.filter(received__lte=recipient.max_amount - amount)
+            if not recipient.is_recurring:
+                lifetime = lifetime.filter(received=0)
+        
+        # updated_at lets each worker's availability index pick up the change without a full rebuild
+        if not monthly.update(received=models.F('received') + amount, updated_at=timezone.now()):
+            return False
+        if not lifetime.update(received=models.F('received') + amount):
+            # Undo the monthly increment; the caller's transaction is rolled back anyway
+            self.filter(payment_recipient_id=recipient_id, month=month).update(
+                received=models.F('received') - amount
+            )
+            return False
+        return True
+    
+    def compute_from_payments(self):
+        """Aggregate live and archived payments into {(recipient_id, month): total} and {recipient_id: total}"""
+        monthly = {}
+        lifetime = {}
+        rows = [
+            row
+            for model in (Payment, ArchivedPayment)
+            for row in model.objects.annotate(
+                month=TruncMonth('created_at', tzinfo=dt_timezone.utc)
+            ).values('payment_recipient_id', 'month').annotate(total=models.Sum('amount')).order_by()
+        ]
+        for row in rows:
+            recipient_id = row['payment_recipient_id']
+            key = (recipient_id, month_start(row['month']))
+            monthly[key] = monthly.get(key, 0) + row['total']
+            lifetime[recipient_id] = lifetime.get(recipient_id, 0) + row['total']
+        return monthly, lifetime
+    
+    def rebuild(self):
+        """Replace every balance row with totals recomputed from the Payment table"""
+        monthly, lifetime = self.compute_from_payments()
+        with transaction.atomic():
+            self.all().delete()
+            RecipientLifetimeBalance.objects.all().delete()
+            self.bulk_create([
+                self.model(payment_recipient_id=recipient_id, month=month, received=total)
+                for (recipient_id, month), total in monthly.items()
+            ])
+            RecipientLifetimeBalance.objects.bulk_create([
+                RecipientLifetimeBalance(payment_recipient_id=recipient_id, received=total)
+                for recipient_id, total in lifetime.items()
+            ])
+            CacheVersion.objects.bump(CacheVersion.RECIPIENTS)
+        return len(monthly), len(lifetime)
+
+
+class RecipientMonthlyBalance(models.Model):
+    """Denormalized amount received per recipient and (UTC) month, maintained on every payment write"""
+    payment_recipient = models.ForeignKey(
+        PaymentRecipient,
+        verbose_name='Destinatario',
+        on_delete=models.CASCADE,
+        related_name='monthly_balances'
+    )
+    month = models.DateField(
+        verbose_name='Mes',
+        help_text='Primer día del mes'
+    )
+    received = models.BigIntegerField(
+        verbose_name='Recibido',
+        default=0
+    )
+    updated_at = models.DateTimeField(
+        verbose_name='Actualizado',
+        auto_now=True
+    )
+    
+    objects = RecipientBalanceManager()
+    
+    class Meta:
+        verbose_name = 'Saldo mensual'
+        verbose_name_plural = 'Saldos mensuales'
+        constraints = [
+            models.UniqueConstraint(fields=['payment_recipient', 'month'], name='unique_recipient_month_balance'),
+        ]
+        indexes = [
+            # Latest change and the rows changed since, read by the availability index
+            models.Index(fields=['updated_at'], name='monthly_balance_updated_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.payment_recipient_id} {self.month:%Y-%m}: ${self.received}"
+
+
+class RecipientLifetimeBalance(models.Model):
+    """Denormalized amount ever received per recipient, used by the one-time payment rule"""
+    # Kept for every recipient so toggling is_recurring never requires a rebuild
+    payment_recipient = models.OneToOneField(
+        PaymentRecipient,
+        verbose_name='Destinatario',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='lifetime_balance'
+    )
+    received = models.BigIntegerField(
+        verbose_name='Recibido',
+        default=0
+    )
+    
+    class Meta:
+        verbose_name = 'Saldo histórico'
+        verbose_name_plural = 'Saldos históricos'
+    
+    def __str__(self):
+        return f"{self.payment_recipient_id}: ${self.received}"
+
+
+class CacheVersionManager(models.Manager):
+    def get_version(self, name):
+        return self.filter(name=name).values_list('version', flat=True).first()
+    
+    def bump(self, name):
+        """Mark every in-process cache for name as stale, in all workers"""
+        # A random token instead of a counter: a rolled back bump can never be mistaken for a later one
+        version = secrets.randbits(62)
+        if not self.filter(name=name).update(version=version):
+            self.bulk_create([self.model(name=name, version=version)], ignore_conflicts=True)
+            self.filter(name=name).update(version=version)
+        return version
+
+
+class CacheVersion(models.Model):
+    """Shared version token used by workers to detect changes made by other processes"""
+    RECIPIENTS = 'recipients'
+    
+    name = models.CharField(
+        max_length=50,
+        primary_key=True
+    )
+    version = models.BigIntegerField(default=0)
+    
+    objects = CacheVersionManager()
+    
+    class Meta:
+        verbose_name = 'Versión de caché'
+        verbose_name_plural = 'Versiones de caché'
+    
+    def __str__(self):
+        return f"{self.name}: {self.version}"
+
+
+class MonthlySnapshotManager(models.Manager):
+    SCOPE_FIELDS = {
+        'recipient': 'payment_recipient_id',
+        'specialist': 'specialist_id',
+        'operator': 'operator_user_id',
+    }
+    
+    def close_month(self, month, force=False):
+        """
+        Write per-recipient, per-specialist and per-operator totals for a (local) calendar month.
+        Idempotent: returns False if the month was already closed, unless force recomputes it.
+        """
+        month = month.replace(day=1)
+        start, end = local_month_range(month.year, month.month)
+        try:
+            with transaction.atomic():
+                if force:
+                    MonthClose.objects.filter(month=month).delete()
+                    self.filter(month=month).delete()
+                # Inserting the close marker first makes concurrent workers fail fast on the unique month
+                MonthClose.objects.create(month=month)
+                self.bulk_create(self._merge(self._compute(start, end, month)))
+        except IntegrityError:
+            return False
+        return True
+    
+    def _compute(self, start, end, month):
+        """Aggregate live and archived payments in [start, end) per scope"""
+        snapshots = []
+        for scope, field in self.SCOPE_FIELDS.items():
+            for model in (Payment, ArchivedPayment):
+                rows = model.objects.filter(created_at__gte=start, created_at__lt=end).values(field).annotate(
+                    total=models.Sum('amount'), count=models.Count('pk')
+                ).order_by()
+                snapshots.extend(
+                    self.model(month=month, scope=scope, object_id=row[field],
+                               total_amount=row['total'], payment_count=row['count'])
+                    for row in rows
+                )
+        return snapshots
+    
+    @staticmethod
+    def _merge(snapshots):
+        """Combine rows for the same scope and object coming from live and archived payments"""
+        merged = {}
+        for snapshot in snapshots:
+            key = (snapshot.scope, snapshot.object_id)
+            if key in merged:
+                merged[key].total_amount += snapshot.total_amount
+                merged[key].payment_count += snapshot.payment_count
+            else:
+                merged[key] = snapshot
+        return list(merged.values())
+    
+    def close_pending_months(self):
+        """
+        Close every month before the current (local) one that has payments and no snapshot yet,
+        then renumber recipient priorities if any month was closed
+        """
+        current = timezone.localdate().replace(day=1)
+        last_closed = MonthClose.objects.order_by('-month').values_list('month', flat=True).first()
+        if last_closed:
+            month = (last_closed + timedelta(days=32)).replace(day=1)
+        else:
+            first_payment = Payment.objects.order_by('created_at').values_list('created_at', flat=True).first()
+            if first_payment is None:
+                return []
+            month = timezone.localtime(first_payment).date().replace(day=1)
+        
+        closed = []
+        while month < current:
+            if self.close_month(month):
+                closed.append(month)
+            month = (month + timedelta(days=32)).replace(day=1)
+        if closed:
+            # Monthly housekeeping: stored priority numbers drift from the sort key order between renumbers
+            PaymentRecipient.objects.renumber()
+        return closed
+    
+    def get_monthly_totals(self, month):
+        """Same dict as Payment.get_monthly_totals, read from a closed month's snapshot"""
+        totals = self.filter(month=month).aggregate(
+            total_amount=models.Sum('total_amount', filter=models.Q(scope=MonthlySnapshot.RECIPIENT)),
+            payment_count=models.Sum('payment_count', filter=models.Q(scope=MonthlySnapshot.RECIPIENT)),
+            unique_recipients=models.Count('pk', filter=models.Q(scope=MonthlySnapshot.RECIPIENT)),
+            unique_operators=models.Count('pk', filter=models.Q(scope=MonthlySnapshot.OPERATOR)),
+        )
+        return {key: value or 0 for key, value in totals.items()}
+
+
+class MonthClose(models.Model):
+    """Marks a (local) calendar month whose totals have been written to MonthlySnapshot"""
+    month = models.DateField(
+        verbose_name='Mes',
+        unique=True,
+        help_text='Primer día del mes cerrado'
+    )
+    closed_at = models.DateTimeField(
+        verbose_name='Cerrado',
+        default=timezone.now
+    )
+    
+    class Meta:
+        ordering = ['-month']
+        verbose_name = 'Cierre mensual'
+        verbose_name_plural = 'Cierres mensuales'
+    
+    def __str__(self):
+        return f"{self.month:%Y-%m}"
+
+
+class MonthlySnapshot(models.Model):
+    """Payment totals of a closed month for one recipient, specialist or operator"""
+    RECIPIENT = 'recipient'
+    SPECIALIST = 'specialist'
+    OPERATOR = 'operator'
+    
+    SCOPE_CHOICES = [
+        (RECIPIENT, 'Destinatario'),
+        (SPECIALIST, 'Especialista'),
+        (OPERATOR, 'Operador'),
+    ]
+    
+    month = models.DateField(verbose_name='Mes')
+    scope = models.CharField(
+        verbose_name='Tipo',
+        max_length=20,
+        choices=SCOPE_CHOICES
+    )
+    object_id = models.PositiveBigIntegerField(verbose_name='ID')
+    total_amount = models.BigIntegerField(
+        verbose_name='Total',
+        default=0
+    )
+    payment_count = models.PositiveIntegerField(
+        verbose_name='Pagos',
+        default=0
+    )
+    
+    objects = MonthlySnapshotManager()
+    
+    class Meta:
+        ordering = ['-month', 'scope', 'object_id']
+        verbose_name = 'Resumen mensual'
+        verbose_name_plural = 'Resúmenes mensuales'
+        constraints = [
+            models.UniqueConstraint(fields=['month', 'scope', 'object_id'], name='unique_monthly_snapshot'),
+        ]
+    
+    def __str__(self):
+        return f"{self.month:%Y-%m} {self.scope} {self.object_id}: ${self.total_amount}"
+
+
+class ArchivedPaymentManager(models.Manager):
+    def archive_before(self, cutoff, batch_size=1000):
+        """
+        Move payments created before cutoff into the archive table, in batches.
+        Recipient balances are left untouched: archived payments still count towards them.
+        """
+        moved = 0
+        while True:
+            with transaction.atomic():
+                batch = list(Payment.objects.filter(created_at__lt=cutoff).order_by('pk')[:batch_size])
+                if not batch:
+                    break
+                self.bulk_create([
+                    self.model(
+                        id=payment.id,
+                        amount=payment.amount,
+                        payment_recipient_id=payment.payment_recipient_id,
+                        specialist_id=payment.specialist_id,
+                        operator_user_id=payment.operator_user_id,
+                        proof_of_payment_file=payment.proof_of_payment_file.name,
+                        notes=payment.notes,
+                        compression_profile=payment.compression_profile,
+                        original_size=payment.original_size,
+                        compressed_size=payment.compressed_size,
+                        created_at=payment.created_at,
+                    )
+                    for payment in batch
+                ])
+                # The delete handlers see the archived copies (Payment.is_being_archived) and leave the
+                # balance ledger and the proof blob references alone: the payments still hold both
+                Payment.objects.filter(pk__in=[payment.pk for payment in batch]).delete()
+            moved += len(batch)
+        return moved
+
+
+class ArchivedPayment(models.Model):
+    """Payment moved out of the live table after its month was closed; same id as the original"""
+    id = models.BigIntegerField(primary_key=True)
+    amount = models.PositiveIntegerField(verbose_name='Monto')
+    payment_recipient = models.ForeignKey(
+        PaymentRecipient,
+        verbose_name='Destinatario',
+        on_delete=models.PROTECT,
+        related_name='archived_payments'
+    )
+    specialist = models.ForeignKey(
+        Specialist,
+        verbose_name='Especialista',
+        on_delete=models.PROTECT,
+        related_name='archived_payments'
+    )
+    proof_of_payment_file = models.FileField(
+        verbose_name='Comprobante',
+        upload_to=modify_file_name
+    )
+    operator_user = models.ForeignKey(
+        User,
+        verbose_name='Operador',
+        on_delete=models.PROTECT,
+        related_name='archived_payments'
+    )
+    notes = models.TextField(
+        verbose_name='Notas',
+        blank=True
+    )
+    compression_profile = models.CharField(
+        verbose_name='Perfil de compresión',
+        max_length=20,
+        choices=Payment.COMPRESSION_PROFILE_CHOICES,
+        blank=True
+    )
+    original_size = models.PositiveIntegerField(
+        verbose_name='Tamaño original',
+        null=True,
+        blank=True
+    )
+    compressed_size = models.PositiveIntegerField(
+        verbose_name='Tamaño comprimido',
+        null=True,
+        blank=True
+    )
+    created_at = models.DateTimeField(verbose_name='Creado')
+    archived_at = models.DateTimeField(
+        verbose_name='Archivado',
+        auto_now_add=True
+    )
+    
+    objects = ArchivedPaymentManager()
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Pago archivado'
+        verbose_name_plural = 'Pagos archivados'
+        indexes = [
+            models.Index(fields=['proof_of_payment_file'], name='archived_proof_file_idx'),
+            # Month windows of the proof packing and cold storage candidates
+            models.Index(fields=['created_at'], name='archived_created_at_idx'),
+        ]
+    
+    def __str__(self):
+        return f"${self.amount} to {self.payment_recipient_id} on {self.created_at.strftime('%Y-%m-%d')}"
+
+
+class CompressionJobManager(models.Manager):
+    MAX_ATTEMPTS = 5
+    RETRY_DELAY = timedelta(seconds=30)
+    # A running job not finished within this time is assumed lost with its worker and claimed again
+    LEASE = timedelta(minutes=10)
+    
+    def enqueue(self, file_name, content_type='', source_sha256=''):
+        return self.create(file_name=file_name, content_type=content_type or '', source_sha256=source_sha256)
+    
+    def claim(self, limit):
+        """
+        Mark up to limit due jobs as running and return them, oldest first.
+        Each job is taken with a conditional UPDATE, so concurrent workers never claim the same job.
+        """
+        now = timezone.now()
+        due = models.Q(status=CompressionJob.PENDING, available_at__lte=now) | models.Q(
+            status=CompressionJob.RUNNING, started_at__lt=now - self.LEASE
+        )
+        claimed = []
+        for job in self.filter(due).order_by('available_at', 'pk')[:limit]:
+            taken = self.filter(pk=job.pk, status=job.status, attempts=job.attempts).update(
+                status=CompressionJob.RUNNING,
+                started_at=now,
+                attempts=models.F('attempts') + 1,
+            )
+            if taken:
+                job.status = CompressionJob.RUNNING
+                job.started_at = now
+                job.attempts += 1
+                claimed.append(job)
+        return claimed
+    
+    def complete(self, job, blob):
+        """
+        Point every payment using the original file at the compressed blob, recording its profile and size,
+        count the references and close the job
+        """
+        compressed = {
+            'proof_of_payment_file': blob.name,
+            'compression_profile': blob.profile,
+            'compressed_size': blob.size,
+        }
+        with transaction.atomic():
+            updated = Payment.objects.filter(proof_of_payment_file=job.file_name).update(
+                proof_status=Payment.PROOF_READY,
+                **compressed
+            )
+            updated += ArchivedPayment.objects.filter(proof_of_payment_file=job.file_name).update(**compressed)
+            ProofBlob.objects.acquire(blob, updated, allow_new=True)
+            if not updated:
+                # Every payment using the file was deleted while it was being compressed
+                ProofBlob.objects.release(blob.name, count=0)
+            self.filter(pk=job.pk).update(status=CompressionJob.DONE, finished_at=timezone.now(), last_error='')
+        return updated
+    
+    def fail(self, job, error):
+        """Schedule a retry with exponential backoff, or give up and keep the original file"""
+        now = timezone.now()
+        with transaction.atomic():
+            if job.attempts >= self.MAX_ATTEMPTS:
+                self.filter(pk=job.pk).update(status=CompressionJob.FAILED, finished_at=now, last_error=error)
+                Payment.objects.filter(proof_of_payment_file=job.file_name).update(
+                    proof_status=Payment.PROOF_FAILED
+                )
+                return False
+            self.filter(pk=job.pk).update(
+                status=CompressionJob.PENDING,
+                available_at=now + self.RETRY_DELAY * 2 ** (job.attempts - 1),
+                last_error=error,
+            )
+        return True
+    
+    def retry(self, queryset=None):
+        """Put failed jobs back in the queue with a fresh attempt count"""
+        queryset = self.all() if queryset is None else queryset
+        with transaction.atomic():
+            jobs = queryset.filter(status=CompressionJob.FAILED)
+            Payment.objects.filter(
+                proof_of_payment_file__in=jobs.values('file_name')
+            ).update(proof_status=Payment.PROOF_PROCESSING)
+            return jobs.update(
+                status=CompressionJob.PENDING, attempts=0, available_at=timezone.now(), finished_at=None
+            )
+    
+    def purge(self, older_than):
+        """Delete finished jobs older than the given timedelta"""
+        return self.filter(status=CompressionJob.DONE, finished_at__lt=timezone.now() - older_than).delete()[0]
+    
+    def stats(self, window=timedelta(hours=1)):
+        """Queue depth by status plus wait and total latency of the jobs finished within window"""
+        now = timezone.now()
+        counts = dict(self.order_by().values_list('status').annotate(count=models.Count('pk')))
+        oldest = self.filter(status=CompressionJob.PENDING).aggregate(oldest=models.Min('created_at'))['oldest']
+        
+        waits, latencies = [], []
+        recent = self.filter(status=CompressionJob.DONE, finished_at__gte=now - window).values_list(
+            'created_at', 'started_at', 'finished_at'
+        )
+        for created_at, started_at, finished_at in recent:
+            waits.append((started_at - created_at).total_seconds())
+            latencies.append((finished_at - created_at).total_seconds())
+        latencies.sort()
         
         return {
-            'total_amount': payments.aggregate(total=models.Sum('amount'))['total'] or 0,
-            'payment_count': payments.count(),
-            'unique_recipients': payments.values('payment_recipient').distinct().count(),
-            'unique_operators': payments.values('operator_user').distinct().count(),
-        }
\ No newline at end of file
+            'pending': counts.get(CompressionJob.PENDING, 0),
+            'running': counts.get(CompressionJob.RUNNING, 0),
+            'failed': counts.get(CompressionJob.FAILED, 0),
+            'done': counts.get(CompressionJob.DONE, 0),
+            'oldest_pending_seconds': (now - oldest).total_seconds() if oldest else 0,
+            'recent_jobs': len(latencies),
+            'avg_wait_seconds': sum(waits) / len(waits) if waits else 0,
+            'avg_latency_seconds': sum(latencies) / len(latencies) if latencies else 0,
+            'p95_latency_seconds': latencies[int(len(latencies) * 0.95)] if latencies else 0,
+        }
+
+
+class CompressionJob(models.Model):
+    """Stored proof waiting to be compressed; this table is the persistent queue read by the compression worker"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    
+    STATUS_CHOICES = [
+        (PENDING, 'Pendiente'),
+        (RUNNING, 'En proceso'),
+        (DONE, 'Completado'),
+        (FAILED, 'Fallido'),
+    ]
+    
+    file_name = models.CharField(
+        verbose_name='Archivo original',
+        max_length=255
+    )
+    content_type = models.CharField(
+        verbose_name='Tipo de contenido',
+        max_length=100,
+        blank=True
+    )
+    status = models.CharField(
+        verbose_name='Estado',
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(
+        verbose_name='Intentos',
+        default=0
+    )
+    source_sha256 = models.CharField(
+        verbose_name='Hash del original',
+        max_length=64,
+        blank=True
+    )
+    last_error = models.TextField(
+        verbose_name='Último error',
+        blank=True
+    )
+    created_at = models.DateTimeField(
+        verbose_name='Encolado',
+        auto_now_add=True
+    )
+    available_at = models.DateTimeField(
+        verbose_name='Disponible desde',
+        default=timezone.now
+    )
+    started_at = models.DateTimeField(
+        verbose_name='Iniciado',
+        null=True,
+        blank=True
+    )
+    finished_at = models.DateTimeField(
+        verbose_name='Finalizado',
+        null=True,
+        blank=True
+    )
+    
+    objects = CompressionJobManager()
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Trabajo de compresión'
+        verbose_name_plural = 'Trabajos de compresión'
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='compressionjob_due_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.file_name} ({self.status})"
+    
+    def get_latency(self):
+        """Seconds from enqueue to completion, or None while the job is not done"""
+        if self.status != self.DONE or not self.finished_at:
+            return None
+        return (self.finished_at - self.created_at).total_seconds()
+
+
+class ProofBlobManager(models.Manager):
+    def store(self, file_obj, source_sha256='', profile=''):
+        """
+        Return the blob for this content, writing the file under its hash only the first time it is seen.
+        The blob is returned with the references it already has; callers add theirs with acquire().
+        """
+        sha256 = hash_file(file_obj)
+        extension = os.path.splitext(file_obj.name)[1].lower() or '.jpg'
+        name = f"{ProofBlob.ROOT}/{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}"
+        storage = ProofBlob.storage()
+        if not storage.exists(name):
+            file_obj.seek(0)
+            saved = storage.save(name, file_obj)
+            if saved != name:
+                # Another worker wrote the same content first; keep its copy
+                storage.delete(saved)
+        
+        blob, created = self.get_or_create(
+            sha256=sha256,
+            defaults={'name': name, 'size': storage.size(name), 'source_sha256': source_sha256, 'profile': profile},
+        )
+        if not created and source_sha256 and not blob.source_sha256:
+            self.filter(pk=blob.pk, source_sha256='').update(source_sha256=source_sha256)
+        return blob
+    
+    def acquire(self, blob, count, allow_new=False):
+        """
+        Add count references to blob. Fails (returns False) if the blob was released in the meantime,
+        unless allow_new, used for a blob just stored that may not have any reference yet.
+        """
+        queryset = self.filter(pk=blob.pk)
+        if not allow_new:
+            queryset = queryset.filter(ref_count__gt=0)
+        return bool(queryset.update(ref_count=models.F('ref_count') + count))
+    
+    def release(self, name, count=1):
+        """Drop count references to the blob stored as name; the last one deletes the row and, after commit, the file"""
+        if not name or not name.startswith(ProofBlob.ROOT + '/'):
+            return
+        with transaction.atomic():
+            self.filter(name=name, ref_count__gte=count).update(ref_count=models.F('ref_count') - count)
+            if self.filter(name=name, ref_count=0).delete()[0]:
+                # A packed copy stays inside its pack but is no longer readable
+                PackedProof.objects.filter(name=name).delete()
+                transaction.on_commit(lambda: ProofBlob.delete_files(name))
+    
+    def replace(self, name, blob):
+        """
+        Point every live and archived payment using the file name at blob in one transaction, moving the
+        references over. The old file is removed after commit: by release() for a blob, directly otherwise.
+        Payments are found through the proof_of_payment_file indexes of both tables.
+        Returns the number of payments updated.
+        """
+        compressed = {
+            'proof_of_payment_file': blob.name,
+            'compression_profile': blob.profile,
+            'compressed_size': blob.size,
+        }
+        with transaction.atomic():
+            updated = Payment.objects.filter(proof_of_payment_file=name).update(**compressed)
+            updated += ArchivedPayment.objects.filter(proof_of_payment_file=name).update(**compressed)
+            self.acquire(blob, updated, allow_new=True)
+            if not updated:
+                # Every payment using the file was deleted in the meantime
+                self.release(blob.name, count=0)
+            elif name.startswith(ProofBlob.ROOT + '/'):
+                self.release(name, count=updated)
+            else:
+                PackedProof.objects.filter(name=name).delete()
+                transaction.on_commit(lambda: ProofBlob.delete_files(name))
+        return updated
+
+
+class ProofBlob(models.Model):
+    """Compressed proof stored once under its content hash and shared by every payment that uses it"""
+    ROOT = 'comprobantes/blobs'
+    
+    sha256 = models.CharField(
+        verbose_name='Hash',
+        max_length=64,
+        unique=True
+    )
+    source_sha256 = models.CharField(
+        verbose_name='Hash del original',
+        max_length=64,
+        blank=True,
+        db_index=True,
+        help_text='Hash del archivo subido que produjo este comprobante, para detectar duplicados'
+    )
+    name = models.CharField(
+        verbose_name='Archivo',
+        max_length=255,
+        unique=True
+    )
+    size = models.PositiveIntegerField(
+        verbose_name='Tamaño',
+        default=0
+    )
+    profile = models.CharField(
+        verbose_name='Perfil de compresión',
+        max_length=20,
+        choices=Payment.COMPRESSION_PROFILE_CHOICES,
+        blank=True
+    )
+    ref_count = models.PositiveIntegerField(
+        verbose_name='Referencias',
+        default=0
+    )
+    created_at = models.DateTimeField(
+        verbose_name='Creado',
+        auto_now_add=True
+    )
+    
+    objects = ProofBlobManager()
+    
+    class Meta:
+        verbose_name = 'Archivo de comprobante'
+        verbose_name_plural = 'Archivos de comprobante'
+    
+    def __str__(self):
+        return f"{self.name} ({self.ref_count})"
+    
+    @staticmethod
+    def storage():
+        return Payment._meta.get_field('proof_of_payment_file').storage
+    
+    @staticmethod
+    def delete_files(name):
+        """Remove a released blob and its thumbnail from storage"""
+        from .utils.thumbnails import delete_thumbnail
+        
+        ProofBlob.storage().delete(name)
+        delete_thumbnail(name)
+
+
+class PackedProof(models.Model):
+    """
+    Proof file moved into a monthly pack (an uncompressed ZIP archive) to keep the media tree small;
+    its bytes are read straight from the pack at offset
+    """
+    ROOT = 'comprobantes/packs'
+    
+    name = models.CharField(
+        verbose_name='Archivo',
+        max_length=255,
+        unique=True
+    )
+    pack = models.CharField(
+        verbose_name='Paquete',
+        max_length=255,
+        db_index=True
+    )
+    offset = models.PositiveBigIntegerField(
+        verbose_name='Posición'
+    )
+    size = models.PositiveIntegerField(
+        verbose_name='Tamaño'
+    )
+    created_at = models.DateTimeField(
+        verbose_name='Empaquetado',
+        auto_now_add=True
+    )
+    
+    class Meta:
+        verbose_name = 'Comprobante empaquetado'
+        verbose_name_plural = 'Comprobantes empaquetados'
+    
+    def __str__(self):
+        return f"{self.name} ({self.pack})"
+    
+    def read(self):
+        """Bytes of the packed file, read with one seek into the pack"""
+        with ProofBlob.storage().open(self.pack, 'rb') as pack:
+            pack.seek(self.offset)
+            return pack.read(self.size)
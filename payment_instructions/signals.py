@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_delete, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Payment, PaymentRecipient, RecipientMonthlyBalance, CacheVersion, ArchivedPayment, ProofBlob
+from .utils.recipient_index import recipient_index
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """Apply settings.SQLITE_PRAGMAS to every new SQLite connection"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+
+
+@receiver(pre_delete, sender=Payment)
+def remove_payment_from_balances(sender, instance, **kwargs):
+    """Subtract a deleted payment from its recipient balances (runs inside the delete transaction)"""
+    if instance.is_being_archived():
+        return
+    stored = instance.get_stored_state()
+    if stored:
+        RecipientMonthlyBalance.objects.record_payment(stored, sign=-1)
+
+
+@receiver(post_delete, sender=Payment)
+@receiver(post_delete, sender=ArchivedPayment)
+def release_proof_blob(sender, instance, **kwargs):
+    """Drop the deleted payment's reference to its shared proof file (the last one removes it)"""
+    if sender is Payment and instance.is_being_archived():
+        return
+    ProofBlob.objects.release(instance.proof_of_payment_file.name)
+
+
+def invalidate_recipient_index():
+    """Invalidate the availability index in this worker now and in the others through the shared version"""
+    CacheVersion.objects.bump(CacheVersion.RECIPIENTS)
+    recipient_index.invalidate()
+    transaction.on_commit(recipient_index.invalidate)
+
+
+@receiver(post_save, sender=PaymentRecipient)
+@receiver(post_delete, sender=PaymentRecipient)
+def recipient_capacity_changed(sender, **kwargs):
+    # Payments don't invalidate: the index picks up their balance ledger updates by themselves
+    invalidate_recipient_index()
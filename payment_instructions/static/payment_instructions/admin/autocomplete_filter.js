@@ -0,0 +1,12 @@
+'use strict';
+{
+    const $ = django.jQuery;
+
+    // Apply an autocomplete list filter as soon as a value is picked
+    $(document).on('change', '.autocomplete-filter', function() {
+        const params = new URLSearchParams(window.location.search);
+        params.set(this.dataset.parameter, this.value);
+        params.delete('p');
+        window.location.search = params.toString();
+    });
+}
@@ -1,3 +1,1455 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+from xml.etree import ElementTree
 
-# Create your tests here.
+import fitz
+from PIL import Image
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.core.files import File
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.urls import reverse
+
+from .models import (
+    User, PaymentRecipient, Payment, Specialist, RecipientMonthlyBalance, RecipientLifetimeBalance, CacheVersion,
+    CapacityExceeded, MonthlySnapshot, ArchivedPayment, CompressionJob, ProofBlob, MonthClose, PackedProof,
+    local_month_range,
+)
+from .utils.allocation import STRATEGIES, plan_split
+from .utils.cold_storage import cold_candidates
+from .utils.compression_queue import compress_stored_proof, process_jobs
+from .utils.exports import EXPORT_HEADER
+from .utils.proof_packs import month_candidates, open_proof
+from .utils.query_plans import explain, full_scans
+from .utils.thumbnails import generate_thumbnail, render_thumbnail, thumbnail_name, thumbnail_version
+from .utils.file_compression import FileCompressor, SizeTargetEncoder
+from .management.commands.benchmark_compression import make_receipt
+from .upload_handlers import MAX_PROOF_SIZE, PROOF_INVALID_TYPE, PROOF_TOO_LARGE, PROOF_TOO_MANY_PIXELS
+from .utils.recipient_index import recipient_index
+
+
+def make_pdf(pages=1):
+    document = fitz.open()
+    for number in range(pages):
+        document.new_page().insert_text((72, 72), f'Comprobante {number + 1}')
+    return document.tobytes()
+
+
+def crash_worker(*args):
+    """Stands in for a pool task whose process is killed"""
+    os._exit(1)
+
+
+def make_png(size=(1600, 1200)):
+    output = BytesIO()
+    Image.new('RGB', size, (240, 240, 240)).save(output, format='PNG')
+    return output.getvalue()
+
+
+class TemporaryMediaMixin:
+    """Points MEDIA_ROOT at a directory that lives only as long as the test class"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+
+class RecipientSelectionTestCase(TestCase):
+    """Shared fixtures for recipient selection tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.operator = User.objects.create_user(username='operator', email='operator@example.com', password='secret')
+        cls.specialist = Specialist.objects.create(name='Especialista')
+
+    @classmethod
+    def create_recipient(cls, alias, **kwargs):
+        kwargs.setdefault('name', alias)
+        kwargs.setdefault('max_amount', 10000)
+        kwargs.setdefault('priority_order', PaymentRecipient.objects.count() + 1)
+        return PaymentRecipient.objects.create(alias=alias, **kwargs)
+
+    @classmethod
+    def create_payment(cls, recipient, amount):
+        return Payment.objects.create(
+            amount=amount,
+            payment_recipient=recipient,
+            specialist=cls.specialist,
+            operator_user=cls.operator,
+            proof_of_payment_file='comprobantes/test.jpg',
+        )
+
+
+class FindBestRecipientTests(RecipientSelectionTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.full = cls.create_recipient('full', max_amount=5000)
+        cls.create_payment(cls.full, 5000)
+        cls.partial = cls.create_recipient('partial', max_amount=8000)
+        cls.create_payment(cls.partial, 3000)
+        cls.used_onetime = cls.create_recipient('used_onetime', max_amount=20000, is_recurring=False)
+        cls.create_payment(cls.used_onetime, 100)
+        cls.threshold = cls.create_recipient('threshold', max_amount=50000, min_threshold=10000)
+        cls.onetime = cls.create_recipient('onetime', max_amount=30000, is_recurring=False)
+        cls.inactive = cls.create_recipient('inactive', max_amount=100000, is_active=False)
+        cls.fallback = cls.create_recipient('fallback', max_amount=15000)
+
+    def legacy_best_recipient(self, amount):
+        """Reference implementation: per-recipient checks in priority order"""
+        for recipient in PaymentRecipient.objects.filter(is_active=True).order_by('sort_key', 'name'):
+            if recipient.can_receive_amount(amount):
+                return recipient
+        return None
+
+    def test_matches_per_recipient_logic(self):
+        for amount in [1, 3000, 5000, 5001, 9999, 10000, 15000, 30000, 40000, 50000, 50001]:
+            with self.subTest(amount=amount):
+                expected = self.legacy_best_recipient(amount)
+                self.assertEqual(PaymentRecipient.objects.find_best_recipient(amount, use_index=False), expected)
+                self.assertEqual(PaymentRecipient.objects.find_best_recipient(amount), expected)
+
+    def test_available_recipients_match_per_recipient_logic(self):
+        for amount in [1, 5000, 10000, 30000]:
+            with self.subTest(amount=amount):
+                expected = [
+                    r for r in PaymentRecipient.objects.filter(is_active=True).order_by('sort_key', 'name')
+                    if r.can_receive_amount(amount)
+                ]
+                self.assertEqual(list(PaymentRecipient.objects.get_available_recipients(amount)), expected)
+
+    def test_single_query_regardless_of_recipient_count(self):
+        with self.assertNumQueries(1):
+            PaymentRecipient.objects.find_best_recipient(12000, use_index=False)
+
+        for i in range(30):
+            recipient = self.create_recipient(f'extra_{i}', max_amount=1000)
+            self.create_payment(recipient, 500)
+
+        with self.assertNumQueries(1):
+            best = PaymentRecipient.objects.find_best_recipient(12000, use_index=False)
+        self.assertEqual(best, self.threshold)
+
+
+class RecipientBalanceLedgerTests(RecipientSelectionTestCase):
+
+    def assertLedgerInSync(self):
+        expected_monthly, expected_lifetime = RecipientMonthlyBalance.objects.compute_from_payments()
+        stored_monthly = {
+            (row.payment_recipient_id, row.month): row.received
+            for row in RecipientMonthlyBalance.objects.exclude(received=0)
+        }
+        stored_lifetime = dict(
+            RecipientLifetimeBalance.objects.exclude(received=0).values_list('payment_recipient_id', 'received')
+        )
+        self.assertEqual(stored_monthly, expected_monthly)
+        self.assertEqual(stored_lifetime, expected_lifetime)
+
+    def test_create_update_move_and_delete(self):
+        first = self.create_recipient('first', max_amount=10000)
+        second = self.create_recipient('second', max_amount=10000, is_recurring=False)
+
+        payment = self.create_payment(first, 4000)
+        self.create_payment(first, 1000)
+        self.assertEqual(first.get_current_month_received(), 5000)
+        self.assertLedgerInSync()
+
+        payment = Payment.objects.get(pk=payment.pk)
+        payment.amount = 6000
+        payment.save()
+        self.assertEqual(first.get_remaining_amount(), 3000)
+        self.assertLedgerInSync()
+
+        payment.payment_recipient = second
+        payment.save()
+        self.assertEqual(first.get_current_month_received(), 1000)
+        self.assertEqual(second.get_status(), 'completed_onetime')
+        self.assertEqual(second.suggest_max_payment(), 0)
+        self.assertLedgerInSync()
+
+        Payment.objects.filter(payment_recipient=second).delete()
+        self.assertEqual(second.get_status(), 'available_onetime')
+        self.assertEqual(second.suggest_max_payment(), 10000)
+        self.assertLedgerInSync()
+
+    def test_exclude_payment_uses_stored_amount(self):
+        recipient = self.create_recipient('recipient', max_amount=10000)
+        payment = self.create_payment(recipient, 7000)
+        payment.amount = 9000
+        self.assertTrue(recipient.can_receive_amount(payment.amount, exclude_payment=payment))
+        self.assertEqual(recipient.get_remaining_amount(exclude_payment=payment), 10000)
+
+    def test_capacity_checks_do_not_scan_payments(self):
+        recipient = self.create_recipient('recipient', max_amount=10000)
+        for _ in range(20):
+            self.create_payment(recipient, 100)
+        with self.assertNumQueries(1):
+            self.assertEqual(recipient.get_remaining_amount(), 8000)
+
+    def test_rebuild_fixes_drift(self):
+        recipient = self.create_recipient('recipient', max_amount=10000)
+        self.create_payment(recipient, 2500)
+        RecipientMonthlyBalance.objects.update(received=0)
+        RecipientLifetimeBalance.objects.update(received=0)
+        RecipientMonthlyBalance.objects.rebuild()
+        self.assertEqual(recipient.get_current_month_received(), 2500)
+        self.assertLedgerInSync()
+
+
+class RecipientAvailabilityIndexTests(RecipientSelectionTestCase):
+
+    def setUp(self):
+        recipient_index.invalidate()
+        self.first = self.create_recipient('first', max_amount=5000)
+        self.second = self.create_recipient('second', max_amount=20000)
+
+    def test_lookup_from_fresh_index_only_checks_version(self):
+        PaymentRecipient.objects.find_best_recipient(1000)
+        with self.assertNumQueries(1):
+            self.assertEqual(PaymentRecipient.objects.find_best_recipient(1000), self.first)
+
+    def test_payment_updates_index_without_rebuild(self):
+        self.assertEqual(PaymentRecipient.objects.find_best_recipient(3000), self.first)
+        version = CacheVersion.objects.get(name=CacheVersion.RECIPIENTS).version
+        self.create_payment(self.first, 4000)
+        self.assertEqual(CacheVersion.objects.get(name=CacheVersion.RECIPIENTS).version, version)
+        # Version check plus the changed ledger rows, no recipient query
+        with self.assertNumQueries(2):
+            self.assertEqual(PaymentRecipient.objects.find_best_recipient(3000), self.second)
+        with self.assertNumQueries(1):
+            self.assertEqual(PaymentRecipient.objects.find_best_recipient(3000), self.second)
+
+    def test_payment_from_another_worker_is_detected(self):
+        self.create_payment(self.first, 1000)
+        self.assertEqual(PaymentRecipient.objects.find_best_recipient(3000), self.first)
+        # Simulate another process writing the ledger: no local signal, no version bump
+        RecipientMonthlyBalance.objects.filter(payment_recipient=self.first).update(
+            received=4000, updated_at=timezone.now()
+        )
+        self.assertEqual(PaymentRecipient.objects.find_best_recipient(3000), self.second)
+
+    def test_change_from_another_worker_is_detected(self):
+        self.assertEqual(PaymentRecipient.objects.find_best_recipient(3000), self.first)
+        # Simulate another process: data changes and the shared version moves, no local signal
+        PaymentRecipient.objects.filter(pk=self.first.pk).update(is_active=False)
+        CacheVersion.objects.bump(CacheVersion.RECIPIENTS)
+        self.assertEqual(PaymentRecipient.objects.find_best_recipient(3000), self.second)
+
+
+class SearchAliasBatchTests(RecipientSelectionTestCase):
+
+    def setUp(self):
+        recipient_index.invalidate()
+        self.client.force_login(self.operator)
+        self.first = self.create_recipient('first', max_amount=5000)
+        self.onetime = self.create_recipient('onetime', max_amount=8000, is_recurring=False)
+        self.large = self.create_recipient('large', max_amount=20000, min_threshold=2000)
+
+    def post_amounts(self, amounts):
+        return self.client.post(
+            reverse('payment_instructions:search_alias_batch'),
+            data=json.dumps({'amounts': amounts}),
+            content_type='application/json',
+        )
+
+    def test_earlier_items_consume_capacity(self):
+        response = self.post_amounts([3000, 3000, 3000, 1000, 1000, 18000])
+        self.assertEqual(response.status_code, 200)
+        aliases = [result.get('alias') for result in response.json()['results']]
+        self.assertEqual(aliases, ['first', 'onetime', 'large', 'first', 'first', None])
+
+    def test_matches_single_lookup_for_one_amount(self):
+        for amount in [500, 6000, 9000, 25000]:
+            with self.subTest(amount=amount):
+                expected = PaymentRecipient.objects.find_best_recipient(amount, use_index=False)
+                result = self.post_amounts([amount]).json()['results'][0]
+                self.assertEqual(result.get('alias'), expected.alias if expected else None)
+
+    @override_settings(PAYMENT_ALLOCATION_STRATEGY='best_fit')
+    def test_follows_configured_strategy(self):
+        expected = PaymentRecipient.objects.find_best_recipient(3000, use_index=False)
+        self.assertEqual(expected, self.first)
+        response = self.post_amounts([3000, 3000, 2000])
+        aliases = [result.get('alias') for result in response.json()['results']]
+        self.assertEqual(aliases, ['first', 'onetime', 'first'])
+        # Suggestions work on copies: the shared index keeps the stored capacity
+        self.assertEqual(PaymentRecipient.objects.find_best_recipient(3000), self.first)
+
+    def test_rejects_invalid_amounts(self):
+        self.assertEqual(self.post_amounts(['abc']).status_code, 400)
+        self.assertEqual(self.post_amounts([0]).status_code, 400)
+        self.assertEqual(self.post_amounts([]).status_code, 400)
+
+
+class ConcurrentAllocationTests(TransactionTestCase):
+    """Operators racing for the same recipient on the file-backed SQLite test database"""
+
+    THREADS = 8
+    ATTEMPTS_PER_THREAD = 5
+
+    def setUp(self):
+        self.operator = User.objects.create_user(username='operator', email='operator@example.com')
+        self.specialist = Specialist.objects.create(name='Especialista')
+
+    def race(self, recipient, amount):
+        barrier = threading.Barrier(self.THREADS)
+        outcomes = []
+
+        def operator_session():
+            try:
+                barrier.wait()
+                for _ in range(self.ATTEMPTS_PER_THREAD):
+                    try:
+                        Payment.objects.allocate(
+                            amount=amount,
+                            payment_recipient=recipient,
+                            specialist=self.specialist,
+                            operator_user=self.operator,
+                            proof_of_payment_file='comprobantes/test.jpg',
+                        )
+                        outcomes.append('created')
+                    except CapacityExceeded:
+                        outcomes.append('rejected')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=operator_session) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_recurring_recipient_is_never_over_allocated(self):
+        recipient = PaymentRecipient.objects.create(alias='recurring', name='recurring', max_amount=10000)
+        outcomes = self.race(recipient, 1000)
+
+        self.assertEqual(len(outcomes), self.THREADS * self.ATTEMPTS_PER_THREAD)
+        self.assertEqual(outcomes.count('created'), 10)
+        self.assertEqual(recipient.payments.aggregate(total=Sum('amount'))['total'], 10000)
+        self.assertEqual(recipient.get_remaining_amount(), 0)
+
+    def test_one_time_recipient_receives_a_single_payment(self):
+        recipient = PaymentRecipient.objects.create(
+            alias='onetime', name='onetime', max_amount=10000, is_recurring=False
+        )
+        outcomes = self.race(recipient, 500)
+
+        self.assertEqual(outcomes.count('created'), 1)
+        self.assertEqual(recipient.payments.count(), 1)
+        self.assertEqual(recipient.get_total_received(), 500)
+
+
+class SQLiteTuningTests(TransactionTestCase):
+
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_connections_are_tuned(self):
+        self.assertEqual(self.pragma('journal_mode'), 'wal')
+        self.assertEqual(self.pragma('busy_timeout'), settings.SQLITE_PRAGMAS['busy_timeout'])
+        self.assertEqual(self.pragma('synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma('cache_size'), settings.SQLITE_PRAGMAS['cache_size'])
+        with CaptureQueriesContext(connection) as queries, transaction.atomic():
+            Specialist.objects.create(name='Especialista')
+        self.assertEqual(queries.captured_queries[0]['sql'], 'BEGIN IMMEDIATE')
+
+    def test_load_test_compares_profiles(self):
+        # Its own process: the command switches the default database to a scratch one and forks workers
+        result = subprocess.run(
+            [sys.executable, 'manage.py', 'load_test_database', '--duration', '0.5', '--workers', '2',
+             '--payments', '20', '--recipients', '3'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=120,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        lines = result.stdout.splitlines()
+        self.assertEqual([line.split()[0] for line in lines], ['profile', 'default', 'tuned'])
+        self.assertGreater(float(lines[2].split()[2]), 0)
+
+
+class AllocationStrategyTests(RecipientSelectionTestCase):
+
+    def setUp(self):
+        recipient_index.invalidate()
+        self.roomy = self.create_recipient('roomy', max_amount=50000)
+        self.tight = self.create_recipient('tight', max_amount=6000)
+        self.medium = self.create_recipient('medium', max_amount=20000, min_threshold=8000)
+
+    def test_fit_strategies(self):
+        manager = PaymentRecipient.objects
+        self.assertEqual(manager.find_best_recipient(5000, strategy='priority_first'), self.roomy)
+        self.assertEqual(manager.find_best_recipient(5000, strategy='best_fit'), self.tight)
+        self.assertEqual(manager.find_best_recipient(9000, strategy='best_fit'), self.medium)
+        self.assertEqual(manager.find_best_recipient(5000, strategy='worst_fit'), self.roomy)
+        self.assertEqual(manager.find_best_recipient(5000, strategy='best_fit', use_index=False), self.tight)
+        self.assertIsNone(manager.find_best_recipient(60000, strategy='best_fit'))
+
+    def test_weighted_round_robin_follows_weights(self):
+        strategy = STRATEGIES['weighted_round_robin']()
+        recipients = list(PaymentRecipient.objects.with_capacity().order_by('sort_key', 'name'))
+        selected = [strategy.select(recipients, 1000).alias for _ in range(56)]
+        self.assertEqual(selected.count('roomy'), 50)
+        self.assertEqual(selected.count('tight'), 6)
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            PaymentRecipient.objects.find_best_recipient(1000, strategy='random')
+
+
+class SplitPaymentTests(TemporaryMediaMixin, RecipientSelectionTestCase):
+
+    def setUp(self):
+        recipient_index.invalidate()
+        self.first = self.create_recipient('first', max_amount=10000)
+        self.onetime = self.create_recipient('onetime', max_amount=15000, is_recurring=False)
+        self.picky = self.create_recipient('picky', max_amount=30000, min_threshold=12000)
+        self.small = self.create_recipient('small', max_amount=5000)
+
+    def plan(self, amount):
+        return [(recipient.alias, leg) for recipient, leg in plan_split(amount)]
+
+    def test_single_leg_when_one_recipient_fits(self):
+        self.assertEqual(self.plan(8000), [('first', 8000)])
+
+    def test_fewest_legs_respecting_thresholds(self):
+        # 40000 needs two legs: picky (30000) plus one more, chosen by priority
+        self.assertEqual(self.plan(40000), [('first', 10000), ('picky', 30000)])
+        self.assertEqual(self.plan(33000), [('first', 10000), ('picky', 23000)])
+        self.assertEqual(self.plan(60000), [('first', 10000), ('onetime', 15000), ('picky', 30000), ('small', 5000)])
+        self.assertIsNone(plan_split(60001))
+
+    def test_used_onetime_recipient_is_skipped(self):
+        self.create_payment(self.onetime, 100)
+        recipient_index.invalidate()
+        self.assertEqual(self.plan(45000), [('first', 10000), ('picky', 30000), ('small', 5000)])
+
+    def test_bounded_search_with_many_recipients(self):
+        for i in range(300):
+            self.create_recipient(f'extra_{i}', max_amount=1000 + i)
+        recipient_index.invalidate()
+        legs = plan_split(50000)
+        self.assertEqual(sum(leg for _, leg in legs), 50000)
+        self.assertEqual(len(legs), 3)
+
+        legs = plan_split(65000)
+        self.assertEqual(sum(leg for _, leg in legs), 65000)
+        self.assertEqual(len(legs), 8)
+        for recipient, leg in legs:
+            self.assertTrue(recipient.min_threshold <= leg <= recipient.remaining)
+
+    def test_search_alias_offers_split_only_when_requested(self):
+        self.client.force_login(self.operator)
+        url = reverse('payment_instructions:search_alias')
+        response = self.client.post(url, data=json.dumps({'amount': 40000}), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(
+            url, data=json.dumps({'amount': 40000, 'allow_split': True}), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(leg['alias'], leg['amount']) for leg in response.json()['legs']],
+            [('first', '10000'), ('picky', '30000')],
+        )
+
+    def test_split_create_is_all_or_nothing(self):
+        self.client.force_login(self.operator)
+        url = reverse('payment_instructions:create_split_payment')
+
+        def post(legs):
+            return self.client.post(url, {
+                'legs': json.dumps(legs),
+                'specialist_id': self.specialist.pk,
+                'proof_of_payment_file': SimpleUploadedFile('proof.pdf', make_pdf(), 'application/pdf'),
+            })
+
+        response = post([{'alias': 'first', 'amount': 10000}, {'alias': 'small', 'amount': 6000}])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Payment.objects.exists())
+        self.assertEqual(self.first.get_current_month_received(), 0)
+
+        response = post([{'alias': 'first', 'amount': 10000}, {'alias': 'picky', 'amount': 30000}])
+        self.assertEqual(response.status_code, 200)
+        payments = Payment.objects.filter(pk__in=response.json()['payment_ids'])
+        self.assertEqual(payments.count(), 2)
+        self.assertEqual(len({payment.proof_of_payment_file.name for payment in payments}), 1)
+
+
+class MonthCloseTests(RecipientSelectionTestCase):
+
+    def setUp(self):
+        self.recipient = self.create_recipient('recipient', max_amount=100000)
+        self.other = self.create_recipient('other', max_amount=100000, is_recurring=False)
+        self.last_month = (timezone.localdate().replace(day=1) - timedelta(days=1)).replace(day=1)
+        start, _ = local_month_range(self.last_month.year, self.last_month.month)
+        for recipient, amount in [(self.recipient, 1000), (self.recipient, 2500), (self.other, 700)]:
+            payment = self.create_payment(recipient, amount)
+            Payment.objects.filter(pk=payment.pk).update(created_at=start + timedelta(days=3))
+        self.create_payment(self.recipient, 400)
+        RecipientMonthlyBalance.objects.rebuild()
+
+    def test_close_and_archive_keep_totals(self):
+        live_totals = Payment.get_monthly_totals(self.last_month.year, self.last_month.month)
+        self.assertEqual(live_totals['total_amount'], 4200)
+
+        self.assertEqual(MonthlySnapshot.objects.close_pending_months(), [self.last_month])
+        self.assertEqual(MonthlySnapshot.objects.close_pending_months(), [])
+        self.assertEqual(Payment.get_monthly_totals(self.last_month.year, self.last_month.month), live_totals)
+
+        start, _ = local_month_range(timezone.localdate().year, timezone.localdate().month)
+        ledger = list(RecipientMonthlyBalance.objects.order_by('pk').values_list('payment_recipient', 'month', 'received'))
+        self.assertEqual(ArchivedPayment.objects.archive_before(start), 3)
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(
+            list(RecipientMonthlyBalance.objects.order_by('pk').values_list('payment_recipient', 'month', 'received')), ledger
+        )
+
+        self.assertEqual(Payment.get_monthly_totals(self.last_month.year, self.last_month.month), live_totals)
+        # Archiving doesn't give one-time recipients their capacity back
+        self.assertEqual(self.other.get_status(), 'completed_onetime')
+        self.assertEqual(RecipientMonthlyBalance.objects.compute_from_payments()[1][self.other.pk], 700)
+
+
+class ReportingQueryTests(RecipientSelectionTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other_operator = User.objects.create_user(username='other', email='other@example.com')
+        cls.recurring = cls.create_recipient('recurring', max_amount=10000)
+        cls.used_onetime = cls.create_recipient('used_onetime', max_amount=5000, is_recurring=False)
+        cls.free_onetime = cls.create_recipient('free_onetime', max_amount=5000, is_recurring=False)
+        cls.create_recipient('inactive', max_amount=5000, is_active=False)
+        cls.create_payment(cls.recurring, 1500)
+        cls.create_payment(cls.recurring, 500)
+        cls.create_payment(cls.used_onetime, 800)
+        Payment.objects.create(
+            amount=300, payment_recipient=cls.recurring, specialist=cls.specialist,
+            operator_user=cls.other_operator, proof_of_payment_file='comprobantes/test.jpg',
+        )
+
+    def test_payment_summary_in_one_query(self):
+        with self.assertNumQueries(1):
+            summary = PaymentRecipient.get_payment_summary()
+        self.assertEqual(summary, {
+            'total_recipients': 4,
+            'active_recipients': 3,
+            'completed_this_month': 1,
+            'available_recipients': 2,
+            'total_capacity': 10000,
+            'total_used': 2300,
+            'recipients_by_status': {'available': 1, 'completed_onetime': 1, 'available_onetime': 1},
+        })
+
+    def test_monthly_totals_in_two_queries(self):
+        with self.assertNumQueries(2):
+            totals = Payment.get_monthly_totals()
+        self.assertEqual(totals, {
+            'total_amount': 3100, 'payment_count': 4, 'unique_recipients': 2, 'unique_operators': 2,
+        })
+
+    def test_grouped_totals(self):
+        with self.assertNumQueries(2):
+            by_operator = Payment.get_totals(group_by='operator')
+        self.assertEqual(
+            [(row['label'], row['total_amount'], row['payment_count']) for row in by_operator],
+            [('operator', 2800, 3), ('other', 300, 1)],
+        )
+        by_day = Payment.get_totals(group_by='day')
+        self.assertEqual([row['key'] for row in by_day], [timezone.localdate()])
+        self.assertEqual(Payment.get_totals(end=timezone.now() - timedelta(days=1)), {
+            'total_amount': 0, 'payment_count': 0,
+        })
+
+
+class PriorityOrderingTests(RecipientSelectionTestCase):
+
+    def setUp(self):
+        for alias in ['a', 'b', 'c', 'd']:
+            self.create_recipient(alias)
+
+    def aliases(self):
+        return list(PaymentRecipient.objects.values_list('alias', flat=True))
+
+    def test_insert_and_move_touch_only_one_row(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.create_recipient('new', priority_order=2)
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if query['sql'].startswith('UPDATE "payment_instructions_paymentrecipient"')
+        ])
+        self.assertEqual(self.aliases(), ['a', 'new', 'b', 'c', 'd'])
+
+        recipient = PaymentRecipient.objects.get(alias='d')
+        recipient.priority_order = 1
+        recipient.save()
+        self.assertEqual(self.aliases(), ['d', 'a', 'new', 'b', 'c'])
+
+        recipient = PaymentRecipient.objects.get(alias='a')
+        recipient.priority_order = 10
+        recipient.save()
+        self.assertEqual(self.aliases(), ['d', 'new', 'b', 'c', 'a'])
+
+    def test_unchanged_priority_keeps_position(self):
+        recipient = PaymentRecipient.objects.get(alias='b')
+        recipient.name = 'renamed'
+        recipient.save()
+        self.assertEqual(self.aliases(), ['a', 'b', 'c', 'd'])
+
+    def test_visible_rank_and_delete(self):
+        self.create_recipient('top', priority_order=1)
+        PaymentRecipient.objects.get(alias='b').delete()
+        ranks = dict(PaymentRecipient.objects.with_rank().values_list('alias', 'priority_rank'))
+        self.assertEqual(ranks, {'top': 1, 'a': 2, 'c': 3, 'd': 4})
+
+    def test_renumbers_when_gap_is_exhausted(self):
+        for i in range(15):
+            self.create_recipient(f'wedge_{i}', priority_order=2)
+        self.assertEqual(self.aliases()[:2], ['a', 'wedge_14'])
+        self.assertEqual(self.aliases()[-3:], ['b', 'c', 'd'])
+        self.assertEqual(len(set(PaymentRecipient.objects.values_list('sort_key', flat=True))), 19)
+
+    def test_bulk_reorder(self):
+        order = list(PaymentRecipient.objects.order_by('-alias'))
+        with self.assertNumQueries(5):
+            PaymentRecipient.objects.reorder(order)
+        self.assertEqual(self.aliases(), ['d', 'c', 'b', 'a'])
+        self.assertEqual(list(PaymentRecipient.objects.values_list('priority_order', flat=True)), [1, 2, 3, 4])
+
+        # A partial order would hand out keys already held by the recipients left out
+        with self.assertRaises(ValueError):
+            PaymentRecipient.objects.reorder(order[:2])
+        with self.assertRaises(ValueError):
+            PaymentRecipient.objects.reorder(order[:3] + order[:1])
+        self.assertEqual(self.aliases(), ['d', 'c', 'b', 'a'])
+
+    def test_month_close_renumbers_priorities(self):
+        recipient = PaymentRecipient.objects.get(alias='d')
+        recipient.priority_order = 1
+        recipient.save()
+        # Only the moved row was written: the others still carry their old numbers
+        self.assertEqual(list(PaymentRecipient.objects.values_list('priority_order', flat=True)), [1, 1, 2, 3])
+
+        last_month = timezone.now() - timedelta(days=40)
+        payment = self.create_payment(recipient, 1000)
+        Payment.objects.filter(pk=payment.pk).update(created_at=last_month)
+        self.assertTrue(MonthlySnapshot.objects.close_pending_months())
+        self.assertEqual(self.aliases(), ['d', 'a', 'b', 'c'])
+        self.assertEqual(list(PaymentRecipient.objects.values_list('priority_order', flat=True)), [1, 2, 3, 4])
+
+
+class RecipientAdminTests(TemporaryMediaMixin, RecipientSelectionTestCase):
+
+    def setUp(self):
+        admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='secret')
+        self.client.force_login(admin)
+        self.url = reverse('admin:payment_instructions_paymentrecipient_changelist')
+
+    def add_recipients(self, count):
+        for index in range(count):
+            recipient = self.create_recipient(f'r{PaymentRecipient.objects.count()}', is_recurring=index % 2 == 0)
+            self.create_payment(recipient, 1000 * (index + 1))
+
+    def changelist_queries(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        self.add_recipients(3)
+        # First request warms the session and content type caches
+        self.changelist_queries()
+        _, few = self.changelist_queries()
+        self.add_recipients(12)
+        response, many = self.changelist_queries()
+        self.assertEqual(few, many)
+        self.assertContains(response, 'Usado')
+
+    def test_sorts_by_annotated_columns(self):
+        self.add_recipients(4)
+        # Column 4 is remaining_amount: max_amount minus what was received this month
+        response, _ = self.changelist_queries(o='4')
+        remaining = [recipient.remaining for recipient in response.context['cl'].result_list]
+        self.assertEqual(remaining, sorted(remaining))
+        self.assertEqual(remaining[0], 10000 - 4000)
+
+
+class PaymentAdminChangelistTests(RecipientSelectionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='secret')
+        self.client.force_login(admin)
+        self.url = reverse('admin:payment_instructions_payment_changelist')
+        self.recipient = self.create_recipient('listed')
+        self.create_recipient('never-paid')
+
+    def get(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in queries]
+
+    def test_queries_do_not_grow_with_rows(self):
+        for _ in range(3):
+            self.create_payment(self.recipient, 100)
+        self.get()
+        cache.clear()
+        _, few = self.get()
+        for _ in range(30):
+            self.create_payment(self.recipient, 100)
+        cache.clear()
+        response, many = self.get()
+        self.assertEqual(len(few), len(many))
+        # Related rows are joined, and the sidebar doesn't list every recipient
+        self.assertNotContains(response, 'never-paid')
+
+    def test_count_is_cached_between_pages(self):
+        self.create_payment(self.recipient, 100)
+        self.get()
+        _, queries = self.get()
+        self.assertFalse([sql for sql in queries if 'COUNT(' in sql and 'payment_instructions_payment' in sql])
+
+    def test_autocomplete_filter(self):
+        other = self.create_recipient('other')
+        payment = self.create_payment(self.recipient, 100)
+        self.create_payment(other, 200)
+        response, _ = self.get(payment_recipient__id__exact=self.recipient.pk)
+        self.assertEqual(list(response.context['cl'].result_list), [payment])
+
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'term': 'oth', 'app_label': 'payment_instructions', 'model_name': 'payment',
+            'field_name': 'payment_recipient',
+        })
+        self.assertEqual([result['id'] for result in response.json()['results']], [str(other.pk)])
+
+
+class QueryPlanTests(RecipientSelectionTestCase):
+
+    def test_hot_queries_use_indexes(self):
+        self.create_payment(self.create_recipient('recipient'), 1000)
+        out = StringIO()
+        call_command('explain_queries', stdout=out)
+        self.assertIn('payment_recipient_month_idx', out.getvalue())
+        self.assertIn('payment_operator_created_idx', out.getvalue())
+
+    def test_foreign_keys_use_composite_indexes(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Payment._meta.db_table)
+        indexed = [info['columns'] for info in constraints.values() if info['index']]
+        lookups = {
+            'payment_recipient_id': 'payment_recipient_month_idx',
+            'specialist_id': 'payment_specialist_month_idx',
+            'operator_user_id': 'payment_operator_created_idx',
+        }
+        for column, index in lookups.items():
+            with self.subTest(column=column):
+                # No duplicate single-column index next to the composite one
+                self.assertNotIn([column], indexed)
+                [plan] = explain(lambda: list(Payment.objects.filter(**{column: 1})))
+                self.assertIn(index, ' '.join(plan))
+
+    def test_full_scans_are_detected(self):
+        now = timezone.localtime()
+        [plan] = explain(lambda: list(Payment.objects.filter(notes='x')))
+        self.assertTrue(full_scans(plan))
+        [plan] = explain(lambda: list(Payment.objects.filter(operator_user=self.operator).order_by('amount')))
+        self.assertTrue(full_scans(plan))
+        # The monthly totals query is a range search on created_at
+        [plan] = explain(lambda: Payment.get_monthly_totals(now.year, now.month))
+        self.assertFalse(full_scans(plan))
+
+    def assertSearchesBy(self, query, indexes):
+        """Every statement query sends to the live and archived payment tables uses the given indexes"""
+        for table, index in zip([Payment._meta.db_table, ArchivedPayment._meta.db_table], indexes):
+            plans = explain(query, table=table)
+            self.assertTrue(plans)
+            for plan in plans:
+                self.assertTrue(any(f'USING INDEX {index}' in step for step in plan), plan)
+
+    def test_compression_jobs_update_payments_by_proof_index(self):
+        job = CompressionJob.objects.enqueue('comprobantes/proof.png')
+        job.attempts = CompressionJob.objects.MAX_ATTEMPTS
+        blob = ProofBlob.objects.create(sha256='0' * 64, name=f'{ProofBlob.ROOT}/proof.jpg', size=1)
+        self.assertSearchesBy(
+            lambda: CompressionJob.objects.complete(job, blob), ['payment_proof_file_idx', 'archived_proof_file_idx']
+        )
+        [plan] = explain(lambda: CompressionJob.objects.fail(job, 'error'))
+        self.assertIn('payment_proof_file_idx', ' '.join(plan))
+
+    def test_blob_replacement_finds_payments_by_proof_index(self):
+        blob = ProofBlob.objects.create(sha256='0' * 64, name=f'{ProofBlob.ROOT}/proof.jpg', size=1)
+        self.assertSearchesBy(
+            lambda: ProofBlob.objects.replace(f'{ProofBlob.ROOT}/old.jpg', blob),
+            ['payment_proof_file_idx', 'archived_proof_file_idx'],
+        )
+
+    def test_proof_candidates_search_by_index(self):
+        now = timezone.now()
+        for query in [lambda: month_candidates(now - timedelta(days=30), now), lambda: cold_candidates(now)]:
+            for table in [Payment._meta.db_table, ArchivedPayment._meta.db_table]:
+                for plan in explain(query, table=table):
+                    # Scanning the partial index only reads the proofs still being compressed
+                    scans = [
+                        step for step in plan
+                        if step.startswith('SCAN') and 'payment_processing_proof_idx' not in step
+                    ]
+                    self.assertEqual(scans, [], plan)
+
+
+class PaymentExportTests(RecipientSelectionTestCase):
+
+    def setUp(self):
+        self.recipient = self.create_recipient('recipient', cbu='0' * 22)
+        self.other = self.create_recipient('other')
+        self.last_month = (timezone.localdate().replace(day=1) - timedelta(days=1)).replace(day=1)
+        start, _ = local_month_range(self.last_month.year, self.last_month.month)
+        archived = self.create_payment(self.recipient, 700)
+        Payment.objects.filter(pk=archived.pk).update(created_at=start + timedelta(days=1))
+        ArchivedPayment.objects.archive_before(start + timedelta(days=2))
+        for recipient, amount, day in [(self.recipient, 1000, 3), (self.other, 2500, 2)]:
+            payment = self.create_payment(recipient, amount)
+            Payment.objects.filter(pk=payment.pk).update(created_at=start + timedelta(days=day))
+        self.create_payment(self.recipient, 400)
+
+    def export(self, export_format='csv', **options):
+        with tempfile.NamedTemporaryFile(suffix=f'.{export_format}') as output:
+            err = StringIO()
+            with CaptureQueriesContext(connection) as queries:
+                call_command('export_payments', format=export_format, output=output.name, stderr=err, **options)
+            self.assertIn('rows/s', err.getvalue())
+            return output.read(), len(queries)
+
+    def test_csv_merges_live_and_archived_in_sql_filtered_order(self):
+        content, queries = self.export(month=f'{self.last_month:%Y-%m}')
+        # One joined query per table, whatever the number of rows
+        self.assertEqual(queries, 2)
+        rows = list(csv.reader(StringIO(content.decode('utf-8-sig'))))
+        self.assertEqual(rows[0][:5], ['ID', 'Fecha', 'Monto', 'Alias', 'CBU'])
+        self.assertEqual([(row[2], row[3], row[-1]) for row in rows[1:]], [
+            ('700', 'recipient', 'Sí'), ('2500', 'other', 'No'), ('1000', 'recipient', 'No'),
+        ])
+        self.assertEqual(rows[1][4], '0' * 22)
+        self.assertIn('/proof/', rows[1][8])
+
+        content, _ = self.export(recipient='recipient')
+        self.assertEqual(len(content.decode('utf-8-sig').splitlines()), 4)
+
+    def test_xlsx_is_a_valid_workbook(self):
+        content, _ = self.export('xlsx', specialist=self.specialist.name)
+        with zipfile.ZipFile(BytesIO(content)) as workbook:
+            self.assertIsNone(workbook.testzip())
+            sheet = ElementTree.fromstring(workbook.read('xl/worksheets/sheet1.xml'))
+        namespace = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+        self.assertEqual(len(sheet.iter(f'{namespace}row').__next__()), len(EXPORT_HEADER))
+        self.assertEqual(len(list(sheet.iter(f'{namespace}row'))), 5)
+
+    def test_admin_action_streams_selected_payments(self):
+        admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='secret')
+        self.client.force_login(admin)
+        selected = Payment.objects.filter(payment_recipient=self.recipient)
+        response = self.client.post(reverse('admin:payment_instructions_payment_changelist'), {
+            'action': 'export_csv',
+            '_selected_action': [payment.pk for payment in selected],
+        })
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment;', response['Content-Disposition'])
+        rows = list(csv.reader(StringIO(b''.join(response.streaming_content).decode('utf-8-sig'))))
+        self.assertEqual(sorted(int(row[0]) for row in rows[1:]), sorted(payment.pk for payment in selected))
+        self.assertTrue(rows[1][8].startswith('http://testserver/admin/'))
+
+
+class ProofUploadTestCase(TemporaryMediaMixin, RecipientSelectionTestCase):
+    """Posts payments with a proof through the operator view"""
+
+    def setUp(self):
+        self.recipient = self.create_recipient('recipient')
+        self.client.force_login(self.operator)
+
+    def post_payment(self, content, name='proof.png', content_type='image/png'):
+        return self.client.post(reverse('payment_instructions:create_payment'), {
+            'amount': 1000,
+            'alias': 'recipient',
+            'specialist_id': self.specialist.pk,
+            'proof_of_payment_file': SimpleUploadedFile(name, content, content_type),
+        })
+
+
+class CompressionQueueTests(ProofUploadTestCase):
+
+    def run_worker(self):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            return process_jobs(executor, limit=10)
+
+    def test_payment_is_created_before_compression(self):
+        response = self.post_payment(make_png())
+        self.assertEqual(response.status_code, 200)
+        payment = Payment.objects.get(pk=response.json()['payment_id'])
+        original = payment.proof_of_payment_file.name
+        self.assertEqual(payment.proof_status, Payment.PROOF_PROCESSING)
+        self.assertTrue(original.endswith('.png'))
+        self.assertEqual(CompressionJob.objects.get().file_name, original)
+
+        self.assertEqual(self.run_worker(), 1)
+        payment.refresh_from_db()
+        self.assertEqual(payment.proof_status, Payment.PROOF_READY)
+        self.assertTrue(payment.proof_of_payment_file.name.startswith(ProofBlob.ROOT + '/'))
+        self.assertTrue(os.path.exists(payment.proof_of_payment_file.path))
+        self.assertFalse(payment.proof_of_payment_file.storage.exists(original))
+
+        stats = CompressionJob.objects.stats()
+        self.assertEqual((stats['pending'], stats['done'], stats['recent_jobs']), (0, 1, 1))
+
+    def test_duplicate_uploads_share_one_blob(self):
+        content = make_png()
+        first = Payment.objects.get(pk=self.post_payment(content).json()['payment_id'])
+        self.run_worker()
+        first.refresh_from_db()
+
+        # Same bytes again: found by hash before storing or compressing anything
+        second = Payment.objects.get(pk=self.post_payment(content).json()['payment_id'])
+        self.assertEqual(second.proof_status, Payment.PROOF_READY)
+        self.assertEqual(second.proof_of_payment_file.name, first.proof_of_payment_file.name)
+        self.assertEqual(CompressionJob.objects.count(), 1)
+        blob = ProofBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+
+        storage = first.proof_of_payment_file.storage
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(ProofBlob.objects.get().ref_count, 1)
+        self.assertTrue(storage.exists(blob.name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(ProofBlob.objects.exists())
+        self.assertFalse(storage.exists(blob.name))
+
+    def test_archived_payments_keep_their_blob_reference(self):
+        payment = Payment.objects.get(pk=self.post_payment(make_png()).json()['payment_id'])
+        self.run_worker()
+        payment.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(ArchivedPayment.objects.archive_before(timezone.now() + timedelta(days=1)), 1)
+        blob = ProofBlob.objects.get()
+        self.assertEqual(blob.ref_count, 1)
+        self.assertTrue(payment.proof_of_payment_file.storage.exists(blob.name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ArchivedPayment.objects.get().delete()
+        self.assertFalse(ProofBlob.objects.exists())
+
+    def test_split_payment_legs_count_as_references(self):
+        self.create_recipient('other')
+        response = self.client.post(reverse('payment_instructions:create_split_payment'), {
+            'legs': json.dumps([{'alias': 'recipient', 'amount': 1000}, {'alias': 'other', 'amount': 500}]),
+            'specialist_id': self.specialist.pk,
+            'proof_of_payment_file': SimpleUploadedFile('proof.pdf', make_pdf(), 'application/pdf'),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.run_worker()
+        self.assertEqual(ProofBlob.objects.get().ref_count, 2)
+
+    def test_failed_jobs_are_retried_then_marked(self):
+        response = self.post_payment(make_png())
+        payment = Payment.objects.get(pk=response.json()['payment_id'])
+        # Corrupt the stored original so every attempt fails
+        with open(payment.proof_of_payment_file.path, 'wb') as stored:
+            stored.write(b'\x89PNG\r\n\x1a\n truncated')
+
+        for attempt in range(1, CompressionJob.objects.MAX_ATTEMPTS + 1):
+            with self.assertLogs('payment_instructions.utils.file_compression', 'ERROR'):
+                self.assertEqual(self.run_worker(), 1)
+            job = CompressionJob.objects.get()
+            self.assertEqual(job.attempts, attempt)
+            self.assertTrue(job.last_error)
+            # Make the backed off retry due now
+            CompressionJob.objects.update(available_at=timezone.now())
+        self.assertEqual(self.run_worker(), 0)
+
+        payment.refresh_from_db()
+        self.assertEqual(CompressionJob.objects.get().status, CompressionJob.FAILED)
+        self.assertEqual(payment.proof_status, Payment.PROOF_FAILED)
+        self.assertTrue(payment.proof_of_payment_file.storage.exists(payment.proof_of_payment_file.name))
+
+        self.assertEqual(CompressionJob.objects.retry(), 1)
+        payment.refresh_from_db()
+        self.assertEqual(payment.proof_status, Payment.PROOF_PROCESSING)
+
+    def test_jobs_survive_a_broken_pool(self):
+        payment = Payment.objects.get(pk=self.post_payment(make_png()).json()['payment_id'])
+        with mock.patch('payment_instructions.utils.compression_queue.compress_stored_proof', crash_worker):
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                with self.assertRaises(BrokenProcessPool):
+                    process_jobs(executor, limit=10)
+                # Once broken the pool refuses every submit; the claimed job still goes back to the queue
+                CompressionJob.objects.update(available_at=timezone.now())
+                with self.assertRaises(BrokenProcessPool):
+                    process_jobs(executor, limit=10)
+        job = CompressionJob.objects.get()
+        self.assertEqual((job.status, job.attempts), (CompressionJob.PENDING, 2))
+        self.assertTrue(job.last_error.startswith('BrokenProcessPool'))
+
+        CompressionJob.objects.update(available_at=timezone.now())
+        self.assertEqual(self.run_worker(), 1)
+        payment.refresh_from_db()
+        self.assertEqual(payment.proof_status, Payment.PROOF_READY)
+
+    def test_command_replaces_a_broken_pool(self):
+        command = 'payment_instructions.management.commands.process_compression_jobs'
+        # connections is patched too: closing them would drop the in-memory test database
+        with mock.patch(f'{command}.ProcessPoolExecutor') as pool, mock.patch(f'{command}.connections'), \
+                mock.patch(f'{command}.process_jobs', side_effect=[BrokenProcessPool(), 1, 0]), \
+                self.assertLogs(command, 'ERROR'):
+            call_command('process_compression_jobs', once=True, workers=1, stdout=StringIO())
+        self.assertEqual(pool.call_count, 2)
+        self.assertEqual(pool.return_value.shutdown.call_count, 2)
+
+
+class ProofUploadHandlerTests(ProofUploadTestCase):
+
+    def test_type_is_taken_from_file_contents(self):
+        response = self.post_payment(make_png(), name='proof.bin', content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(CompressionJob.objects.get().content_type, 'image/png')
+
+    def test_disallowed_type_is_rejected(self):
+        response = self.post_payment(b'MZ\x90\x00 not a proof', name='proof.png')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], PROOF_INVALID_TYPE)
+        self.assertFalse(Payment.objects.exists())
+
+    def test_decompression_bomb_is_rejected_from_header(self):
+        output = BytesIO()
+        Image.new('1', (9000, 5000)).save(output, format='PNG')
+        response = self.post_payment(output.getvalue())
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], PROOF_TOO_MANY_PIXELS)
+        self.assertFalse(Payment.objects.exists())
+
+    def test_oversize_file_is_rejected_while_receiving(self):
+        content = b'%PDF-1.4\n' + b'0' * MAX_PROOF_SIZE
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with self.settings(FILE_UPLOAD_TEMP_DIR=temp_dir):
+                response = self.post_payment(content, name='proof.pdf', content_type='application/pdf')
+            self.assertEqual(os.listdir(temp_dir), [])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], PROOF_TOO_LARGE)
+        self.assertFalse(Payment.objects.exists())
+
+
+class SizeTargetEncoderTests(TestCase):
+
+    def fit(self, img, target_kb=50):
+        img.thumbnail((FileCompressor.MAX_WIDTH, FileCompressor.MAX_HEIGHT))
+        encoder = SizeTargetEncoder(target_kb * 1024)
+        output, size, encoded, quality = encoder.fit(img)
+        output.close()
+        return encoder, size, encoded, quality
+
+    def test_large_photos_are_decoded_at_reduced_scale(self):
+        decoded_sizes = []
+        original_thumbnail = Image.Image.thumbnail
+
+        def thumbnail(img, *args, **kwargs):
+            decoded_sizes.append(img.size)
+            return original_thumbnail(img, *args, **kwargs)
+
+        for image_format, mode in [('JPEG', 'RGB'), ('PNG', 'RGBA')]:
+            output = BytesIO()
+            Image.new(mode, (4000, 3000), (10, 120, 200)).save(output, format=image_format)
+            output.name = f'photo.{image_format.lower()}'
+            with mock.patch.object(Image.Image, 'thumbnail', thumbnail):
+                img = FileCompressor.load_image(output)
+            self.assertEqual((img.mode, img.size), ('RGB', (1200, 900)))
+        # JPEG decoded at 1/2 DCT scale, PNG box-reduced by 3 before the resample
+        self.assertEqual(decoded_sizes, [(2000, 1500), (1334, 1000)])
+
+    def test_source_image_is_closed(self):
+        opened = []
+        original_open = Image.open
+
+        def open_image(*args, **kwargs):
+            opened.append(original_open(*args, **kwargs))
+            return opened[-1]
+
+        def load(size):
+            output = BytesIO()
+            Image.new('L', size).save(output, format='PNG')
+            output.name = 'proof.png'
+            with mock.patch.object(Image, 'open', open_image):
+                return FileCompressor.load_image(output)
+
+        img = load((800, 600))
+        self.assertEqual(img.getpixel((0, 0)), 0)
+        with self.assertRaises(ValueError):
+            load((9000, 5000))
+        # Both sources let go of their file: the small image came back loaded
+        self.assertEqual(len(opened), 2)
+        for source in opened:
+            self.assertIsNone(source.fp)
+
+    def test_simple_image_takes_one_encode(self):
+        encoder, size, encoded, quality = self.fit(Image.new('RGB', (2000, 3000), (255, 255, 255)))
+        self.assertEqual(encoder.encodes, 1)
+        self.assertEqual(quality, FileCompressor.JPEG_QUALITY)
+        self.assertEqual(encoded.size, (1067, 1600))
+
+    def test_receipts_fit_within_encode_budget(self):
+        rng = random.Random(7)
+        for size, photo in [((1080, 1920), False), ((3024, 4032), True)]:
+            img = make_receipt(rng, size, photo)
+            encoder, encoded_size, encoded, quality = self.fit(img)
+            self.assertLessEqual(encoded_size, 50 * 1024)
+            self.assertLessEqual(encoder.encodes, SizeTargetEncoder.MAX_ENCODES)
+            self.assertGreaterEqual(encoded.width, int(img.width * FileCompressor.MIN_SCALE))
+
+
+class PdfProofTests(TestCase):
+
+    def convert(self, content, **kwargs):
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as source:
+            source.write(content)
+            source.flush()
+            source.seek(0)
+            result = FileCompressor.pdf_to_jpeg(File(source, name='proof.pdf'), **kwargs)
+        # Black text on white: encoded with the document profile
+        self.assertEqual((result.content_type, result.profile), ('image/png', FileCompressor.PROFILE_DOCUMENT))
+        return result, Image.open(result)
+
+    def test_single_page_fits_the_usual_box(self):
+        result, img = self.convert(make_pdf())
+        self.assertLessEqual(img.width, FileCompressor.MAX_WIDTH)
+        self.assertLessEqual(img.height, FileCompressor.MAX_HEIGHT)
+        self.assertLessEqual(result.size, FileCompressor.TARGET_SIZE_KB * 1024)
+
+    def test_pages_are_rendered_in_parallel_and_stacked(self):
+        with mock.patch.object(FileCompressor, 'PDF_RENDER_WORKERS', 2):
+            result, img = self.convert(make_pdf(pages=3))
+        # Three A4 pages one above the other
+        self.assertGreater(img.height, img.width * 3)
+        self.assertLessEqual(result.size, FileCompressor.TARGET_SIZE_KB * 3 * 1024)
+
+        _, first_only = self.convert(make_pdf(pages=3), single_page=True)
+        self.assertLess(first_only.height, first_only.width * 2)
+
+        _, two_pages = self.convert(make_pdf(pages=3), pages=[0, 2])
+        self.assertGreater(two_pages.height, two_pages.width * 2)
+        self.assertLess(two_pages.height, two_pages.width * 3)
+
+    def test_pool_workers_render_pages_serially(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'proof.pdf')
+            with open(path, 'wb') as source:
+                source.write(make_pdf(pages=3))
+            with mock.patch('payment_instructions.utils.file_compression.ProcessPoolExecutor') as pool:
+                temporary_path, _, _ = compress_stored_proof(path, 'application/pdf')
+            os.remove(temporary_path)
+        pool.assert_not_called()
+
+
+class CompressionProfileTests(ProofUploadTestCase):
+
+    def encode(self, img):
+        output, size, profile, extension, content_type = FileCompressor.encode_proof(img, 50 * 1024)
+        output.close()
+        return size, profile, extension
+
+    def test_profile_follows_image_content(self):
+        rng = random.Random(3)
+        receipt = make_receipt(rng, (1080, 1920))
+        receipt.thumbnail((FileCompressor.MAX_WIDTH, FileCompressor.MAX_HEIGHT))
+        size, profile, extension = self.encode(receipt)
+        self.assertEqual((profile, extension), (FileCompressor.PROFILE_DOCUMENT, '.png'))
+        # Several times smaller than the colour JPEG of the same receipt
+        self.assertLess(size * 3, SizeTargetEncoder(50 * 1024).encode(receipt, FileCompressor.JPEG_QUALITY)[1])
+
+        gradient = Image.linear_gradient('L').resize((800, 1200)).convert('RGB')
+        self.assertEqual(self.encode(gradient)[1:], (FileCompressor.PROFILE_GRAYSCALE, '.jpg'))
+
+        noise = Image.frombytes('RGB', (600, 800), rng.randbytes(600 * 800 * 3))
+        self.assertEqual(self.encode(noise)[1:], (FileCompressor.PROFILE_PHOTO, '.jpg'))
+
+        # Looks like a document, but the palette PNG of a noisy photo can't fit: JPEG instead
+        photo = make_receipt(rng, (3024, 4032), photo=True)
+        photo.thumbnail((FileCompressor.MAX_WIDTH, FileCompressor.MAX_HEIGHT))
+        self.assertTrue(FileCompressor.analyze(photo)[0])
+        size, profile, extension = self.encode(photo)
+        self.assertEqual(extension, '.jpg')
+        self.assertLessEqual(size, 50 * 1024)
+
+    def test_sizes_are_recorded_on_payments(self):
+        output = BytesIO()
+        make_receipt(random.Random(5), (1080, 1920)).save(output, format='PNG')
+        content = output.getvalue()
+        first = Payment.objects.get(pk=self.post_payment(content).json()['payment_id'])
+        self.assertEqual((first.original_size, first.compressed_size), (len(content), None))
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            process_jobs(executor, limit=10)
+        first.refresh_from_db()
+        blob = ProofBlob.objects.get()
+        self.assertTrue(blob.name.endswith('.png'))
+        self.assertEqual(
+            (first.compression_profile, first.original_size, first.compressed_size),
+            (FileCompressor.PROFILE_DOCUMENT, len(content), blob.size),
+        )
+
+        # A duplicate upload takes the profile and size of the blob it reuses
+        second = Payment.objects.get(pk=self.post_payment(content).json()['payment_id'])
+        self.assertEqual((second.compression_profile, second.compressed_size), (first.compression_profile, blob.size))
+
+        month = timezone.localdate()
+        stats = Payment.get_compression_stats(*local_month_range(month.year, month.month))
+        self.assertEqual(stats, [{
+            'profile': FileCompressor.PROFILE_DOCUMENT,
+            'label': 'Documento',
+            'payment_count': 2,
+            'original_size': 2 * len(content),
+            'compressed_size': 2 * blob.size,
+            'saved_size': 2 * (len(content) - blob.size),
+        }])
+        out = StringIO()
+        call_command('compression_stats', stdout=out)
+        self.assertIn('Documento', out.getvalue())
+
+    def test_small_proof_is_not_inflated(self):
+        content = make_pdf()
+        payment = Payment.objects.get(pk=self.post_payment(
+            content, name='proof.pdf', content_type='application/pdf'
+        ).json()['payment_id'])
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            process_jobs(executor, limit=10)
+        payment.refresh_from_db()
+        self.assertEqual(payment.proof_status, Payment.PROOF_READY)
+        self.assertEqual(
+            (payment.compression_profile, payment.original_size, payment.compressed_size),
+            (FileCompressor.PROFILE_ORIGINAL, len(content), len(content)),
+        )
+        with payment.proof_of_payment_file.open('rb') as stored:
+            self.assertEqual(stored.read(), content)
+        [stats] = Payment.get_compression_stats()
+        self.assertEqual((stats['label'], stats['saved_size']), ('Original', 0))
+
+
+class ProofThumbnailTests(ProofUploadTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='secret')
+
+    def test_worker_creates_thumbnail_and_admin_serves_it(self):
+        payment = Payment.objects.get(pk=self.post_payment(make_png()).json()['payment_id'])
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            process_jobs(executor, limit=10)
+        payment.refresh_from_db()
+        storage = payment.proof_of_payment_file.storage
+        thumb_name = thumbnail_name(payment.proof_of_payment_file.name)
+        self.assertTrue(storage.exists(thumb_name))
+
+        self.client.force_login(self.admin)
+        url = reverse('admin:payment_instructions_payment_thumbnail', args=[payment.pk])
+        response = self.client.get(url, {'v': thumbnail_version(payment.proof_of_payment_file.name)})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+        thumbnail = Image.open(BytesIO(b''.join(response.streaming_content)))
+        self.assertLessEqual(thumbnail.size, (240, 320))
+
+        # The change list embeds thumbnails instead of full images
+        response = self.client.get(reverse('admin:payment_instructions_payment_changelist'))
+        self.assertContains(response, url)
+
+    def test_backfill_renders_pdf_first_page(self):
+        payment = Payment.objects.get(pk=self.post_payment(
+            make_pdf(pages=2), name='proof.pdf', content_type='application/pdf'
+        ).json()['payment_id'])
+        storage = payment.proof_of_payment_file.storage
+        thumb_name = thumbnail_name(payment.proof_of_payment_file.name)
+        self.assertFalse(storage.exists(thumb_name))
+
+        call_command('generate_thumbnails', workers=1, stdout=StringIO())
+        self.assertTrue(storage.exists(thumb_name))
+        with storage.open(thumb_name) as thumb:
+            # A4 first page, fitted by height
+            self.assertEqual(Image.open(thumb).size, (227, 320))
+
+    def test_oversized_image_is_not_decoded(self):
+        output = BytesIO()
+        Image.new('1', (9000, 5000)).save(output, format='PNG')
+        with self.assertRaisesRegex(ValueError, 'Image too large'):
+            render_thumbnail(output)
+
+        # Box-reduced straight to the thumbnail size before any resampling
+        decoded_sizes = []
+        original_thumbnail = Image.Image.thumbnail
+
+        def thumbnail(img, *args, **kwargs):
+            decoded_sizes.append(img.size)
+            return original_thumbnail(img, *args, **kwargs)
+
+        with mock.patch.object(Image.Image, 'thumbnail', thumbnail):
+            img = render_thumbnail(BytesIO(make_png((2400, 3200))))
+        self.assertEqual((img.size, decoded_sizes), ((240, 320), [(240, 320)]))
+
+
+class ColdStorageTests(ProofUploadTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.checkpoint = os.path.join(directory.name, 'checkpoint.json')
+        self.rng = random.Random(11)
+
+    def old_payment(self, days=400):
+        """Payment with a compressed photo proof, created days ago"""
+        output = BytesIO()
+        make_receipt(self.rng, (1200, 1600), photo=True).save(output, format='JPEG', quality=95)
+        payment = Payment.objects.get(pk=self.post_payment(output.getvalue(), name='proof.jpg').json()['payment_id'])
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            process_jobs(executor, limit=10)
+        Payment.objects.filter(pk=payment.pk).update(created_at=timezone.now() - timedelta(days=days))
+        payment.refresh_from_db()
+        return payment
+
+    def recompress(self, **options):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command(
+                'recompress_proofs', older_than=30, workers=1, checkpoint=self.checkpoint, stdout=out, **options
+            )
+        return out.getvalue()
+
+    def test_old_proofs_are_swapped_for_cold_versions(self):
+        old = self.old_payment()
+        recent = self.old_payment(days=1)
+        old_name, recent_name = old.proof_of_payment_file.name, recent.proof_of_payment_file.name
+
+        output = self.recompress()
+        self.assertIn('Recompressed 1 proofs', output)
+        old.refresh_from_db()
+        recent.refresh_from_db()
+        self.assertEqual(recent.proof_of_payment_file.name, recent_name)
+        self.assertEqual(old.compression_profile, FileCompressor.PROFILE_COLD)
+        self.assertLess(old.compressed_size, old.original_size)
+        self.assertLessEqual(old.compressed_size, FileCompressor.COLD_TARGET_SIZE_KB * 1024)
+        with Image.open(old.proof_of_payment_file.path) as img:
+            # Gray levels only: a 4-entry palette PNG or a grayscale JPEG
+            self.assertIn(img.mode, ('P', 'L'))
+
+        # The old blob gave its reference to the cold one and its file is gone
+        storage = old.proof_of_payment_file.storage
+        self.assertFalse(ProofBlob.objects.filter(name=old_name).exists())
+        self.assertFalse(storage.exists(old_name))
+        self.assertEqual(ProofBlob.objects.get(name=old.proof_of_payment_file.name).ref_count, 1)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+        # Cold proofs are not picked again
+        self.assertIn('Recompressed 0 proofs', self.recompress())
+
+    def test_resumes_after_checkpoint(self):
+        first, second = sorted(
+            [self.old_payment(), self.old_payment()], key=lambda payment: payment.proof_of_payment_file.name
+        )
+        with open(self.checkpoint, 'w') as checkpoint:
+            json.dump({'older_than': 30, 'last_name': first.proof_of_payment_file.name, 'recompressed': 3,
+                       'skipped': 0, 'failed': 0, 'reclaimed': 0}, checkpoint)
+
+        output = self.recompress()
+        self.assertIn('Resuming after', output)
+        self.assertIn('Recompressed 4 proofs', output)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertNotEqual(first.compression_profile, FileCompressor.PROFILE_COLD)
+        self.assertEqual(second.compression_profile, FileCompressor.PROFILE_COLD)
+
+    def test_closed_months_are_packed_and_read_by_offset(self):
+        payment = self.old_payment()
+        MonthClose.objects.create(month=timezone.localtime(payment.created_at).date().replace(day=1))
+        self.recompress(pack=True)
+
+        payment.refresh_from_db()
+        name = payment.proof_of_payment_file.name
+        packed = PackedProof.objects.get(name=name)
+        storage = payment.proof_of_payment_file.storage
+        self.assertFalse(storage.exists(name))
+        self.assertTrue(storage.exists(packed.pack))
+        with open_proof(name) as proof:
+            content = proof.read()
+        self.assertEqual(len(content), payment.compressed_size)
+        self.assertIn(Image.open(BytesIO(content)).mode, ('P', 'L'))
+        generate_thumbnail(name, force=True)
+
+        admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='secret')
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin:payment_instructions_payment_proof', args=[payment.pk]))
+        self.assertEqual(b''.join(response.streaming_content), content)
+
+
+    def test_admin_streams_selected_proofs_as_zip_with_manifest(self):
+        packed = self.old_payment()
+        MonthClose.objects.create(month=timezone.localtime(packed.created_at).date().replace(day=1))
+        self.recompress(pack=True)
+        packed.refresh_from_db()
+        loose = self.old_payment(days=1)
+        shared = self.create_payment(self.recipient, 300)
+        missing = self.create_payment(self.recipient, 200)
+        Payment.objects.filter(pk=shared.pk).update(proof_of_payment_file=loose.proof_of_payment_file.name)
+        Payment.objects.filter(pk=missing.pk).update(proof_of_payment_file='comprobantes/missing.jpg')
+        without_proof = self.create_payment(self.recipient, 100)
+        Payment.objects.filter(pk=without_proof.pk).update(proof_of_payment_file='')
+
+        admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='secret')
+        self.client.force_login(admin)
+        response = self.client.post(reverse('admin:payment_instructions_payment_changelist'), {
+            'action': 'download_proofs',
+            '_selected_action': [packed.pk, loose.pk, shared.pk, missing.pk, without_proof.pk],
+        })
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        with zipfile.ZipFile(BytesIO(b''.join(response.streaming_content))) as archive:
+            self.assertIsNone(archive.testzip())
+            manifest = list(csv.reader(StringIO(archive.read('comprobantes.csv').decode('utf-8-sig'))))
+            self.assertEqual(manifest[0], ['ID', 'Fecha', 'Monto', 'Alias', 'Archivo'])
+            files = {int(row[0]): row[4] for row in manifest[1:]}
+            # Payments without a proof are left out; a shared proof goes in once
+            self.assertEqual(list(files), [packed.pk, loose.pk, shared.pk, missing.pk])
+            self.assertEqual(files[shared.pk], files[loose.pk])
+            self.assertEqual(files[missing.pk], 'No encontrado')
+            self.assertEqual(len(archive.namelist()), 3)
+            with open_proof(packed.proof_of_payment_file.name) as proof:
+                self.assertEqual(archive.read(files[packed.pk]), proof.read())
+            with open_proof(loose.proof_of_payment_file.name) as proof:
+                self.assertEqual(archive.read(files[loose.pk]), proof.read())
@@ -0,0 +1,85 @@
+import hashlib
+
+from django.core.files.uploadhandler import SkipFile, StopFutureHandlers, TemporaryFileUploadHandler
+
+PROOF_FIELD = 'proof_of_payment_file'
+MAX_PROOF_SIZE = 5 * 1024 * 1024  # 5MB
+# Room for the other form fields and the multipart headers around the proof
+MAX_FORM_OVERHEAD = 64 * 1024
+
+PROOF_TOO_LARGE = 'El archivo es demasiado grande. Máximo 5MB.'
+PROOF_INVALID_TYPE = 'Tipo de archivo no válido. Solo imágenes o PDF.'
+PROOF_TOO_MANY_PIXELS = 'La imagen tiene demasiados píxeles. Máximo 40 megapíxeles.'
+
+PROOF_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'%PDF-', 'application/pdf'),
+)
+
+
+def sniff_content_type(header):
+    """Content type of an allowed proof from its first bytes, or None when it is not one"""
+    for signature, content_type in PROOF_SIGNATURES:
+        if header.startswith(signature):
+            return content_type
+    return None
+
+
+class ProofUploadHandler(TemporaryFileUploadHandler):
+    """
+    Spools the proof of payment straight to a temporary file, checking its type from the first
+    chunk and its size while it is received. Other file fields are left to the next handlers.
+    A rejected proof is dropped without being stored and the reason is left in request.proof_upload_error;
+    an accepted one carries the SHA-256 of its bytes in file.sha256.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.active = False
+        self.request_too_large = False
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # A body this large cannot hold an acceptable proof, whatever the part headers claim
+        self.request_too_large = content_length > MAX_PROOF_SIZE + MAX_FORM_OVERHEAD
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        self.active = field_name == PROOF_FIELD
+        if not self.active:
+            return
+        if self.request_too_large or (content_length or 0) > MAX_PROOF_SIZE:
+            self.reject(PROOF_TOO_LARGE)
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.sha256 = hashlib.sha256()
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        if start == 0:
+            content_type = sniff_content_type(raw_data)
+            if content_type is None:
+                self.reject(PROOF_INVALID_TYPE)
+            # Trust the file contents over the type sent by the client
+            self.file.content_type = content_type
+        if start + len(raw_data) > MAX_PROOF_SIZE:
+            self.reject(PROOF_TOO_LARGE)
+        self.file.write(raw_data)
+        self.sha256.update(raw_data)
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+        self.active = False
+        file_obj = super().file_complete(file_size)
+        # Hashed while received, so duplicate detection doesn't read the file again
+        file_obj.sha256 = self.sha256.hexdigest()
+        return file_obj
+
+    def reject(self, message):
+        self.active = False
+        if self.request is not None:
+            self.request.proof_upload_error = message
+        raise SkipFile()
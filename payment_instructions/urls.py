@@ -11,5 +11,7 @@ urlpatterns = [
     
     # AJAX endpoints
     path('search-alias/', views.search_alias, name='search_alias'),
+    path('search-alias-batch/', views.search_alias_batch, name='search_alias_batch'),
     path('create-payment/', views.create_payment, name='create_payment'),
+    path('create-split-payment/', views.create_split_payment, name='create_split_payment'),
 ] 
\ No newline at end of file
@@ -0,0 +1,299 @@
+import copy
+import threading
+
+from django.conf import settings
+
+from ..models import PaymentRecipient
+
+
+def get_capacity_snapshot():
+    """Active recipients annotated with their capacity, loaded once (from the worker index when fresh)"""
+    from .recipient_index import recipient_index
+
+    recipients = recipient_index.get_recipients()
+    if recipients is None:
+        recipients = list(
+            PaymentRecipient.objects.with_capacity().filter(is_active=True).order_by('sort_key', 'name')
+        )
+    return recipients
+
+
+def get_available_capacity(recipient):
+    """Largest single payment the recipient can still take according to its annotations"""
+    if not recipient.is_recurring:
+        return recipient.max_amount if recipient.total_received == 0 else 0
+    return max(recipient.remaining, 0)
+
+
+def can_receive(recipient, amount):
+    """Same rules as PaymentRecipient.can_receive_amount, on the values annotated by with_capacity()"""
+    return (recipient.min_threshold or 0) <= amount <= get_available_capacity(recipient)
+
+
+def consume_capacity(recipient, amount):
+    """Apply an assignment to an annotated snapshot entry, as the ledger would after the payment"""
+    recipient.month_received += amount
+    recipient.total_received += amount
+    recipient.remaining -= amount
+
+
+class AllocationStrategy:
+    """Chooses one recipient for an amount from a capacity snapshot in priority order"""
+    name = None
+
+    def select(self, recipients, amount):
+        raise NotImplementedError
+
+    def eligible(self, recipients, amount):
+        return [recipient for recipient in recipients if can_receive(recipient, amount)]
+
+
+class PriorityFirstStrategy(AllocationStrategy):
+    """First eligible recipient by priority_order"""
+    name = 'priority_first'
+
+    def select(self, recipients, amount):
+        for recipient in recipients:
+            if can_receive(recipient, amount):
+                return recipient
+        return None
+
+
+class BestFitStrategy(AllocationStrategy):
+    """Eligible recipient left with the least capacity after the payment; priority breaks ties"""
+    name = 'best_fit'
+
+    def select(self, recipients, amount):
+        return min(
+            self.eligible(recipients, amount),
+            key=lambda recipient: get_available_capacity(recipient) - amount,
+            default=None
+        )
+
+
+class WorstFitStrategy(AllocationStrategy):
+    """Eligible recipient left with the most capacity after the payment; priority breaks ties"""
+    name = 'worst_fit'
+
+    def select(self, recipients, amount):
+        return min(
+            self.eligible(recipients, amount),
+            key=lambda recipient: amount - get_available_capacity(recipient),
+            default=None
+        )
+
+
+class WeightedRoundRobinStrategy(AllocationStrategy):
+    """Smooth weighted round-robin among eligible recipients, weighted by max_amount"""
+    name = 'weighted_round_robin'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._current_weights = {}
+
+    def select(self, recipients, amount):
+        eligible = self.eligible(recipients, amount)
+        if not eligible:
+            return None
+
+        with self._lock:
+            total_weight = 0
+            selected = None
+            for recipient in eligible:
+                weight = recipient.max_amount
+                total_weight += weight
+                current = self._current_weights.get(recipient.pk, 0) + weight
+                self._current_weights[recipient.pk] = current
+                if selected is None or current > self._current_weights[selected.pk]:
+                    selected = recipient
+            self._current_weights[selected.pk] -= total_weight
+        return selected
+
+
+STRATEGIES = {
+    strategy.name: strategy
+    for strategy in (PriorityFirstStrategy, BestFitStrategy, WorstFitStrategy, WeightedRoundRobinStrategy)
+}
+_strategy_instances = {}
+
+
+def get_strategy(name=None):
+    """Shared strategy instance by name, defaulting to settings.PAYMENT_ALLOCATION_STRATEGY"""
+    if isinstance(name, AllocationStrategy):
+        return name
+    name = name or getattr(settings, 'PAYMENT_ALLOCATION_STRATEGY', PriorityFirstStrategy.name)
+    if name not in STRATEGIES:
+        raise ValueError(f'Unknown allocation strategy: {name}')
+    if name not in _strategy_instances:
+        _strategy_instances[name] = STRATEGIES[name]()
+    return _strategy_instances[name]
+
+
+class CapacityTree:
+    """Max segment tree over capacities in priority order, to find the first recipient that fits in O(log R)"""
+
+    def __init__(self, capacities):
+        self.size = 1
+        while self.size < max(len(capacities), 1):
+            self.size *= 2
+        self.tree = [0] * (2 * self.size)
+        self.tree[self.size:self.size + len(capacities)] = capacities
+        for node in range(self.size - 1, 0, -1):
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+
+    def __getitem__(self, index):
+        return self.tree[self.size + index]
+
+    def __setitem__(self, index, value):
+        node = self.size + index
+        self.tree[node] = value
+        node //= 2
+        while node:
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+            node //= 2
+
+    def find_first(self, amount, start=0):
+        """Index of the first position >= start whose capacity is at least amount, or None"""
+        return self._find_first(1, 0, self.size, amount, start)
+
+    def _find_first(self, node, low, high, amount, start):
+        if high <= start or self.tree[node] < amount:
+            return None
+        if high - low == 1:
+            return low
+        middle = (low + high) // 2
+        found = self._find_first(2 * node, low, middle, amount, start)
+        if found is None:
+            found = self._find_first(2 * node + 1, middle, high, amount, start)
+        return found
+
+
+def plan_batch(amounts, strategy=None):
+    """
+    Assign a recipient to each amount in order, counting capacity used by earlier items against later ones.
+    Uses the same strategy as find_best_recipient (settings.PAYMENT_ALLOCATION_STRATEGY by default).
+    Returns a list of recipients (None when nothing fits) aligned with amounts.
+    """
+    strategy = get_strategy(strategy)
+    recipients = get_capacity_snapshot()
+    if not isinstance(strategy, PriorityFirstStrategy):
+        # Copies, so consuming capacity doesn't touch the shared availability index
+        recipients = [copy.copy(recipient) for recipient in recipients]
+        assignments = []
+        for amount in amounts:
+            recipient = strategy.select(recipients, amount)
+            if recipient is not None:
+                consume_capacity(recipient, amount)
+            assignments.append(recipient)
+        return assignments
+
+    # Priority first: a capacity tree finds each first fit in O(log R)
+    tree = CapacityTree([get_available_capacity(recipient) for recipient in recipients])
+
+    assignments = []
+    for amount in amounts:
+        index = tree.find_first(amount)
+        # Skip recipients whose minimum per payment is above this amount
+        while index is not None and amount < (recipients[index].min_threshold or 0):
+            index = tree.find_first(amount, start=index + 1)
+
+        if index is None:
+            assignments.append(None)
+            continue
+
+        recipient = recipients[index]
+        tree[index] = tree[index] - amount if recipient.is_recurring else 0
+        assignments.append(recipient)
+
+    return assignments
+
+
+MAX_SPLIT_LEGS = 8
+SPLIT_SEARCH_BUDGET = 20000
+
+
+def plan_split(amount, recipients=None, max_legs=MAX_SPLIT_LEGS, budget=SPLIT_SEARCH_BUDGET):
+    """
+    Split amount across the fewest recipients. Every leg respects the recipient's min_threshold and
+    remaining capacity, one-time recipients get at most one leg, and among plans with the same number
+    of legs the one using the highest priority recipients is preferred.
+    Returns a list of (recipient, leg_amount) in priority order, or None when no plan is found.
+
+    The search is bounded: for each leg count it explores at most `budget` nodes, pruning with the
+    best capacities still available, so it stays fast with hundreds of recipients.
+    """
+    if amount <= 0:
+        return None
+    if recipients is None:
+        recipients = get_capacity_snapshot()
+
+    candidates = [
+        (recipient, max(recipient.min_threshold or 0, 1), get_available_capacity(recipient))
+        for recipient in recipients
+    ]
+    candidates = [(recipient, low, high) for recipient, low, high in candidates if low <= high and low <= amount]
+    if not candidates:
+        return None
+
+    # best_suffix[i][m]: largest total capacity of m recipients taken from candidates[i:]
+    count = len(candidates)
+    best_suffix = [[0]] * (count + 1)
+    top = []
+    for index in range(count - 1, -1, -1):
+        top = sorted(top + [candidates[index][2]], reverse=True)[:max_legs]
+        sums = [0]
+        for capacity in top:
+            sums.append(sums[-1] + capacity)
+        best_suffix[index] = sums
+
+    all_capacities = best_suffix[0]
+    fewest = next((legs for legs in range(1, len(all_capacities)) if all_capacities[legs] >= amount), None)
+    if fewest is None:
+        return None
+
+    for legs in range(fewest, min(max_legs, count) + 1):
+        chosen = _search_legs(candidates, best_suffix, amount, legs, budget)
+        if chosen is not None:
+            return _distribute(amount, [candidates[index] for index in chosen])
+    return None
+
+
+def _search_legs(candidates, best_suffix, amount, legs, budget):
+    """Depth-first search in priority order for `legs` candidates that can cover amount exactly"""
+    nodes = 0
+    chosen = []
+
+    def search(start, low_total, high_total):
+        nonlocal nodes
+        missing = legs - len(chosen)
+        if missing == 0:
+            return low_total <= amount <= high_total
+        for index in range(start, len(candidates) - missing + 1):
+            nodes += 1
+            if nodes > budget:
+                return False
+            suffix = best_suffix[index]
+            if missing >= len(suffix) or high_total + suffix[missing] < amount:
+                # Even the largest remaining capacities cannot cover the amount from here on
+                return False
+            _, low, high = candidates[index]
+            if low_total + low > amount:
+                continue
+            chosen.append(index)
+            if search(index + 1, low_total + low, high_total + high):
+                return True
+            chosen.pop()
+        return False
+
+    return list(chosen) if search(0, 0, 0) else None
+
+
+def _distribute(amount, legs):
+    """Give every leg its minimum, then fill the rest in priority order up to each capacity"""
+    assigned = [low for _, low, _ in legs]
+    rest = amount - sum(assigned)
+    for position, (_, low, high) in enumerate(legs):
+        extra = min(rest, high - low)
+        assigned[position] += extra
+        rest -= extra
+    return [(recipient, leg_amount) for (recipient, _, _), leg_amount in zip(legs, assigned)]
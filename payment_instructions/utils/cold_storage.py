@@ -0,0 +1,97 @@
+import os
+import tempfile
+
+from django.core.files import File
+from PIL import Image
+
+from .file_compression import FileCompressor
+from .thumbnails import generate_thumbnail
+from ..models import ArchivedPayment, PackedProof, Payment, ProofBlob
+from ..upload_handlers import sniff_content_type
+
+# Re-encodes that save less than this share of the current file are not worth another generation loss
+MIN_SAVING = 0.1
+
+
+def recompress_stored_proof(path):
+    """
+    Re-encode the proof at path with the cold profile into a temporary file and decode the result
+    completely to check it. Returns (temporary path, filename, size before, size after), or None when
+    the cold version would not save MIN_SAVING. Runs inside a pool process: filesystem only.
+    """
+    before = os.path.getsize(path)
+    with open(path, 'rb') as source:
+        content_type = sniff_content_type(source.read(8))
+        if content_type is None:
+            raise ValueError(f'Tipo de archivo no reconocido: {os.path.basename(path)}')
+        upload = File(source, name=os.path.basename(path))
+        upload.content_type = content_type
+        compressed = FileCompressor.compress_file(upload, cold=True, parallel=False)
+        if compressed is upload:
+            # FileCompressor hands back the original when it cannot process the file
+            raise ValueError(f'No se pudo comprimir {os.path.basename(path)}')
+
+    with compressed:
+        if compressed.size > before * (1 - MIN_SAVING):
+            return None
+        suffix = os.path.splitext(compressed.name)[1]
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as output:
+            for chunk in compressed.chunks():
+                output.write(chunk)
+
+    try:
+        with Image.open(output.name) as img:
+            img.load()
+    except Exception:
+        os.unlink(output.name)
+        raise
+    return output.name, os.path.basename(compressed.name), before, compressed.size
+
+
+def cold_candidates(cutoff, after='', limit=100):
+    """
+    Up to limit stored proof names after the given one, in name order, that every payment using them
+    was created before cutoff, that aren't cold or packed yet and aren't waiting for compression
+    """
+    # One subquery per condition, so each is an index search rather than a scan of the payments
+    excluded = [
+        Payment.objects.filter(created_at__gte=cutoff).values('proof_of_payment_file'),
+        Payment.objects.filter(proof_status=Payment.PROOF_PROCESSING).values('proof_of_payment_file'),
+        PackedProof.objects.values('name'),
+    ]
+    names = set()
+    for model in (Payment, ArchivedPayment):
+        queryset = model.objects.filter(created_at__lt=cutoff, proof_of_payment_file__gt=after).exclude(
+            compression_profile=FileCompressor.PROFILE_COLD
+        )
+        for names_in_use in excluded:
+            queryset = queryset.exclude(proof_of_payment_file__in=names_in_use)
+        queryset = queryset.order_by('proof_of_payment_file')
+        names.update(queryset.values_list('proof_of_payment_file', flat=True).distinct()[:limit])
+    return sorted(names)[:limit]
+
+
+def swap_in(name, result):
+    """
+    Store a cold re-encode as a blob and move every payment using name over to it in one transaction.
+    Returns the bytes reclaimed (0 if the file had no payments left).
+    """
+    temporary_path, filename, before, after = result
+    try:
+        # Uploads of the same original keep finding their (now cold) proof
+        source_sha256 = ProofBlob.objects.filter(name=name).values_list('source_sha256', flat=True).first() or ''
+        with open(temporary_path, 'rb') as compressed:
+            blob = ProofBlob.objects.store(
+                File(compressed, name=filename), source_sha256, FileCompressor.PROFILE_COLD
+            )
+    finally:
+        os.unlink(temporary_path)
+
+    if blob.name == name or not ProofBlob.objects.replace(name, blob):
+        return 0
+    try:
+        generate_thumbnail(blob.name)
+    except Exception:
+        # The admin generates missing thumbnails on first view
+        pass
+    return before - after
@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures.process import BrokenProcessPool
+
+from django.core.files import File
+
+from .file_compression import FileCompressor
+from .thumbnails import generate_thumbnail, delete_thumbnail
+from ..models import CompressionJob, ProofBlob
+
+CONTENT_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.pdf': 'application/pdf',
+}
+
+
+def compress_stored_proof(path, content_type):
+    """
+    Compress the file at path into a temporary file and return (temporary path, filename, profile).
+    When the encoded result is not smaller, the temporary file is a copy of the original instead,
+    with the original profile. Runs inside a pool process, so it only touches the filesystem, never
+    the database, and renders PDF pages serially rather than starting a nested pool.
+    """
+    content_type = content_type or CONTENT_TYPES.get(os.path.splitext(path)[1].lower(), 'application/pdf')
+    with open(path, 'rb') as source:
+        upload = File(source, name=os.path.basename(path))
+        upload.content_type = content_type
+        compressed = FileCompressor.compress_file(upload, parallel=False)
+        if compressed is upload:
+            # FileCompressor hands back the original when it cannot process the file
+            raise ValueError(f'No se pudo comprimir {os.path.basename(path)}')
+
+    if compressed.size >= os.path.getsize(path):
+        # Already small (e.g. a text-only PDF): re-encoding would only inflate it
+        compressed.close()
+        with open(path, 'rb') as source, tempfile.NamedTemporaryFile(
+            suffix=os.path.splitext(path)[1], delete=False
+        ) as output:
+            shutil.copyfileobj(source, output)
+        return output.name, os.path.basename(path), FileCompressor.PROFILE_ORIGINAL
+
+    suffix = os.path.splitext(compressed.name)[1]
+    with compressed, tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as output:
+        for chunk in compressed.chunks():
+            output.write(chunk)
+    return output.name, os.path.basename(compressed.name), compressed.profile
+
+
+def process_jobs(executor, limit):
+    """
+    Claim up to limit due jobs, compress them on executor and record the results.
+    Returns the number of jobs claimed; database writes all happen in the calling process.
+    If a pool process dies (e.g. killed for memory), the claimed jobs it took down are sent back
+    through CompressionJob.objects.fail() and BrokenProcessPool is raised so the caller can start
+    a new pool.
+    """
+    jobs = CompressionJob.objects.claim(limit)
+    storage = ProofBlob.storage()
+    broken = None
+
+    futures = []
+    for job in jobs:
+        try:
+            future = executor.submit(compress_stored_proof, storage.path(job.file_name), job.content_type)
+        except BrokenProcessPool as e:
+            broken = e
+            future = None
+        futures.append((job, future))
+
+    for job, future in futures:
+        try:
+            if future is None:
+                raise broken
+            temporary_path, filename, profile = future.result()
+            try:
+                with open(temporary_path, 'rb') as compressed:
+                    blob = ProofBlob.objects.store(File(compressed, name=filename), job.source_sha256, profile)
+            finally:
+                os.unlink(temporary_path)
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                broken = e
+            CompressionJob.objects.fail(job, f'{type(e).__name__}: {e}')
+            continue
+
+        if CompressionJob.objects.complete(job, blob):
+            try:
+                generate_thumbnail(blob.name)
+            except Exception:
+                # The admin generates missing thumbnails on first view
+                pass
+        storage.delete(job.file_name)
+        delete_thumbnail(job.file_name)
+
+    if broken is not None:
+        raise broken
+    return len(jobs)
@@ -0,0 +1,161 @@
+import heapq
+import itertools
+import os
+import time
+
+from django.urls import reverse
+from django.utils import timezone
+
+from .proof_packs import iter_proof
+from .streaming import stream_csv, stream_xlsx, stream_zip
+from ..models import PackedProof, ProofBlob
+
+EXPORT_HEADER = [
+    'ID', 'Fecha', 'Monto', 'Alias', 'CBU', 'Destinatario', 'Especialista', 'Operador', 'Comprobante', 'Notas',
+    'Archivado',
+]
+EXPORT_FIELDS = (
+    'id', 'created_at', 'amount', 'payment_recipient__alias', 'payment_recipient__cbu', 'payment_recipient__name',
+    'specialist__name', 'operator_user__username', 'proof_of_payment_file', 'notes',
+)
+# Rows fetched from the database cursor at a time
+FETCH_SIZE = 2000
+
+ARCHIVE_HEADER = ['ID', 'Fecha', 'Monto', 'Alias', 'Archivo']
+ARCHIVE_FIELDS = ('id', 'created_at', 'amount', 'payment_recipient__alias', 'proof_of_payment_file')
+MANIFEST_NAME = 'comprobantes.csv'
+# Payments whose packed proofs are looked up with one query; stays under SQLite's parameter limit
+ARCHIVE_BATCH = 500
+
+EXPORT_FORMATS = {
+    'csv': (stream_csv, 'text/csv; charset=utf-8'),
+    'xlsx': (stream_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+
+def filter_payments(queryset, start=None, end=None, recipient=None, specialist=None):
+    """Restrict payments (live or archived) to [start, end), a recipient alias and a specialist name, in SQL"""
+    if start is not None:
+        queryset = queryset.filter(created_at__gte=start)
+    if end is not None:
+        queryset = queryset.filter(created_at__lt=end)
+    if recipient:
+        queryset = queryset.filter(payment_recipient__alias=recipient)
+    if specialist:
+        queryset = queryset.filter(specialist__name=specialist)
+    return queryset
+
+
+def proof_url_template(model, base_url=''):
+    """URL of the admin proof view for a model, with {} in place of the object id"""
+    url = reverse(f'admin:{model._meta.app_label}_{model._meta.model_name}_proof', args=[0])
+    prefix, suffix = url.rsplit('/0/', 1)
+    return base_url.rstrip('/') + prefix + '/{}/' + suffix
+
+
+def export_rows(querysets, base_url=''):
+    """
+    Export rows of the payments in querysets, merged in creation order. Each queryset is read with
+    one joined query through a chunked cursor, so memory doesn't grow with the number of rows.
+    Proofs link to the admin proof view, which keeps working after proofs are re-encoded or packed.
+    """
+    def read(queryset):
+        url = proof_url_template(queryset.model, base_url)
+        archived = 'Sí' if queryset.model._meta.model_name == 'archivedpayment' else 'No'
+        rows = queryset.order_by('created_at', 'id').values_list(*EXPORT_FIELDS).iterator(chunk_size=FETCH_SIZE)
+        for row in rows:
+            yield row, url, archived
+
+    sources = [read(queryset) for queryset in querysets]
+    for row, url, archived in heapq.merge(*sources, key=lambda item: (item[0][1], item[0][0])):
+        pk, created_at, amount, alias, cbu, name, specialist, operator, proof, notes = row
+        yield [
+            pk,
+            timezone.localtime(created_at).strftime('%Y-%m-%d %H:%M'),
+            amount,
+            alias,
+            cbu,
+            name,
+            specialist,
+            operator,
+            url.format(pk) if proof else '',
+            notes,
+            archived,
+        ]
+
+
+class ExportTimer:
+    """Counts the rows passing through and measures the export rate"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.count = 0
+        self.elapsed = 0
+
+    def __iter__(self):
+        started = time.perf_counter()
+        for row in self.rows:
+            self.count += 1
+            yield row
+        self.elapsed = time.perf_counter() - started
+
+    @property
+    def rate(self):
+        return self.count / self.elapsed if self.elapsed else 0
+
+    def __str__(self):
+        return f'{self.count} payments in {self.elapsed:.1f}s ({self.rate:.0f} rows/s)'
+
+
+def stream_export(querysets, export_format='csv', base_url=''):
+    """Return (chunk iterator, content type, timer) for an export in the given format"""
+    stream, content_type = EXPORT_FORMATS[export_format]
+    timer = ExportTimer(export_rows(querysets, base_url))
+    return stream(EXPORT_HEADER, timer), content_type, timer
+
+
+def proof_members(rows, manifest):
+    """
+    ZIP members with the proofs of the given payment rows (ARCHIVE_FIELDS), each read in chunks when
+    the archive gets to it. A proof shared by several payments goes in once; every payment gets a
+    manifest row with its file in the archive, or a note when its proof can't be found.
+    """
+    storage = ProofBlob.storage()
+    included = {}
+    while True:
+        batch = list(itertools.islice(rows, ARCHIVE_BATCH))
+        if not batch:
+            break
+        names = {row[-1] for row in batch} - included.keys()
+        loose = {name for name in names if storage.exists(name)}
+        packed = {proof.name: proof for proof in PackedProof.objects.filter(name__in=names - loose)}
+
+        for pk, created_at, amount, alias, name in batch:
+            created_at = timezone.localtime(created_at)
+            if name not in included and (name in loose or name in packed):
+                included[name] = f"{created_at:%Y-%m}/pago_{pk}{os.path.splitext(name)[1]}"
+                # Proofs are JPEG, PNG or PDF: already compressed, so they are stored as they are
+                yield included[name], iter_proof(name, packed.get(name)), False
+            manifest.append([
+                pk, created_at.strftime('%Y-%m-%d %H:%M'), amount, alias, included.get(name, 'No encontrado'),
+            ])
+
+
+def stream_proof_archive(queryset):
+    """
+    Return (chunk iterator, timer) for a ZIP of the proofs of the payments in queryset, in creation
+    order, with a CSV manifest mapping payment ids to files at the end. Payments are read through a
+    chunked cursor and files one chunk at a time; only the manifest rows are kept until the end.
+    """
+    rows = (
+        queryset.exclude(proof_of_payment_file='').order_by('created_at', 'id')
+        .values_list(*ARCHIVE_FIELDS).iterator(chunk_size=FETCH_SIZE)
+    )
+    timer = ExportTimer(rows)
+    manifest = []
+
+    def members():
+        yield from proof_members(iter(timer), manifest)
+        yield MANIFEST_NAME, stream_csv(ARCHIVE_HEADER, manifest), True
+
+    return stream_zip(members()), timer
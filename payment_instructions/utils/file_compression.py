@@ -1,8 +1,29 @@
+import logging
+import math
 import os
-from PIL import Image
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps, ImageStat
 import fitz
-from io import BytesIO
-from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.files.uploadedfile import UploadedFile
+
+logger = logging.getLogger(__name__)
+
+
+def render_pdf_page(source, page_number, dpi):
+    """
+    Rasterize one page to (mode, size, samples). source is an open document or a path;
+    with a path this runs in a pool process, which opens its own copy of the document.
+    """
+    doc = fitz.open(source) if isinstance(source, str) else source
+    try:
+        zoom = dpi / 72  # default PDF DPI is 72
+        pix = doc[page_number].get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        return 'RGB', (pix.width, pix.height), pix.samples
+    finally:
+        if doc is not source:
+            doc.close()
+
 
 class FileCompressor:
     # Lower quality for maximum compression while maintaining readability
@@ -10,96 +31,283 @@ class FileCompressor:
     MAX_WIDTH = 1200   # Maximum width in pixels
     MAX_HEIGHT = 1600  # Maximum height in pixels
     TARGET_SIZE_KB = 50  # Target file size in KB
+    MIN_QUALITY = 30  # Minimum JPEG quality before the resolution is lowered instead
+    MIN_SCALE = 0.5  # Never shrink below half of the MAX_WIDTH x MAX_HEIGHT fit
+    MAX_PIXELS = 40 * 1000 * 1000  # Larger images are refused as possible decompression bombs
+    PDF_MIN_DPI = 72
+    PDF_MAX_DPI = 200
+    PDF_MAX_PAGES = 8  # Pages after this one are left out of the contact sheet
+    PDF_MAX_SIZE_KB = 200  # Size budget of a multi-page contact sheet
+    PDF_PAGE_GAP = 8  # Separator between pages in pixels
+    PDF_RENDER_WORKERS = min(os.cpu_count() or 1, 4)
+    SPOOL_MAX_SIZE = 1024 * 1024  # Encoded output kept in memory up to this size, then on disk
+    # Encoding profiles, picked per proof by analyze()
+    PROFILE_PHOTO = 'photo'  # Full colour JPEG
+    PROFILE_GRAYSCALE = 'grayscale'  # Single channel JPEG
+    PROFILE_DOCUMENT = 'document'  # Palette PNG
+    PROFILE_COLD = 'cold'  # Re-encoded for long-term storage: grayscale, fewer levels, smaller budget
+    PROFILE_ORIGINAL = 'original'  # Kept as uploaded: no encode came out smaller
+    ANALYSIS_SIZE = 128  # Classification runs on a sample this large
+    DOCUMENT_COLORS = 16  # Palette size of document PNGs
+    DOCUMENT_BACKGROUND_SHARE = 0.4  # Minimum share of the most common colour (the paper or screen)
+    DOCUMENT_TOP_COLORS_SHARE = 0.9  # Minimum share of the 8 most common colours
+    GRAYSCALE_MAX_SATURATION = 12  # Mean HSV saturation (0-255) below which colour is dropped
+    COLD_TARGET_SIZE_KB = 25  # Target file size of the cold profile
+    COLD_DOCUMENT_COLORS = 4  # Gray levels of cold documents: text, anti-aliasing and paper
     
     @staticmethod
-    def compress_image(image_file):
-        """Compress image files while maintaining readability for bank proofs"""
-        try:
-            # Open the image
-            img = Image.open(image_file)
+    def new_output():
+        """Buffer for an encoded result that moves to a temporary file if it grows large"""
+        return tempfile.SpooledTemporaryFile(max_size=FileCompressor.SPOOL_MAX_SIZE)
+    
+    @staticmethod
+    def source_path(file_obj):
+        """Filesystem path of an uploaded or stored file, so decoders can read it without a copy in memory"""
+        if hasattr(file_obj, 'temporary_file_path'):
+            return file_obj.temporary_file_path()
+        path = getattr(getattr(file_obj, 'file', None), 'name', None)
+        if isinstance(path, str) and os.path.isfile(path):
+            return path
+        return None
+    
+    @staticmethod
+    def read_dimensions(file_obj):
+        """Width and height from the image header, without decoding any pixels"""
+        file_obj.seek(0)
+        with Image.open(file_obj) as img:
+            size = img.size
+        file_obj.seek(0)
+        return size
+    
+    @staticmethod
+    def load_image(image_file, box=None):
+        """
+        Decode an image as RGB (or grayscale) fitted within box (MAX_WIDTH x MAX_HEIGHT by default), never
+        holding it at full size when the decoder can avoid it: JPEGs are decoded at a reduced DCT scale (draft)
+        and other formats are box-reduced by an integer factor before the alpha channel is flattened.
+        """
+        # Open from disk when the file is spooled there; only the header is read at this point.
+        # The source is closed on the way out (also when refused), so pool workers don't leak descriptors.
+        with Image.open(FileCompressor.source_path(image_file) or image_file) as source:
+            img = source
+            width, height = img.size
+            if width * height > FileCompressor.MAX_PIXELS:
+                raise ValueError(f'Image too large: {width}x{height}')
+            
+            box = box or (FileCompressor.MAX_WIDTH, FileCompressor.MAX_HEIGHT)
+            scale = min(box[0] / width, box[1] / height, 1)
+            target = (max(1, int(width * scale)), max(1, int(height * scale)))
+            
+            # JPEG: let libjpeg decode straight at 1/2, 1/4 or 1/8 scale while staying above the target
+            if img.format == 'JPEG':
+                img.draft('RGB', target)
+            
+            if img.mode in ('P', 'LA'):
+                img = img.convert('RGBA')
+            
+            # Integer box reduction while the image is still at least twice the target size
+            factor = min(img.width // target[0], img.height // target[1])
+            if factor >= 2:
+                img = img.reduce(factor)
             
             # Convert to RGB if necessary (removes alpha channel)
-            if img.mode in ('RGBA', 'LA', 'P'):
+            if img.mode == 'RGBA':
                 background = Image.new('RGB', img.size, (255, 255, 255))
-                if img.mode == 'P':
-                    img = img.convert('RGBA')
-                background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
+                background.paste(img, mask=img.split()[-1])
                 img = background
+            elif img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
             
             # Calculate new dimensions while maintaining aspect ratio
-            img.thumbnail((FileCompressor.MAX_WIDTH, FileCompressor.MAX_HEIGHT), Image.Resampling.LANCZOS)
-            
-            # Progressive compression to reach target size
-            quality = FileCompressor.JPEG_QUALITY
-            output = BytesIO()
-            
-            while quality > 30:  # Minimum quality threshold
-                output = BytesIO()
-                img.save(output, format='JPEG', quality=quality, optimize=True)
-                size_kb = output.tell() / 1024
-                
-                if size_kb <= FileCompressor.TARGET_SIZE_KB:
-                    break
-                    
-                quality -= 10
-                
-                # If still too large, reduce dimensions
-                if quality <= 50 and size_kb > FileCompressor.TARGET_SIZE_KB:
-                    new_width = int(img.width * 0.8)
-                    new_height = int(img.height * 0.8)
-                    img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            output.seek(0)
+            img.thumbnail(box, Image.Resampling.LANCZOS)
+            if img is source:
+                # Still the opened file: keep a loaded copy that outlives it
+                img = img.copy()
+        return img
+    
+    @staticmethod
+    def analyze(img):
+        """
+        Classify an image as (document, grayscale) from a small sample: a document is dominated by one
+        background colour with nearly every pixel in a handful of colours; grayscale has almost no saturation.
+        """
+        scale = min(FileCompressor.ANALYSIS_SIZE / img.width, FileCompressor.ANALYSIS_SIZE / img.height, 1)
+        sample = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))), Image.Resampling.BOX)
+        if sample.mode == 'L':
+            saturation = 0
+            sample = sample.convert('RGB')
+        else:
+            saturation = ImageStat.Stat(sample.convert('HSV')).mean[1]
+        
+        # 3 bits per channel merges anti-aliasing and JPEG noise into the colour they belong to
+        counts = sorted((count for count, _ in ImageOps.posterize(sample, 3).getcolors(512)), reverse=True)
+        total = sum(counts)
+        document = (
+            counts[0] >= total * FileCompressor.DOCUMENT_BACKGROUND_SHARE
+            and sum(counts[:8]) >= total * FileCompressor.DOCUMENT_TOP_COLORS_SHARE
+        )
+        return document, saturation < FileCompressor.GRAYSCALE_MAX_SATURATION
+    
+    @staticmethod
+    def target_bytes(cold=False, pages=1):
+        """Size budget of a proof; contact sheets get one target per page up to PDF_MAX_SIZE_KB (scaled when cold)"""
+        target_kb = FileCompressor.COLD_TARGET_SIZE_KB if cold else FileCompressor.TARGET_SIZE_KB
+        if pages > 1:
+            limit_kb = FileCompressor.PDF_MAX_SIZE_KB * target_kb // FileCompressor.TARGET_SIZE_KB
+            target_kb = min(target_kb * pages, limit_kb)
+        return target_kb * 1024
+    
+    @staticmethod
+    def encode_document(img, grayscale=False, colors=None):
+        """Encode img as a palette PNG of up to colors entries (4 bits or less); returns (buffer, size in bytes)"""
+        colors = colors or FileCompressor.DOCUMENT_COLORS
+        source = img.convert('L') if grayscale and img.mode != 'L' else img
+        output = FileCompressor.new_output()
+        source.quantize(colors).save(output, format='PNG', optimize=True, bits=max(colors - 1, 1).bit_length())
+        return output, output.tell()
+    
+    @staticmethod
+    def encode_proof(img, target_bytes, max_quality=None, cold=False):
+        """
+        Encode img with the profile that suits it within target_bytes. Documents become a palette PNG
+        when it fits, otherwise a JPEG (single channel when the image has no colour worth keeping).
+        cold always drops colour and uses fewer gray levels for documents.
+        Returns (buffer positioned at 0, size, profile, file extension, content type).
+        """
+        document, grayscale = FileCompressor.analyze(img)
+        grayscale = grayscale or cold
+        colors = FileCompressor.COLD_DOCUMENT_COLORS if cold else FileCompressor.DOCUMENT_COLORS
+        if document:
+            # A half-size trial at least half the budget means the full image won't fit
+            trial = img.reduce(2) if img.width >= 64 and img.height >= 64 else img
+            if trial is img or FileCompressor.encode_document(trial, grayscale, colors)[1] * 2 <= target_bytes:
+                output, size = FileCompressor.encode_document(img, grayscale, colors)
+                if size <= target_bytes:
+                    output.seek(0)
+                    profile = FileCompressor.PROFILE_COLD if cold else FileCompressor.PROFILE_DOCUMENT
+                    return output, size, profile, '.png', 'image/png'
+                output.close()
+        
+        if grayscale and img.mode != 'L':
+            img = img.convert('L')
+        if cold:
+            profile = FileCompressor.PROFILE_COLD
+        else:
+            profile = FileCompressor.PROFILE_GRAYSCALE if img.mode == 'L' else FileCompressor.PROFILE_PHOTO
+        # Pick quality and, only if needed, a smaller resolution to reach the target size
+        encoder = SizeTargetEncoder(target_bytes, max_quality=max_quality)
+        output, size, img, quality = encoder.fit(img)
+        output.seek(0)
+        return output, size, profile, '.jpg', 'image/jpeg'
+    
+    @staticmethod
+    def compress_image(image_file, cold=False):
+        """Compress image files while maintaining readability for bank proofs"""
+        try:
+            img = FileCompressor.load_image(image_file)
+            output, size, profile, extension, content_type = FileCompressor.encode_proof(
+                img, FileCompressor.target_bytes(cold), cold=cold
+            )
             
             # Generate new filename
             name = os.path.splitext(image_file.name)[0]
-            new_filename = f"{name}_compressed.jpg"
+            new_filename = f"{name}_compressed{extension}"
             
-            return InMemoryUploadedFile(
-                output,
-                'ImageField',
-                new_filename,
-                'image/jpeg',
-                output.tell(),
-                None
-            )
+            compressed = UploadedFile(output, new_filename, content_type, size)
+            compressed.profile = profile
+            return compressed
             
-        except Exception as e:
-            print(f"Error compressing image: {str(e)}")
+        except Exception:
+            logger.exception('Error compressing image %s', image_file.name)
             return image_file
     
     @staticmethod
-    def pdf_to_jpeg(pdf_file, dpi=100, quality=75, single_page=True):
+    def page_dpi(rect, max_height):
+        """Render DPI that fits a page of this size (in points) within MAX_WIDTH x max_height pixels"""
+        zoom = min(FileCompressor.MAX_WIDTH / rect.width, max_height / rect.height)
+        # Slightly under the exact fit: the rendered pixel box is rounded outwards
+        return min(max(zoom * 72 * 0.999, FileCompressor.PDF_MIN_DPI), FileCompressor.PDF_MAX_DPI)
+    
+    @staticmethod
+    def render_pages(doc, path, page_numbers, dpi=None, parallel=True):
+        """
+        Rasterize the given pages as PIL images, each at its own DPI unless dpi is given.
+        With a path and more than one page, pages are rendered in parallel across PDF_RENDER_WORKERS processes,
+        unless parallel is False (callers already running inside a pool process).
+        """
+        # A lone page fits the usual box; pages of a contact sheet are fitted by width (long pages capped)
+        max_height = FileCompressor.MAX_HEIGHT if len(page_numbers) == 1 else FileCompressor.MAX_HEIGHT * 2
+        dpis = [dpi or FileCompressor.page_dpi(doc[number].rect, max_height) for number in page_numbers]
+        workers = min(FileCompressor.PDF_RENDER_WORKERS, len(page_numbers))
+        
+        if parallel and path and workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                rendered = list(executor.map(render_pdf_page, [path] * len(page_numbers), page_numbers, dpis))
+        else:
+            rendered = [render_pdf_page(doc, number, page_dpi) for number, page_dpi in zip(page_numbers, dpis)]
+        return [Image.frombytes(mode, size, samples) for mode, size, samples in rendered]
+    
+    @staticmethod
+    def stitch_pages(pages):
+        """Stack pages vertically on a white sheet, centred, with a thin grey separator between them"""
+        gap = FileCompressor.PDF_PAGE_GAP
+        width = max(page.width for page in pages)
+        height = sum(page.height for page in pages) + gap * (len(pages) - 1)
+        sheet = Image.new('RGB', (width, height), (255, 255, 255))
+        y = 0
+        for page in pages:
+            if y:
+                sheet.paste((200, 200, 200), (0, y - gap, width, y))
+            sheet.paste(page, ((width - page.width) // 2, y))
+            y += page.height + gap
+        return sheet
+    
+    @staticmethod
+    def pdf_to_jpeg(pdf_file, dpi=None, quality=75, single_page=False, pages=None, cold=False, parallel=True):
+        """
+        Convert a PDF proof to one image (a JPEG, or a PNG for documents). A single-page PDF (or
+        single_page=True) becomes that page; otherwise every page, or only the page numbers in pages
+        (0-based), up to PDF_MAX_PAGES, is rendered and stacked into a vertical contact sheet within
+        a size budget that grows per page. parallel is passed on to render_pages.
+        """
         try:
-            pdf_file.seek(0)
-            doc = fitz.open(stream=pdf_file.read(), filetype="pdf")
+            path = FileCompressor.source_path(pdf_file)
+            if path:
+                doc = fitz.open(path, filetype="pdf")
+            else:
+                pdf_file.seek(0)
+                doc = fitz.open(stream=pdf_file.read(), filetype="pdf")
 
-            zoom = dpi / 72  # default PDF DPI is 72
-            mat = fitz.Matrix(zoom, zoom)
+            with doc:
+                page_numbers = [number for number in (pages or range(doc.page_count)) if 0 <= number < doc.page_count]
+                if single_page:
+                    page_numbers = page_numbers[:1]
+                page_numbers = page_numbers[:FileCompressor.PDF_MAX_PAGES]
+                if not page_numbers:
+                    raise ValueError('El PDF no tiene páginas')
+                rendered = FileCompressor.render_pages(doc, path, page_numbers, dpi, parallel=parallel)
 
-            page = doc[0]
-            pix = page.get_pixmap(matrix=mat)
-            output = BytesIO()
-            pix.pil_save(output, format="JPEG", optimize=True, quality=quality)
-            output.seek(0)
+            img = rendered[0] if len(rendered) == 1 else FileCompressor.stitch_pages(rendered)
+            output, size, profile, extension, content_type = FileCompressor.encode_proof(
+                img, FileCompressor.target_bytes(cold, len(rendered)), max_quality=quality, cold=cold
+            )
 
-            new_filename = os.path.splitext(pdf_file.name)[0] + ".jpg"
-            return InMemoryUploadedFile(
-                    output,
-                    'FileField',
-                    new_filename,
-                    'image/jpeg',
-                    output.getbuffer().nbytes,
-                    None)
+            new_filename = os.path.splitext(pdf_file.name)[0] + extension
+            compressed = UploadedFile(output, new_filename, content_type, size)
+            compressed.profile = profile
+            return compressed
 
-        except Exception as e:
-            print(f"Error converting PDF to JPEG: {str(e)}")
+        except Exception:
+            logger.exception('Error converting PDF %s to an image', pdf_file.name)
             return pdf_file
         
 
     @staticmethod
-    def compress_file(file_obj):
-        """Main method to compress any supported file"""
+    def compress_file(file_obj, cold=False, parallel=True):
+        """
+        Main method to compress any supported file; cold re-encodes with the cold storage profile.
+        Pass parallel=False from pool workers so PDF pages are rendered in the worker itself.
+        """
         if not file_obj:
             return None
         
@@ -107,6 +315,106 @@ class FileCompressor:
         content_type = file_obj.content_type.lower()
         
         if content_type in ['image/jpeg', 'image/jpg', 'image/png', 'image/gif']:
-            return FileCompressor.compress_image(file_obj)
+            return FileCompressor.compress_image(file_obj, cold=cold)
         else:
-            return FileCompressor.pdf_to_jpeg(file_obj)
\ No newline at end of file
+            return FileCompressor.pdf_to_jpeg(file_obj, cold=cold, parallel=parallel)
+
+
+class SizeTargetEncoder:
+    """
+    Chooses JPEG quality and resolution together to fit a byte budget in a bounded number of encodes.
+    After one full encode at the maximum quality, quality is binary searched on a half-size trial image:
+    its size relative to its own maximum-quality encode predicts the full image's at a quarter of the
+    cost. Each full encode that misses recalibrates the prediction. The image is only shrunk when even
+    the minimum quality is predicted not to fit.
+    """
+    QUALITY_STEP = 5
+    MAX_ENCODES = 8
+    # Predictions aim slightly under the target so a near miss doesn't cost another full encode
+    PREDICTION_MARGIN = 0.93
+    
+    def __init__(self, target_bytes, max_quality=None, min_quality=None, min_scale=None):
+        self.target_bytes = target_bytes
+        self.max_quality = max_quality or FileCompressor.JPEG_QUALITY
+        self.min_quality = min_quality or FileCompressor.MIN_QUALITY
+        self.min_scale = min_scale or FileCompressor.MIN_SCALE
+        self.encodes = 0
+    
+    def encode(self, img, quality, optimize=True):
+        """Encode img as JPEG into a new buffer; returns (buffer, size in bytes)"""
+        output = FileCompressor.new_output()
+        img.save(output, format='JPEG', quality=quality, optimize=optimize)
+        self.encodes += 1
+        return output, output.tell()
+    
+    def encoded_size(self, img, quality):
+        # Trial sizes are only compared with each other, so the slower optimized encode isn't needed
+        output, size = self.encode(img, quality, optimize=False)
+        output.close()
+        return size
+    
+    def fit(self, img):
+        """Return (buffer, size, encoded image, quality); the buffer is positioned at its end"""
+        target = self.target_bytes
+        min_width = max(1, int(img.width * self.min_scale))
+        
+        quality = self.max_quality
+        output, size = self.encode(img, quality)
+        if size <= target:
+            return output, size, img, quality
+        
+        trial = img.reduce(2) if img.width >= 64 and img.height >= 64 else img
+        trial_sizes = {self.max_quality: self.encoded_size(trial, self.max_quality)}
+        correction = size / trial_sizes[self.max_quality]
+        
+        budget = target * self.PREDICTION_MARGIN
+        
+        def predict(quality):
+            if quality not in trial_sizes:
+                if self.encodes >= self.MAX_ENCODES - 1:
+                    # Keep the last encode for the real image
+                    return float('inf')
+                trial_sizes[quality] = self.encoded_size(trial, quality)
+            return trial_sizes[quality] * correction
+        
+        # Highest quality on the QUALITY_STEP grid predicted to fit, below every quality seen too large
+        too_large = self.max_quality
+        while self.encodes < self.MAX_ENCODES:
+            grid = list(range(self.min_quality, too_large, self.QUALITY_STEP))
+            if not grid or predict(grid[0]) > budget:
+                break
+            low, high = 0, len(grid) - 1
+            while low < high:
+                middle = (low + high + 1) // 2
+                if predict(grid[middle]) <= budget:
+                    low = middle
+                else:
+                    high = middle - 1
+            quality = grid[low]
+            
+            output.close()
+            output, size = self.encode(img, quality)
+            if size <= target:
+                return output, size, img, quality
+            # Misprediction: calibrate on this encode and search again below it
+            correction *= size / predict(quality)
+            too_large = quality
+        
+        # Even the minimum quality does not fit: lower the resolution instead, sized from the prediction
+        estimate = predict(self.min_quality) if too_large > self.min_quality else size
+        while img.width > min_width and self.encodes < self.MAX_ENCODES:
+            img = self.shrink(img, math.sqrt(budget / estimate), min_width)
+            quality = self.min_quality
+            output.close()
+            output, size = self.encode(img, quality)
+            if size <= target:
+                break
+            estimate = size
+        return output, size, img, quality
+    
+    @staticmethod
+    def shrink(img, scale, min_width):
+        """Resize by scale (with a small margin) but not below min_width"""
+        width = max(min_width, int(img.width * scale * 0.95))
+        height = max(1, round(img.height * width / img.width))
+        return img.resize((width, height), Image.Resampling.LANCZOS)
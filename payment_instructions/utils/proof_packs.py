@@ -0,0 +1,135 @@
+import os
+import struct
+import zipfile
+import zlib
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from ..models import ArchivedPayment, MonthClose, PackedProof, Payment, ProofBlob, local_month_range
+
+# Fixed part of a ZIP local file header; the file name and extra field follow it
+LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+
+
+def open_proof(name):
+    """Open a stored proof for reading, from its own file or, once packed, from its monthly pack"""
+    storage = ProofBlob.storage()
+    if storage.exists(name):
+        return storage.open(name, 'rb')
+    packed = PackedProof.objects.filter(name=name).first()
+    if packed is None:
+        raise FileNotFoundError(name)
+    return ContentFile(packed.read(), name=os.path.basename(name))
+
+
+def iter_proof(name, packed=None, chunk_size=64 * 1024):
+    """
+    Yield the bytes of a stored proof in chunks without reading it whole: from its own file or,
+    once packed, from its monthly pack (pass packed to skip looking it up). Nothing is opened
+    until the first chunk is asked for.
+    """
+    storage = ProofBlob.storage()
+    if packed is None:
+        if storage.exists(name):
+            with storage.open(name, 'rb') as proof:
+                yield from proof.chunks(chunk_size)
+            return
+        packed = PackedProof.objects.filter(name=name).first()
+        if packed is None:
+            raise FileNotFoundError(name)
+    with storage.open(packed.pack, 'rb') as pack:
+        pack.seek(packed.offset)
+        remaining = packed.size
+        while remaining:
+            chunk = pack.read(min(chunk_size, remaining))
+            if not chunk:
+                raise ValueError(f'Paquete incompleto: {packed.pack}')
+            remaining -= len(chunk)
+            yield chunk
+
+
+def data_offset(pack, info):
+    """Offset of a member's bytes in an uncompressed ZIP, read from its local header"""
+    pack.seek(info.header_offset)
+    fields = LOCAL_HEADER.unpack(pack.read(LOCAL_HEADER.size))
+    name_length, extra_length = fields[-2], fields[-1]
+    return info.header_offset + LOCAL_HEADER.size + name_length + extra_length
+
+
+def month_candidates(start, end):
+    """
+    Proofs that can go into the pack of the month [start, end): used by a payment of that month,
+    by no later payment and by no proof still being compressed, and not packed yet
+    """
+    # One subquery per condition, so each is an index search rather than a scan of the payments
+    excluded = [
+        Payment.objects.filter(created_at__gte=end).values('proof_of_payment_file'),
+        ArchivedPayment.objects.filter(created_at__gte=end).values('proof_of_payment_file'),
+        Payment.objects.filter(proof_status=Payment.PROOF_PROCESSING).values('proof_of_payment_file'),
+        PackedProof.objects.values('name'),
+    ]
+    names = set()
+    for model in (Payment, ArchivedPayment):
+        queryset = model.objects.filter(created_at__gte=start, created_at__lt=end).exclude(proof_of_payment_file='')
+        for names_in_use in excluded:
+            queryset = queryset.exclude(proof_of_payment_file__in=names_in_use)
+        names.update(queryset.values_list('proof_of_payment_file', flat=True).distinct().order_by())
+    storage = ProofBlob.storage()
+    return sorted(name for name in names if storage.exists(name))
+
+
+def pack_month(month, names):
+    """
+    Write the given proofs into one uncompressed ZIP for month, verify every member against its CRC,
+    then index the members by offset and remove the loose files after commit.
+    Returns (pack name, packed bytes); the pack is only visible under its final name once complete.
+    """
+    storage = ProofBlob.storage()
+    pack_name = storage.get_available_name(f'{PackedProof.ROOT}/{month:%Y-%m}.zip')
+    pack_path = storage.path(pack_name)
+    os.makedirs(os.path.dirname(pack_path), exist_ok=True)
+    temporary_path = pack_path + '.tmp'
+
+    try:
+        # Proofs are already JPEG or PNG: storing them uncompressed keeps every member readable by offset
+        with zipfile.ZipFile(temporary_path, 'w', compression=zipfile.ZIP_STORED) as pack:
+            for name in names:
+                pack.write(storage.path(name), arcname=name)
+
+        entries = []
+        with zipfile.ZipFile(temporary_path) as archive, open(temporary_path, 'rb') as pack:
+            for info in archive.infolist():
+                offset = data_offset(pack, info)
+                pack.seek(offset)
+                if zlib.crc32(pack.read(info.file_size)) != info.CRC:
+                    raise ValueError(f'{info.filename} no coincide en el paquete')
+                entries.append(PackedProof(name=info.filename, pack=pack_name, offset=offset, size=info.file_size))
+        os.replace(temporary_path, pack_path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.unlink(temporary_path)
+        raise
+
+    def delete_loose_files():
+        for name in names:
+            storage.delete(name)
+
+    with transaction.atomic():
+        PackedProof.objects.bulk_create(entries)
+        transaction.on_commit(delete_loose_files)
+    return pack_name, sum(entry.size for entry in entries)
+
+
+def pack_closed_months(before):
+    """Pack the proofs of every closed month that ends before the given datetime; returns [(pack, files, bytes)]"""
+    packs = []
+    for month in MonthClose.objects.order_by('month').values_list('month', flat=True):
+        start, end = local_month_range(month.year, month.month)
+        if end > before:
+            break
+        names = month_candidates(start, end)
+        if names:
+            pack_name, size = pack_month(month, names)
+            packs.append((pack_name, len(names), size))
+    return packs
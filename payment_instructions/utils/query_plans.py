@@ -0,0 +1,56 @@
+import re
+
+from django.db import connection, models
+from django.utils import timezone
+
+from ..models import Payment, Specialist, local_month_range
+
+PAYMENT_TABLE = Payment._meta.db_table
+# Plan steps that read the whole payments table (even through an index) or sort its rows afterwards
+FULL_SCAN = re.compile(rf'^SCAN (TABLE )?{PAYMENT_TABLE}\b|TEMP B-TREE FOR (RIGHT PART OF )?ORDER BY')
+
+
+def hot_queries():
+    """
+    (label, callable) pairs running the payment queries made on every page view and month report.
+    Ids don't need to exist: the plan only depends on the shape of the query.
+    """
+    now = timezone.localtime()
+    start, _ = local_month_range(now.year, now.month)
+    return [
+        ('recipient month', lambda: Payment.objects.filter(
+            payment_recipient_id=0, created_at__gte=start
+        ).aggregate(total=models.Sum('amount'))),
+        ('specialist month', lambda: Specialist(pk=0).get_current_month_amount()),
+        # The operators' changelist: their own payments, newest first, with the admin's pk tiebreak
+        ('operator payments', lambda: list(
+            Payment.objects.filter(operator_user_id=0).order_by('-created_at', '-pk')[:100]
+        )),
+        ('monthly totals', lambda: Payment.get_monthly_totals(now.year, now.month)),
+    ]
+
+
+def explain(query, table=PAYMENT_TABLE):
+    """Run query and return the EXPLAIN QUERY PLAN lines of each statement it sends to table (payments by default)"""
+    statements = []
+
+    def record(execute, sql, params, many, context):
+        statements.append((sql, params))
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(record):
+        query()
+
+    plans = []
+    with connection.cursor() as cursor:
+        for sql, params in statements:
+            if table not in sql:
+                continue
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plans.append([row[-1] for row in cursor.fetchall()])
+    return plans
+
+
+def full_scans(plan):
+    """Steps of a query plan that scan or sort the whole payments table"""
+    return [step for step in plan if FULL_SCAN.search(step)]
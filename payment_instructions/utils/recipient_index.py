@@ -0,0 +1,104 @@
+import copy
+import threading
+
+from django.db import models
+
+from ..models import PaymentRecipient, CacheVersion, RecipientMonthlyBalance, month_start
+
+
+class RecipientAvailabilityIndex:
+    """
+    Per-worker snapshot of active recipients in priority order with their remaining capacity,
+    consumed by the allocation strategies in utils.allocation.
+    Every lookup reads, in one primary key query, the shared CacheVersion token and the latest
+    balance ledger update. A new token (recipient configuration changed, by any worker or from the
+    admin) rebuilds the snapshot; a newer ledger update only re-reads the balance rows changed since,
+    so payments don't throw the snapshot away. Writers are serialized (IMMEDIATE transactions), so
+    ledger rows commit in updated_at order and none is skipped.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._month = None
+        self._balances_seen = None
+        self._recipients = []
+
+    def invalidate(self):
+        """Drop the snapshot; the next lookup rebuilds it"""
+        with self._lock:
+            self._version = None
+            self._recipients = []
+
+    def _is_fresh(self, version):
+        return version is not None and version == self._version and self._month == month_start()
+
+    def _read_state(self):
+        """(configuration version, latest ledger update) in a single query"""
+        latest_balance = RecipientMonthlyBalance.objects.order_by('-updated_at').values('updated_at')[:1]
+        return CacheVersion.objects.filter(name=CacheVersion.RECIPIENTS).annotate(
+            balances_updated=models.Subquery(latest_balance)
+        ).values_list('version', 'balances_updated').first()
+
+    def _rebuild(self, version, balances_updated):
+        recipients = list(
+            PaymentRecipient.objects.with_capacity().filter(is_active=True).order_by('sort_key', 'name')
+        )
+        self._recipients = recipients
+        self._version = version
+        self._month = month_start()
+        self._balances_seen = balances_updated
+
+    def _apply_balances(self, balances_updated):
+        """Replace the balances of the recipients whose ledger rows changed since the last lookup"""
+        changed = RecipientMonthlyBalance.objects.filter(
+            updated_at__gt=self._balances_seen, updated_at__lte=balances_updated
+        ).values_list('payment_recipient_id', 'month', 'received', 'payment_recipient__lifetime_balance__received')
+        current_month = month_start()
+        month_received, total_received = {}, {}
+        for recipient_id, month, received, lifetime_received in changed:
+            # A change to an earlier month (an edited payment date) still moves the lifetime total
+            if month == current_month:
+                month_received[recipient_id] = received
+            total_received[recipient_id] = lifetime_received or 0
+
+        recipients = []
+        for recipient in self._recipients:
+            if recipient.pk in total_received:
+                # Copies, so lookups already holding the previous list never see a half-updated recipient
+                recipient = copy.copy(recipient)
+                recipient.total_received = total_received[recipient.pk]
+                if recipient.pk in month_received:
+                    recipient.month_received = month_received[recipient.pk]
+                    recipient.remaining = recipient.max_amount - recipient.month_received
+            recipients.append(recipient)
+        self._recipients = recipients
+        self._balances_seen = balances_updated
+
+    def get_recipients(self):
+        """Return the active recipients annotated by with_capacity(), or None when no fresh snapshot is available"""
+        state = self._read_state()
+        if state is None:
+            # Nothing has been written since the table was created: seed a token to build against
+            CacheVersion.objects.bump(CacheVersion.RECIPIENTS)
+            state = self._read_state()
+        version, balances_updated = state
+
+        if self._is_fresh(version) and balances_updated == self._balances_seen:
+            return self._recipients
+
+        # Another thread is refreshing; let this call use the database instead of waiting
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            stale = not self._is_fresh(version) or None in (self._balances_seen, balances_updated)
+            if stale or balances_updated < self._balances_seen:
+                self._rebuild(version, balances_updated)
+            elif balances_updated > self._balances_seen:
+                self._apply_balances(balances_updated)
+            return self._recipients
+        finally:
+            self._lock.release()
+
+
+recipient_index = RecipientAvailabilityIndex()
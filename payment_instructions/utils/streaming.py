@@ -0,0 +1,152 @@
+import csv
+import itertools
+import re
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+# Chunks handed to the response are at least this large, so tiny writes don't each become a chunk
+CHUNK_SIZE = 64 * 1024
+
+
+class StreamBuffer:
+    """
+    Write-only file object that keeps what is written until it is taken with pop(). It has no seek,
+    so zipfile writes archives to it in streaming mode (sizes go in data descriptors after each member).
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
+
+
+def stream_zip(members):
+    """
+    Yield a ZIP archive chunk by chunk without holding it in memory or on disk.
+    members is an iterable of (name, iterable of bytes, compress) tuples; each member's content
+    is consumed as it is written, so members can themselves be generated on the fly.
+    """
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, chunks, compress in members:
+            info = zipfile.ZipInfo(name, date_time=datetime.now().timetuple()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+            # Sizes aren't known up front: zip64 headers keep any member size valid for a few bytes each
+            with archive.open(info, 'w', force_zip64=True) as member:
+                for chunk in chunks:
+                    member.write(chunk)
+                    if buffer.size >= CHUNK_SIZE:
+                        yield buffer.pop()
+    yield buffer.pop()
+
+
+class Echo:
+    """File-like object whose write() returns the data, so csv.writer can produce lines for a generator"""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(header, rows):
+    """Yield a UTF-8 CSV (with BOM, so spreadsheets detect the encoding) in chunks of about CHUNK_SIZE bytes"""
+    writer = csv.writer(Echo())
+    lines = ['\ufeff' + writer.writerow(header)]
+    size = 0
+    for row in rows:
+        line = writer.writerow(row)
+        lines.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(lines).encode()
+            lines, size = [], 0
+    yield ''.join(lines).encode()
+
+
+XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+
+# Control characters XML 1.0 does not allow, even escaped
+XML_INVALID = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def xlsx_cell(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+    text = escape(XML_INVALID.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def xlsx_sheet(header, rows):
+    yield (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+    ).encode()
+    for row in itertools.chain([header], rows):
+        yield ('<row>' + ''.join(xlsx_cell(value) for value in row) + '</row>').encode()
+    yield b'</sheetData></worksheet>'
+
+
+def stream_xlsx(header, rows, sheet_name='Hoja1'):
+    """
+    Yield a one-sheet XLSX workbook chunk by chunk. Cells are written inline (numbers as numbers,
+    everything else as inline strings), so no shared string table has to be kept in memory.
+    """
+    return stream_zip([
+        ('[Content_Types].xml', [XLSX_CONTENT_TYPES.encode()], True),
+        ('_rels/.rels', [XLSX_ROOT_RELS.encode()], True),
+        ('xl/workbook.xml', [XLSX_WORKBOOK.format(name=escape(sheet_name)).encode()], True),
+        ('xl/_rels/workbook.xml.rels', [XLSX_WORKBOOK_RELS.encode()], True),
+        ('xl/worksheets/sheet1.xml', xlsx_sheet(header, rows), True),
+    ])
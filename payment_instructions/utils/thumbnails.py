@@ -0,0 +1,77 @@
+import hashlib
+import os
+from io import BytesIO
+
+import fitz
+from django.core.files.base import ContentFile
+from PIL import Image, features
+
+from .file_compression import FileCompressor, render_pdf_page
+from .proof_packs import open_proof
+from ..models import Payment
+
+THUMBNAIL_ROOT = 'comprobantes/thumbs'
+THUMBNAIL_SIZE = (240, 320)
+THUMBNAIL_DPI = 36  # Enough for a 240px wide first page of an A4 or letter PDF
+THUMBNAIL_FORMAT = 'WEBP' if features.check('webp') else 'JPEG'
+THUMBNAIL_QUALITY = 70
+
+
+def get_storage():
+    return Payment._meta.get_field('proof_of_payment_file').storage
+
+
+def thumbnail_name(name):
+    """Storage name of the thumbnail of a proof file; changes whenever the proof file changes"""
+    extension = '.webp' if THUMBNAIL_FORMAT == 'WEBP' else '.jpg'
+    return f'{THUMBNAIL_ROOT}/{os.path.splitext(name)[0]}{extension}'
+
+
+def thumbnail_version(name):
+    """Short token for thumbnail URLs, so browsers can cache them for as long as the proof doesn't change"""
+    return hashlib.sha256(name.encode()).hexdigest()[:12]
+
+
+def render_thumbnail(source):
+    """Thumbnail image of the proof file at path source, or in the open file source; PDFs get their first page"""
+    if isinstance(source, str):
+        with open(source, 'rb') as proof:
+            return render_thumbnail(proof)
+
+    is_pdf = source.read(5) == b'%PDF-'
+    source.seek(0)
+    if is_pdf:
+        with fitz.open(stream=source.read(), filetype='pdf') as doc:
+            mode, size, samples = render_pdf_page(doc, 0, THUMBNAIL_DPI)
+        img = Image.frombytes(mode, size, samples)
+        img.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+        return img
+
+    # Same guarded decode as compression: pixel limit, reduced-scale decode and the source closed afterwards
+    return FileCompressor.load_image(source, box=THUMBNAIL_SIZE)
+
+
+def generate_thumbnail(name, force=False):
+    """Create the thumbnail of a stored proof unless it already exists; returns the thumbnail name"""
+    storage = get_storage()
+    thumb_name = thumbnail_name(name)
+    if storage.exists(thumb_name):
+        if not force:
+            return thumb_name
+        storage.delete(thumb_name)
+
+    output = BytesIO()
+    with open_proof(name) as proof:
+        render_thumbnail(proof).save(output, format=THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY)
+    saved = storage.save(thumb_name, ContentFile(output.getvalue()))
+    if saved != thumb_name:
+        # Generated concurrently by another request or worker
+        storage.delete(saved)
+    return thumb_name
+
+
+def delete_thumbnail(name):
+    storage = get_storage()
+    thumb_name = thumbnail_name(name)
+    if storage.exists(thumb_name):
+        storage.delete(thumb_name)
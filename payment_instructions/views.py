@@ -6,9 +6,17 @@ from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
 import json
 
-from payment_instructions.utils.file_compression import FileCompressor
+from PIL import Image
+
 from .utils.utils import validate_payment_amount
-from .models import Payment, PaymentRecipient, Specialist
+from .upload_handlers import (
+    MAX_PROOF_SIZE, PROOF_TOO_LARGE, PROOF_INVALID_TYPE, PROOF_TOO_MANY_PIXELS, sniff_content_type,
+)
+from .utils.file_compression import FileCompressor
+from .utils.allocation import plan_batch, plan_split
+from .models import Payment, PaymentRecipient, Specialist, CapacityExceeded
+
+MAX_BATCH_AMOUNTS = 200
 
 
 def operator_login(request):
@@ -45,6 +53,32 @@ def operator_dashboard(request):
     })
 
 
+def validate_proof_file(file_obj):
+    """Return an error message if the uploaded proof is too large or of a disallowed type"""
+    if file_obj.size > MAX_PROOF_SIZE:
+        return PROOF_TOO_LARGE
+
+    # ProofUploadHandler already sets the type from the file contents; sniff again for other handlers
+    file_obj.seek(0)
+    content_type = sniff_content_type(file_obj.read(16))
+    file_obj.seek(0)
+    if content_type is None:
+        return PROOF_INVALID_TYPE
+    file_obj.content_type = content_type
+
+    # Refuse decompression bombs from the header, before anything decodes the pixels
+    if content_type.startswith('image/'):
+        try:
+            width, height = FileCompressor.read_dimensions(file_obj)
+        except Image.DecompressionBombError:
+            return PROOF_TOO_MANY_PIXELS
+        except Exception:
+            return PROOF_INVALID_TYPE
+        if width * height > FileCompressor.MAX_PIXELS:
+            return PROOF_TOO_MANY_PIXELS
+    return None
+
+
 @login_required
 @require_http_methods(["POST"])
 def search_alias(request):
@@ -59,6 +93,20 @@ def search_alias(request):
         # Validate and get suggested recipient
         is_valid, message, recipient = validate_payment_amount(amount)
         
+        if not is_valid and recipient is None and data.get('allow_split'):
+            # No single recipient can take it: offer a multi-leg plan instead
+            legs = plan_split(int(str(amount)))
+            if legs:
+                return JsonResponse({
+                    'success': True,
+                    'split': True,
+                    'amount': str(amount),
+                    'legs': [
+                        {'alias': leg_recipient.alias, 'name': leg_recipient.name, 'amount': str(leg_amount)}
+                        for leg_recipient, leg_amount in legs
+                    ]
+                })
+        
         if not is_valid:
             return JsonResponse({'error': message}, status=400)
         
@@ -78,6 +126,49 @@ def search_alias(request):
         return JsonResponse({'error': 'Error interno del servidor'}, status=500)
 
 
+@login_required
+@require_http_methods(["POST"])
+def search_alias_batch(request):
+    """AJAX endpoint to suggest one alias per amount for a list of amounts"""
+    try:
+        data = json.loads(request.body)
+        amounts = data.get('amounts')
+        
+        if not amounts or not isinstance(amounts, list):
+            return JsonResponse({'error': 'Lista de montos requerida'}, status=400)
+        
+        if len(amounts) > MAX_BATCH_AMOUNTS:
+            return JsonResponse({'error': f'Máximo {MAX_BATCH_AMOUNTS} montos por solicitud'}, status=400)
+        
+        parsed_amounts = [int(str(amount)) for amount in amounts]
+        if any(amount <= 0 for amount in parsed_amounts):
+            return JsonResponse({'error': 'El monto debe ser mayor a cero'}, status=400)
+        
+        results = []
+        for amount, recipient in zip(parsed_amounts, plan_batch(parsed_amounts)):
+            if recipient:
+                results.append({
+                    'amount': str(amount),
+                    'alias': recipient.alias,
+                    'name': recipient.name,
+                })
+            else:
+                results.append({
+                    'amount': str(amount),
+                    'error': 'No hay destinatarios disponibles para este monto',
+                })
+        
+        return JsonResponse({
+            'success': all('alias' in result for result in results),
+            'results': results,
+        })
+            
+    except (ValueError, TypeError, json.JSONDecodeError) as e:
+        return JsonResponse({'error': 'Formato de monto inválido'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': 'Error interno del servidor'}, status=500)
+
+
 @login_required
 @require_http_methods(["POST"])
 def create_payment(request):
@@ -95,6 +186,9 @@ def create_payment(request):
         if not specialist_id:
             return JsonResponse({'error': 'Especialista es requerido'}, status=400)
 
+        upload_error = getattr(request, 'proof_upload_error', None)
+        if upload_error:
+            return JsonResponse({'error': upload_error}, status=400)
         if not file_obj:
             return JsonResponse({'error': 'El comprobante es requerido.'}, status=400)
         
@@ -115,30 +209,24 @@ def create_payment(request):
         if not recipient.can_receive_amount(amount_decimal):
             return JsonResponse({'error': 'El destinatario no puede recibir este monto'}, status=400)
         
-        # Validate and compress file
-        # 5MB maximum
-        max_bytes = 5 * 1024 * 1024
-        if file_obj.size > max_bytes:
-            return JsonResponse({'error': 'El archivo es demasiado grande. Máximo 5MB.'}, status=400)
-
-        allowed_types = {
-            'image/jpeg', 'image/jpg', 'image/png', 'image/gif', 'application/pdf'
-        }
-
-        if file_obj.content_type not in allowed_types:
-            return JsonResponse({'error': 'Tipo de archivo no válido. Solo imágenes o PDF.'}, status=400)
-        
-        # Compress the file
-        compressed_file = FileCompressor.compress_file(file_obj)
+        # Validate file
+        file_error = validate_proof_file(file_obj)
+        if file_error:
+            return JsonResponse({'error': file_error}, status=400)
         
-        # Create payment with compressed file
-        payment = Payment.objects.create(
-            amount=amount_decimal,
-            payment_recipient=recipient,
-            specialist=specialist,
-            operator_user=request.user,
-            proof_of_payment_file=compressed_file  # Use compressed file
-        )
+        # Create payment with the original file, rechecking capacity atomically;
+        # the compression worker replaces the file once it is compressed
+        try:
+            payment = Payment.objects.allocate(
+                amount=amount_decimal,
+                payment_recipient=recipient,
+                specialist=specialist,
+                operator_user=request.user,
+                proof_of_payment_file=file_obj,
+                compress_proof=True
+            )
+        except CapacityExceeded:
+            return JsonResponse({'error': 'El destinatario no puede recibir este monto'}, status=400)
         
         return JsonResponse({
             'success': True,
@@ -149,4 +237,71 @@ def create_payment(request):
     except (ValueError, TypeError, json.JSONDecodeError) as e:
         return JsonResponse({'error': f'No se pudo registrar el pago. Error: {str(e)}'}, status=400)
     except Exception as e:
-        return JsonResponse({'error': f'Error interno del servidor: {str(e)}'}, status=500)
\ No newline at end of file
+        return JsonResponse({'error': f'Error interno del servidor: {str(e)}'}, status=500)
+
+
+@login_required
+@require_http_methods(["POST"])
+def create_split_payment(request):
+    """Create all legs of a split payment atomically, sharing one proof"""
+    try:
+        legs = json.loads(request.POST.get('legs') or '[]')
+        specialist_id = request.POST.get('specialist_id')
+        file_obj = request.FILES.get('proof_of_payment_file')
+        
+        if not legs or not isinstance(legs, list):
+            return JsonResponse({'error': 'Lista de pagos requerida'}, status=400)
+        if not specialist_id:
+            return JsonResponse({'error': 'Especialista es requerido'}, status=400)
+        upload_error = getattr(request, 'proof_upload_error', None)
+        if upload_error:
+            return JsonResponse({'error': upload_error}, status=400)
+        if not file_obj:
+            return JsonResponse({'error': 'El comprobante es requerido.'}, status=400)
+        
+        amounts = [int(str(leg['amount'])) for leg in legs]
+        aliases = [leg['alias'] for leg in legs]
+        if any(amount <= 0 for amount in amounts):
+            return JsonResponse({'error': 'El monto debe ser mayor a cero'}, status=400)
+        if len(set(aliases)) != len(aliases):
+            return JsonResponse({'error': 'Cada destinatario puede aparecer una sola vez'}, status=400)
+        
+        recipients = PaymentRecipient.objects.in_bulk(aliases, field_name='alias')
+        if len(recipients) != len(aliases) or not all(recipient.is_active for recipient in recipients.values()):
+            return JsonResponse({'error': 'Destinatario no encontrado'}, status=400)
+        
+        try:
+            specialist = Specialist.objects.get(pk=specialist_id, is_active=True)
+        except Specialist.DoesNotExist:
+            return JsonResponse({'error': 'Especialista no encontrado'}, status=400)
+        
+        file_error = validate_proof_file(file_obj)
+        if file_error:
+            return JsonResponse({'error': file_error}, status=400)
+        
+        try:
+            payments = Payment.objects.allocate_many([
+                {
+                    'amount': amount,
+                    'payment_recipient': recipients[alias],
+                    'specialist': specialist,
+                    'operator_user': request.user,
+                    'proof_of_payment_file': file_obj,
+                    'notes': f'Pago dividido: parte {position} de {len(legs)}',
+                }
+                for position, (alias, amount) in enumerate(zip(aliases, amounts), start=1)
+            ], compress_proof=True)
+        except CapacityExceeded as e:
+            return JsonResponse({'error': ' '.join(e.messages)}, status=400)
+        
+        payment_ids = [payment.id for payment in payments]
+        return JsonResponse({
+            'success': True,
+            'payment_ids': payment_ids,
+            'message': f'Pago dividido creado exitosamente. (ids: {", ".join(map(str, payment_ids))})'
+        })
+        
+    except (ValueError, TypeError, KeyError, json.JSONDecodeError) as e:
+        return JsonResponse({'error': f'No se pudo registrar el pago. Error: {str(e)}'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': f'Error interno del servidor: {str(e)}'}, status=500)
@@ -33,6 +33,13 @@ ALLOWED_HOSTS = [
 # Maximum upload size in bytes
 FILE_UPLOAD_MAX_MEMORY_SIZE = 5 * 1024 * 1024  # 5 MB
 
+# Proofs of payment are checked while received and spooled to disk instead of memory
+FILE_UPLOAD_HANDLERS = [
+    'payment_instructions.upload_handlers.ProofUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -54,6 +61,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'payment_instructions.middleware.MonthCloseMiddleware',
 ]
 
 ROOT_URLCONF = 'payment_system.urls'
@@ -83,9 +91,34 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db', 'db.sqlite3'),
+        # Each gunicorn worker keeps its connection (and its page cache) across requests
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Write transactions take the write lock when they begin, so a concurrent writer waits on
+            # busy_timeout instead of failing with "database is locked" when its read lock can't be upgraded
+            'transaction_mode': 'IMMEDIATE',
+        },
+        # File-backed test database so concurrency tests exercise real SQLite locking
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
     }
 }
 
+# Applied to every new SQLite connection by payment_instructions.signals.configure_sqlite
+SQLITE_PRAGMAS = {
+    # Readers don't block the writer and the writer doesn't block readers
+    'journal_mode': 'WAL',
+    # Milliseconds a connection waits for the write lock before giving up
+    'busy_timeout': 10000,
+    # Safe with WAL: a power loss can only drop the last commits, never corrupt the database
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    # Negative values are KiB: 32 MB of page cache per connection
+    'cache_size': -32000,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -136,6 +169,9 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Custom User Model
 AUTH_USER_MODEL = 'payment_instructions.User'
 
+# Recipient selection strategy: priority_first, best_fit, worst_fit or weighted_round_robin
+PAYMENT_ALLOCATION_STRATEGY = 'priority_first'
+
 # Login/Logout URLs
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/'